@@ -1,6 +1,13 @@
+import argparse
+import random
+import resource
+import tracemalloc
+from collections import Counter
+
 import mysql.connector
+import numpy as np
 import pandas as pd
-from wordcloud import WordCloud, STOPWORDS
+from wordcloud import WordCloud
 import boto3
 from io import BytesIO
 from PIL import Image
@@ -12,6 +19,17 @@ import os
 
 load_dotenv()
 
+from amazon.db import get_db_connection
+from amazon.rollups import rebuild_rollup_rows
+from amazon.search_index import update_search_index, delete_review_postings
+from amazon.term_frequencies import update_term_frequencies, subtract_review_terms, fetch_term_frequencies
+from amazon.export import iter_review_batches
+from amazon.explorer import REVIEW_COLUMNS
+from amazon.sentiment_scores import score_new_reviews, prune_review_scores
+from amazon.versions import bump_review_version
+from amazon.near_duplicates import SIGN_BATCH_SIZE, mark_near_duplicates, prune_near_duplicate_index
+from amazon.aspects import mine_aspects
+
 # for sentiment model
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.pipeline import Pipeline
@@ -19,29 +37,25 @@ from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.linear_model import LogisticRegression
 import nltk
 
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
+from amazon.text import preprocess_text
 
 # Download required NLTK resources
 nltk.download('punkt')
 nltk.download('stopwords')
 nltk.download('wordnet')
+nltk.download('averaged_perceptron_tagger')
 
+# bounded memory sentiment model: reviews kept per sentiment, and the vocabulary limits
+SENTIMENT_SAMPLE_SIZE = int(os.getenv("SENTIMENT_SAMPLE_SIZE", 25000))
+SENTIMENT_MIN_DF = int(os.getenv("SENTIMENT_MIN_DF", 2))
+SENTIMENT_MAX_FEATURES = int(os.getenv("SENTIMENT_MAX_FEATURES", 20000))
 
 
-def remove_duplicate_reviews(asin):
 
-    # Connect to mySQL db
-    db_config = {
-        'user': os.getenv("MYSQL_USER"),
-        'password': os.getenv("MYSQL_PASSWORD"),
-        'host': os.getenv("MYSQL_HOST"),
-        'port': 3306,
-        'database': os.getenv("MSQL_DATABASE"),
-    }
+def remove_duplicate_reviews(asin, near_duplicates=True):
 
-    conn = mysql.connector.connect(**db_config)
+    # Connect to mySQL db
+    conn = get_db_connection()
     asin_value = asin
 
     # # Create a temporary table for duplicate texts
@@ -63,32 +77,67 @@ def remove_duplicate_reviews(asin):
     remove_duplicates_query = """DELETE S1 FROM reviews AS S1  
                                 INNER JOIN reviews AS S2   
                                 WHERE S1.id < S2.id AND S1.text = S2.text 
-                                AND S1.asin = S2.asin; """
+                                AND S1.asin = S2.asin AND S1.asin = %s; """
 
 
     cursor = conn.cursor()
 
-    cursor.execute(remove_duplicates_query)
-        
-    # Commit the changes to the database
+    # the duplicates that were already counted in the term frequencies have to come back out,
+    # marked near-duplicates had theirs taken out when they were marked, or were never counted
+    cursor.execute("""SELECT DISTINCT S1.id, S1.text, S1.rating, S1.duplicate_of FROM reviews AS S1
+                      INNER JOIN reviews AS S2
+                      WHERE S1.id < S2.id AND S1.text = S2.text
+                      AND S1.asin = S2.asin AND S1.asin = %s""", (asin_value,))
+    duplicates = cursor.fetchall()
+    subtract_review_terms(cursor, asin_value, [(review_id, text, rating)
+                                               for review_id, text, rating, duplicate_of in duplicates
+                                               if duplicate_of is None])
+    deleted_ids = [review_id for review_id, _, _, _ in duplicates]
+    delete_review_postings(cursor, asin_value, deleted_ids)
+
+    # near-duplicates of a review that's deleted point at its newest copy, which has the same text
+    cursor.execute("""UPDATE reviews AS D
+                      INNER JOIN (SELECT S1.id AS old_id, MAX(S2.id) AS new_id FROM reviews AS S1
+                                  INNER JOIN reviews AS S2
+                                  WHERE S1.id < S2.id AND S1.text = S2.text
+                                  AND S1.asin = S2.asin AND S1.asin = %s
+                                  GROUP BY S1.id) AS C ON D.duplicate_of = C.old_id
+                      SET D.duplicate_of = C.new_id""", (asin_value,))
+
+    cursor.execute(remove_duplicates_query, (asin_value,))
+    deleted = cursor.rowcount
+    prune_near_duplicate_index(cursor, deleted_ids)
+
+    # reviews that are the same up to punctuation or a few words are kept but
+    # marked, each points at an older review it is similar to and the analysis
+    # leaves it out
+    marked_ids = mark_near_duplicates(cursor, asin_value) if near_duplicates else []
+    for start in range(0, len(marked_ids), SIGN_BATCH_SIZE):
+        chunk = marked_ids[start:start + SIGN_BATCH_SIZE]
+        cursor.execute(f"SELECT id, text, rating FROM reviews WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        subtract_review_terms(cursor, asin_value, cursor.fetchall())
+        delete_review_postings(cursor, asin_value, chunk)
+
+    # readers of this asin's reviews need to know some were deleted or marked
+    if deleted > 0 or marked_ids:
+        bump_review_version(cursor, asin_value)
+        prune_review_scores(cursor, asin_value, deleted_ids + marked_ids)
+
+    # the deleted and marked duplicates were counted in the rollups when they were inserted
+    rebuild_rollup_rows(cursor, [asin_value])
+
+    # everything above is DML, so it's committed as one transaction
     conn.commit()
 
     # Close the cursor
     cursor.close()
+    conn.close()
 
 
 def fetch_product(asin):
 
     # Connect to mySQL db
-    db_config = {
-        'user': os.getenv("MYSQL_USER"),
-        'password': os.getenv("MYSQL_PASSWORD"),
-        'host': os.getenv("MYSQL_HOST"),
-        'port': 3306,
-        'database': os.getenv("MSQL_DATABASE"),
-    }
-
-    conn = mysql.connector.connect(**db_config)
+    conn = get_db_connection()
 
     # Select the product from the db
     asin_value = asin
@@ -104,12 +153,42 @@ def fetch_product(asin):
     return df
 
 
-def create_and_upload_wordclouds(df, asin):
-    # Create stopword list:
-    stopwords = set(STOPWORDS)
+def count_review_terms(asin):
+    # add the reviews scraped since the last run to the term frequencies the wordclouds are made from
+    conn = get_db_connection()
+    counted = update_term_frequencies(conn, asin)
+    conn.close()
+
+    return counted
 
 
+def index_reviews(asin):
+    # add the reviews scraped since the last run to the keyword search index
+    conn = get_db_connection()
+    indexed = update_search_index(conn, asin)
+    conn.close()
 
+    return indexed
+
+
+def record_analysis_run(asin):
+    # lets the dashboard know the wordclouds and important words for this asin changed
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("REPLACE INTO analysis_runs (asin, finished_at) VALUES (%s, NOW(6))", (asin,))
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+
+def create_and_upload_wordclouds(asin):
+    # the wordclouds are made from the stored term frequencies, see count_review_terms
+    conn = get_db_connection()
+    positive_frequencies = fetch_term_frequencies(conn, asin, 'positive')
+    negative_frequencies = fetch_term_frequencies(conn, asin, 'negative')
+    conn.close()
 
     # Specify the S3 bucket name
     bucket_name = os.getenv("AWS_BUCKET_NAME")
@@ -117,15 +196,11 @@ def create_and_upload_wordclouds(df, asin):
     s3 = boto3.resource('s3', region_name=os.getenv("AWS_BUCKET_REGION"))
 
     # Create Positive Wordcloud
-    positive_reviews = df[df["rating"] > 3]
-    print(len(positive_reviews))
-    positive_reviews_text = " ".join(review for review in positive_reviews["text"])
-
     # If there are positive reviews - create and upload wordcloud
-    if len(positive_reviews) > 0:
+    if len(positive_frequencies) > 0:
         print("started_positive wordcloud")
         # Create and generate a word cloud image:
-        pos_wordcloud = WordCloud(stopwords=stopwords, background_color="white", width=800, height=600).generate(positive_reviews_text)
+        pos_wordcloud = WordCloud(background_color="white", width=800, height=600).generate_from_frequencies(positive_frequencies)
 
         pos_image_key = f'positive_word_cloud_{asin}.png'
 
@@ -137,13 +212,11 @@ def create_and_upload_wordclouds(df, asin):
 
 
     # Create Negative Wordcloud
-    neg_reviews = df[df["rating"] <= 3]
-    neg_reviews_text = " ".join(review for review in neg_reviews["text"])
 
     # If there are negative reviews - create and upload wordcloud
-    if len(neg_reviews) > 0:
+    if len(negative_frequencies) > 0:
         # Create and generate a word cloud image:
-        neg_wordcloud = WordCloud(stopwords=stopwords, background_color="white", width=800, height=600, colormap="magma").generate(neg_reviews_text)
+        neg_wordcloud = WordCloud(background_color="white", width=800, height=600, colormap="magma").generate_from_frequencies(negative_frequencies)
 
         neg_image_key = f'negative_word_cloud_{asin}.png'
 
@@ -163,66 +236,50 @@ def image_to_byte_array(image: Image, format: str = 'png'):
 
     return result
 
-# Define the preprocessing functions
-def preprocess_text(text):
-    # Convert to lowercase
-    text = text.lower()
-
-    # Tokenize the text
-    tokens = word_tokenize(text)
-
-    # Remove stop words
-    stop_words = set(stopwords.words('english'))
-    tokens = [token for token in tokens if token not in stop_words]
-
-    # Lemmatize the tokens
-    lemmatizer = WordNetLemmatizer()
-    tokens = [lemmatizer.lemmatize(token) for token in tokens]
-
-    # Join tokens back to a string
-    preprocessed_text = ' '.join(tokens)
-
-    return preprocessed_text
-
-## function to create Logistic Regression sentiment analysis model and upload important words to S3
-def create_and_upload_sentiment_model(df, asin):
-
-    # Impute positive or negative based on the 'rating' column
-    df['sentiment'] = df['rating'].apply(lambda x: 'positive' if x >= 4 else 'negative')
+## function to fit the Logistic Regression sentiment analysis model
+def fit_sentiment_pipeline(texts, sentiments, min_df=1, max_features=None, sample_weight=None):
 
     # Define the pipeline
     pipeline = Pipeline([
-        ('preprocess', CountVectorizer(preprocessor=preprocess_text)),
+        ('preprocess', CountVectorizer(preprocessor=preprocess_text, min_df=min_df, max_features=max_features)),
         ('tfidf', TfidfTransformer()),
         ('classifier', LogisticRegression())
     ])
 
-    # Separate the features (preprocessed text) and target variable (sentiment)
-    X = df['text']
-    y = df['sentiment']
-
-    # Train the pipeline
-    pipeline.fit(X, y)
+    # Train the pipeline, the weights of a sample are scaled to average 1 so the
+    # regularization is as strong as without them
+    if sample_weight is None:
+        pipeline.fit(texts, sentiments)
+    else:
+        sample_weight = np.asarray(sample_weight, dtype=float)
+        pipeline.fit(texts, sentiments, classifier__sample_weight=sample_weight / sample_weight.mean())
     print("fitted sentiment model")
 
+    return pipeline
+
+
+## function to get the most important words of a fitted sentiment model
+def top_coefficients(pipeline, top=15):
+
     # Get the feature names from the CountVectorizer
     feature_names = pipeline.named_steps['preprocess'].get_feature_names_out()
 
     # Get the coefficients from the trained LogisticRegression classifier
     coefficients = pipeline.named_steps['classifier'].coef_[0]
 
-    # Create a DataFrame with feature names and their corresponding coefficients
-    coef_df = pd.DataFrame({'feature': feature_names, 'coefficient': coefficients})
+    # pick the top words by absolute coefficient without sorting the whole vocabulary
+    top = min(top, len(coefficients))
+    top_indices = np.argpartition(-np.abs(coefficients), top - 1)[:top]
+    top_indices = top_indices[np.argsort(-np.abs(coefficients[top_indices]))]
 
-    # Sort the DataFrame by the absolute value of coefficients
-    sorted_coef_df = coef_df.reindex(coef_df['coefficient'].abs().sort_values(ascending=False).index)
+    return pd.DataFrame({'feature': feature_names[top_indices], 'coefficient': coefficients[top_indices]},
+                        index=top_indices)
 
 
-    # Select the top 15 words with coefficients
-    top_15_words_with_coefs = sorted_coef_df.head(15)
+def upload_important_words(top_words_with_coefs, asin):
 
     # convert to csv string to put in s3 bucket
-    important_words_csv = top_15_words_with_coefs.to_csv()
+    important_words_csv = top_words_with_coefs.to_csv()
 
 
     # Upload to s3 bucket
@@ -239,8 +296,179 @@ def create_and_upload_sentiment_model(df, asin):
     print("Done")
 
 
-if __name__ == "__main__":
+## function to create Logistic Regression sentiment analysis model and upload important words to S3
+def create_and_upload_sentiment_model(df, asin):
+
+    # Impute positive or negative based on the 'rating' column
+    df['sentiment'] = df['rating'].apply(sentiment_label)
+
+    pipeline = fit_sentiment_pipeline(df['text'], df['sentiment'])
+
+    # Select the top 15 words with coefficients
+    top_15_words_with_coefs = top_coefficients(pipeline)
+
+    upload_important_words(top_15_words_with_coefs, asin)
+    print(f"Scored {score_reviews(asin, pipeline)} new reviews")
+
+
+def sentiment_label(rating):
+    return 'positive' if rating >= 4 else 'negative'
+
+
+def sample_reviews(asin, sample_size=SENTIMENT_SAMPLE_SIZE, seed=0):
+    # streams the reviews of asin and keeps a uniform random sample of up to
+    # sample_size review texts per sentiment (reservoir sampling), so memory use
+    # depends on sample_size instead of how many reviews the product has
+    rng = random.Random(seed)
+    reservoirs = {'positive': [], 'negative': []}
+    seen = Counter()
+
+    text_index = REVIEW_COLUMNS.index('text')
+    rating_index = REVIEW_COLUMNS.index('rating')
+
+    conn = get_db_connection()
+    try:
+        for rows in iter_review_batches(conn, [asin], exclude_duplicates=True):
+            for row in rows:
+                sentiment = sentiment_label(row[rating_index])
+                seen[sentiment] += 1
+                reservoir = reservoirs[sentiment]
+
+                # the n-th review replaces a random one with probability sample_size / n
+                if len(reservoir) < sample_size:
+                    reservoir.append(row[text_index])
+                else:
+                    replace = rng.randrange(seen[sentiment])
+                    if replace < sample_size:
+                        reservoir[replace] = row[text_index]
+    finally:
+        conn.close()
+
+    return reservoirs, seen
+
+
+def sample_weights(reservoirs, seen):
+    # how many reviews of its sentiment each sampled review stands for
+    return {sentiment: seen[sentiment] / len(texts) if texts else 0.0
+            for sentiment, texts in reservoirs.items()}
+
+
+def sample_training_set(reservoirs, seen):
+    # texts, sentiments and weights of a sample_reviews sample. Each sentiment is capped
+    # separately, so a review is weighted by how many reviews of its sentiment it stands
+    # for, which keeps the share of positive reviews the same as the product's
+    texts, sentiments, weights = [], [], []
+    for sentiment, weight in sample_weights(reservoirs, seen).items():
+        texts += reservoirs[sentiment]
+        sentiments += [sentiment] * len(reservoirs[sentiment])
+        weights += [weight] * len(reservoirs[sentiment])
+    return texts, sentiments, weights
+
+
+## bounded memory version of create_and_upload_sentiment_model for products with a lot of reviews
+def create_and_upload_sentiment_model_sampled(asin, sample_size=SENTIMENT_SAMPLE_SIZE, min_df=SENTIMENT_MIN_DF,
+                                              max_features=SENTIMENT_MAX_FEATURES, trace_memory=False, sample=None):
+    # sample is what sample_reviews returned, when the caller already has it
+    # tracemalloc slows python code down a lot, so it's only on when asked for
+    if trace_memory:
+        tracemalloc.start()
+
+    reservoirs, seen = sample or sample_reviews(asin, sample_size)
+    if not reservoirs['positive'] or not reservoirs['negative']:
+        print("Only one class of sentiment for this products model - all positive or all negative so I can't make a model")
+        if trace_memory:
+            tracemalloc.stop()
+        return None
+
+    # weighted so the scores stored by score_reviews are probabilities for the product's reviews
+    texts, sentiments, weights = sample_training_set(reservoirs, seen)
+    pipeline = fit_sentiment_pipeline(texts, sentiments, min_df=min_df, max_features=max_features,
+                                      sample_weight=weights)
+    top_15_words_with_coefs = top_coefficients(pipeline)
+
+    print(f"Trained on {len(texts)} of {sum(seen.values())} reviews "
+          f"({len(reservoirs['positive'])} positive, {len(reservoirs['negative'])} negative)")
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Python memory high-water mark: {peak / 2 ** 20:.1f} MiB")
+    # ru_maxrss is in KiB on linux
+    print(f"Process memory high-water mark: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:.1f} MiB")
+
+    upload_important_words(top_15_words_with_coefs, asin)
+    print(f"Scored {score_reviews(asin, pipeline)} new reviews")
+    return top_15_words_with_coefs
+
+
+def upload_aspects(aspects, asin):
+    # stored next to the important words so the dashboard caches them the same way
+    bucket_name = os.getenv("AWS_BUCKET_NAME")
+    s3 = boto3.resource('s3', region_name=os.getenv("AWS_BUCKET_REGION"))
+    s3.Object(bucket_name, f'aspects_{asin}.csv').put(Body=aspects.to_csv(index=False))
 
-    asin="B01GGKYKQM"
-    product_df = fetch_product(asin=asin)
-    create_and_upload_sentiment_model(product_df, asin=asin)
\ No newline at end of file
+
+## function to find the aspects reviewers mention most and how positive they are about each
+def create_and_upload_aspects(asin, sample_size=SENTIMENT_SAMPLE_SIZE, sample=None):
+    reservoirs, seen = sample or sample_reviews(asin, sample_size)
+    texts, sentiments, weights = sample_training_set(reservoirs, seen)
+
+    aspects = mine_aspects(texts, sentiments, weights)
+    upload_aspects(aspects, asin)
+    print(f"Found {len(aspects)} aspects in {len(texts)} reviews")
+    return aspects
+
+
+def score_reviews(asin, pipeline):
+    # store the predicted sentiment of the reviews scraped since the last run
+    conn = get_db_connection()
+    scored = score_new_reviews(conn, asin, pipeline)
+    conn.close()
+
+    return scored
+
+
+def compare_with_full_fit(asin, sample_size=SENTIMENT_SAMPLE_SIZE, min_df=SENTIMENT_MIN_DF,
+                          max_features=SENTIMENT_MAX_FEATURES):
+    # how many of the sampled top 15 words the model trained on every review also has in its
+    # top 15, and whether their coefficients have the same sign. Loads every review, so
+    # it's only for checking sample sizes by hand
+    reservoirs, seen = sample_reviews(asin, sample_size)
+    texts, sentiments, weights = sample_training_set(reservoirs, seen)
+    sampled = top_coefficients(fit_sentiment_pipeline(texts, sentiments, min_df=min_df, max_features=max_features,
+                                                      sample_weight=weights))
+
+    df = fetch_product(asin=asin)
+    full = top_coefficients(fit_sentiment_pipeline(df['text'], df['rating'].apply(sentiment_label)))
+
+    sampled_signs = dict(zip(sampled['feature'], np.sign(sampled['coefficient'])))
+    full_signs = dict(zip(full['feature'], np.sign(full['coefficient'])))
+    shared = set(sampled_signs) & set(full_signs)
+
+    return {
+        "reviews": len(df),
+        "sampled": sum(len(texts) for texts in reservoirs.values()),
+        "top_overlap": len(shared) / max(len(full_signs), 1),
+        "sign_agreement": sum(sampled_signs[word] == full_signs[word] for word in shared) / max(len(shared), 1),
+        "sampled_only": sorted(set(sampled_signs) - shared),
+        "full_only": sorted(set(full_signs) - shared),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('asin', nargs='?', default="B01GGKYKQM")
+    parser.add_argument('--sample-size', type=int, default=SENTIMENT_SAMPLE_SIZE, help='reviews kept per sentiment')
+    parser.add_argument('--full', action='store_true', help='train on every review instead of a sample')
+    parser.add_argument('--compare', action='store_true', help='report how the sampled top 15 words compare with the full fit')
+    parser.add_argument('--aspects', action='store_true', help='mine the aspects of the product instead')
+    args = parser.parse_args()
+
+    if args.aspects:
+        print(create_and_upload_aspects(args.asin, args.sample_size))
+    elif args.compare:
+        print(compare_with_full_fit(args.asin, args.sample_size))
+    elif args.full:
+        product_df = fetch_product(asin=args.asin)
+        create_and_upload_sentiment_model(product_df, asin=args.asin)
+    else:
+        create_and_upload_sentiment_model_sampled(args.asin, args.sample_size, trace_memory=True)
@@ -0,0 +1,97 @@
+import glob
+import json
+import os
+import time
+import zlib
+
+
+def archive_key(meta, url):
+    # review pages are stored by asin/sort/page, anything else by url
+    if meta.get('asin') and 'sort' in meta and 'page' in meta:
+        return f"{meta['asin']}/{meta['sort']}/{meta['page']}"
+    return url
+
+
+class PageArchive:
+    # Append-only archive of raw pages.
+    #
+    # Every crawl appends zlib compressed page bodies to its own segment file
+    # (segment-<time>-<pid>.seg) and one json line per page to a matching index
+    # file, so several workers can archive into the same directory at once.
+    # A segment is rolled over once it gets bigger than segment_size bytes.
+    # When a key was archived more than once (retries, re-crawls) the newest
+    # page wins.
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024):
+        self.path = path
+        self.segment_size = segment_size
+        self.segment = None
+        self.segment_name = None
+        self.index = None
+        self.entries = None
+
+    ## writing
+    def open_segment(self):
+        self.close()
+        os.makedirs(self.path, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+        self.segment_name = f'segment-{name}.seg'
+        self.segment = open(os.path.join(self.path, self.segment_name), 'ab')
+        self.index = open(os.path.join(self.path, f'index-{name}.jsonl'), 'a', encoding='utf-8')
+
+    def append(self, key, url, status, body, **fields):
+        if self.segment is None or self.segment.tell() >= self.segment_size:
+            self.open_segment()
+
+        data = zlib.compress(body)
+        offset = self.segment.tell()
+        self.segment.write(data)
+        self.segment.flush()
+
+        entry = dict(fields, key=key, url=url, status=status, segment=self.segment_name,
+                     offset=offset, length=len(data), time=time.time())
+        self.index.write(json.dumps(entry) + '\n')
+        self.index.flush()
+
+        if self.entries is not None:
+            self.entries[key] = entry
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+    ## reading
+    def load_index(self):
+        entries = {}
+        for index_path in sorted(glob.glob(os.path.join(self.path, 'index-*.jsonl'))):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    # a worker killed mid-write can leave a partial last line
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry['key']] = entry
+        self.entries = entries
+        return entries
+
+    def get(self, key):
+        if self.entries is None:
+            self.load_index()
+        return self.entries.get(key)
+
+    def read(self, entry):
+        with open(os.path.join(self.path, entry['segment']), 'rb') as f:
+            f.seek(entry['offset'])
+            return zlib.decompress(f.read(entry['length']))
+
+    def iter_pages(self, asin=None):
+        # (entry, body) for every archived page, optionally only one asin's
+        if self.entries is None:
+            self.load_index()
+        for entry in self.entries.values():
+            if asin is None or entry.get('asin') == asin:
+                yield entry, self.read(entry)
@@ -0,0 +1,87 @@
+# Product aspects and how reviewers feel about them.
+#
+# Candidate aspects are the words and two word phrases of the sampled reviews of
+# an asin that are nouns or noun compounds ("battery", "battery life", "customer
+# service"). One binary document-term matrix of the sample gives how many reviews
+# mention each aspect, and a sparse matrix product with the sentiment of each
+# review splits those mentions into positive and negative. The sample keeps up to
+# the same number of reviews per sentiment, so every review is weighted by how
+# many reviews of its sentiment it stands for (analysis_pipeline.sample_training_set).
+# The table is uploaded next to the important words as aspects_{asin}.csv, see
+# analysis_pipeline.
+#
+#   python -m amazon.aspects B01GGKYKQM
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+
+from amazon.text import is_noun_phrase, preprocess_texts
+
+
+# reviews an aspect has to be mentioned in, and aspects kept per asin
+ASPECT_MIN_DF = int(os.getenv("ASPECT_MIN_DF", 5))
+MAX_ASPECTS = int(os.getenv("MAX_ASPECTS", 50))
+
+ASPECT_COLUMNS = ['aspect', 'mentions', 'positive', 'negative', 'positive_ratio']
+
+
+def mine_aspects(texts, sentiments, weights=None, min_df=ASPECT_MIN_DF, max_aspects=MAX_ASPECTS):
+    # DataFrame of ASPECT_COLUMNS for the most mentioned aspects, most mentioned first
+    sentiments = np.asarray(sentiments)
+    weights = np.ones(len(texts)) if weights is None else np.asarray(weights, dtype=float)
+
+    vectorizer = CountVectorizer(ngram_range=(1, 2), binary=True, min_df=min(min_df, max(len(texts), 1)))
+    try:
+        matrix = vectorizer.fit_transform(preprocess_texts(texts)).tocsc()
+    except ValueError:
+        # no words left after preprocessing and min_df
+        return pd.DataFrame(columns=ASPECT_COLUMNS)
+
+    terms = vectorizer.get_feature_names_out()
+    keep = np.flatnonzero([is_noun_phrase(term) for term in terms])
+    matrix, terms = matrix[:, keep], terms[keep]
+
+    # weighted number of reviews mentioning each aspect, one pass over the matrix per sentiment
+    positive = matrix.T @ (weights * (sentiments == 'positive'))
+    negative = matrix.T @ (weights * (sentiments == 'negative'))
+    mentions = positive + negative
+
+    # a word that's only ever mentioned as part of a phrase, like "life" in "battery life", is left out
+    index = {term: i for i, term in enumerate(terms)}
+    subsumed = np.zeros(len(terms), dtype=bool)
+    for i, term in enumerate(terms):
+        words = term.split()
+        if len(words) < 2:
+            continue
+        for word in words:
+            if word in index and mentions[index[word]] <= mentions[i]:
+                subsumed[index[word]] = True
+    keep = np.flatnonzero(~subsumed)
+    terms, positive, negative, mentions = terms[keep], positive[keep], negative[keep], mentions[keep]
+
+    # the most mentioned aspects without sorting the whole vocabulary
+    top = min(max_aspects, len(terms))
+    if top == 0:
+        return pd.DataFrame(columns=ASPECT_COLUMNS)
+    top_indices = np.argpartition(-mentions, top - 1)[:top]
+    top_indices = top_indices[np.argsort(-mentions[top_indices])]
+
+    return pd.DataFrame({
+        'aspect': terms[top_indices],
+        'mentions': mentions[top_indices].round().astype(int),
+        'positive': positive[top_indices].round().astype(int),
+        'negative': negative[top_indices].round().astype(int),
+        'positive_ratio': (positive[top_indices] / mentions[top_indices]).round(3),
+    })
+
+
+if __name__ == "__main__":
+    # importing analysis_pipeline downloads the nltk data
+    from amazon.analysis_pipeline import create_and_upload_aspects
+
+    for asin in sys.argv[1:]:
+        print(create_and_upload_aspects(asin))
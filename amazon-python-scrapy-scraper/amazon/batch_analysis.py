@@ -0,0 +1,136 @@
+# Train the sentiment models of many asins together.
+#
+# Instead of preprocessing and building a vocabulary per product, the reviews of
+# every asin are preprocessed once in parallel worker processes, turned into one
+# tf-idf matrix over a shared vocabulary, and a classifier is fit per asin on its
+# rows of that matrix. Each asin still gets its own important_words_{asin}.csv
+# and aspects_{asin}.csv, and its reviews scored, like a single product run.
+#
+#   python -m amazon.batch_analysis B01GGKYKQM B07FZ8S74R B0BPR6FL7M
+#   python -m amazon.batch_analysis --file category_asins.txt --jobs 8
+
+import argparse
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+from amazon.analysis_pipeline import (
+    SENTIMENT_MAX_FEATURES,
+    SENTIMENT_MIN_DF,
+    SENTIMENT_SAMPLE_SIZE,
+    create_and_upload_aspects,
+    record_analysis_run,
+    sample_reviews,
+    sample_training_set,
+    score_reviews,
+    top_coefficients,
+    upload_important_words,
+)
+from amazon.text import preprocess_text, preprocess_texts
+
+
+# reviews per preprocessing task sent to a worker
+PREPROCESS_CHUNK_SIZE = 2000
+
+
+def load_corpus(asins, sample_size):
+    # texts and sentiments of every asin, and the rows of each asin in them
+    # the samples are kept for mining the aspects of each asin
+    texts, sentiments, weights, rows, samples = [], [], [], {}, {}
+
+    for asin in asins:
+        reservoirs, seen = samples[asin] = sample_reviews(asin, sample_size)
+        if not reservoirs['positive'] or not reservoirs['negative']:
+            print(f"Skipping {asin}, its reviews are all positive or all negative")
+            continue
+
+        start = len(texts)
+        asin_texts, asin_sentiments, asin_weights = sample_training_set(reservoirs, seen)
+        texts += asin_texts
+        sentiments += asin_sentiments
+        # scaled to average 1 per asin, see fit_sentiment_pipeline
+        weights += list(np.asarray(asin_weights) / np.mean(asin_weights))
+        rows[asin] = slice(start, len(texts))
+
+    return texts, np.array(sentiments), np.array(weights), rows, samples
+
+
+def fit_classifier(matrix, sentiments, weights):
+    # weighted so the probabilities follow the asin's share of positive reviews, not the sample's
+    classifier = LogisticRegression()
+    classifier.fit(matrix, sentiments, sample_weight=weights)
+    return classifier
+
+
+def batch_train(asins, sample_size=SENTIMENT_SAMPLE_SIZE, min_df=SENTIMENT_MIN_DF,
+                max_features=SENTIMENT_MAX_FEATURES, n_jobs=-1):
+    # returns a fitted pipeline per asin, they share the vectorizer and tf-idf weights,
+    # and the sample of reviews of every asin
+    start = time.perf_counter()
+    texts, sentiments, weights, rows, samples = load_corpus(asins, sample_size)
+    if not rows:
+        return {}, samples
+    print(f"Loaded {len(texts)} reviews of {len(rows)} products in {time.perf_counter() - start:.1f}s")
+
+    # preprocessing is pure python, so it's spread over processes
+    start = time.perf_counter()
+    chunks = [texts[i:i + PREPROCESS_CHUNK_SIZE] for i in range(0, len(texts), PREPROCESS_CHUNK_SIZE)]
+    preprocessed = [text for chunk in Parallel(n_jobs=n_jobs)(delayed(preprocess_texts)(chunk) for chunk in chunks)
+                    for text in chunk]
+    print(f"Preprocessed in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    vectorizer = CountVectorizer(min_df=min_df, max_features=max_features)
+    tfidf = TfidfTransformer()
+    matrix = tfidf.fit_transform(vectorizer.fit_transform(preprocessed)).tocsr()
+    print(f"Built a {matrix.shape[1]} word vocabulary in {time.perf_counter() - start:.1f}s")
+
+    # lbfgs spends its time in numpy and scipy, so threads can share the matrix without copying it
+    start = time.perf_counter()
+    classifiers = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(fit_classifier)(matrix[row_slice], sentiments[row_slice], weights[row_slice])
+        for row_slice in rows.values())
+    print(f"Fit {len(classifiers)} classifiers in {time.perf_counter() - start:.1f}s")
+
+    # the vocabulary was built from preprocessed text, new text has to be preprocessed the same way
+    vectorizer.set_params(preprocessor=preprocess_text)
+
+    return {
+        asin: Pipeline([('preprocess', vectorizer), ('tfidf', tfidf), ('classifier', classifier)])
+        for asin, classifier in zip(rows, classifiers)
+    }, samples
+
+
+def batch_analysis(asins, sample_size=SENTIMENT_SAMPLE_SIZE, n_jobs=-1):
+    pipelines, samples = batch_train(asins, sample_size, n_jobs=n_jobs)
+
+    for asin, pipeline in pipelines.items():
+        upload_important_words(top_coefficients(pipeline), asin)
+        create_and_upload_aspects(asin, sample=samples[asin])
+        print(f"Scored {score_reviews(asin, pipeline)} new reviews of {asin}")
+        record_analysis_run(asin)
+
+    return list(pipelines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('asins', nargs='*')
+    parser.add_argument('--file', help='file with one asin per line')
+    parser.add_argument('--sample-size', type=int, default=SENTIMENT_SAMPLE_SIZE, help='reviews kept per sentiment per asin')
+    parser.add_argument('--jobs', type=int, default=-1, help='worker processes and threads, -1 for one per cpu')
+    args = parser.parse_args()
+
+    asins = list(args.asins)
+    if args.file:
+        with open(args.file) as f:
+            asins += [line.strip() for line in f if line.strip()]
+
+    # keep the order but drop repeats
+    asins = list(dict.fromkeys(asins))
+    trained = batch_analysis(asins, args.sample_size, args.jobs)
+    print(f"Trained {len(trained)} of {len(asins)} products")
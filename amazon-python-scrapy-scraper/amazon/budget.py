@@ -0,0 +1,99 @@
+import time
+
+from redis import Redis
+
+
+def get_redis_connection(settings):
+    return Redis(host=settings.get('REDIS_HOST', 'localhost'), port=settings.getint('REDIS_PORT', 6379))
+
+
+# Takes `cost` tokens from every bucket in KEYS or from none of them.
+# ARGV = now, cost, then capacity and refill rate (tokens per second) for each key.
+# Returns 0 when the pages were granted, otherwise the 1-based index of the empty bucket.
+TAKE_TOKENS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local levels = {}
+local denied = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[1 + i * 2])
+    local rate = tonumber(ARGV[2 + i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if denied == 0 and tokens < cost then
+        denied = i
+    end
+end
+
+for i, key in ipairs(KEYS) do
+    local tokens = levels[i]
+    if denied == 0 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+end
+
+return denied
+"""
+
+
+class PageBudget:
+    # Redis backed token buckets shared by every crawl worker. There is one
+    # global bucket for the whole proxy plan and one bucket per ASIN, each
+    # refilled at capacity / period tokens per second. A page is only granted
+    # when both buckets have a token left.
+
+    GLOBAL_KEY = 'amazon:page_budget:global'
+    ASIN_KEY = 'amazon:page_budget:asin:{}'
+
+    def __init__(self, redis_conn, global_capacity, asin_capacity, period):
+        self.redis = redis_conn
+        self.global_capacity = global_capacity
+        self.asin_capacity = asin_capacity
+        self.period = period
+        self.take_tokens = redis_conn.register_script(TAKE_TOKENS_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, settings, redis_conn=None):
+        return cls(
+            redis_conn or get_redis_connection(settings),
+            global_capacity=settings.getint('PAGE_BUDGET_GLOBAL'),
+            asin_capacity=settings.getint('PAGE_BUDGET_PER_ASIN'),
+            period=settings.getfloat('PAGE_BUDGET_PERIOD'),
+        )
+
+    def buckets(self, asin=None):
+        buckets = [(self.GLOBAL_KEY, self.global_capacity)]
+        if asin:
+            buckets.append((self.ASIN_KEY.format(asin), self.asin_capacity))
+        return buckets
+
+    def consume(self, asin=None, pages=1):
+        # returns None when the pages were granted, otherwise "global" or "asin"
+        buckets = self.buckets(asin)
+        args = [time.time(), pages]
+        for _, capacity in buckets:
+            args += [capacity, capacity / self.period]
+
+        denied = self.take_tokens(keys=[key for key, _ in buckets], args=args)
+        if denied == 0:
+            return None
+        return 'global' if denied == 1 else 'asin'
+
+    def remaining(self, asin=None):
+        now = time.time()
+        remaining = {}
+        for key, capacity in self.buckets(asin):
+            tokens, ts = self.redis.hmget(key, 'tokens', 'ts')
+            if tokens is None:
+                level = capacity
+            else:
+                refill = max(0.0, now - float(ts)) * capacity / self.period
+                level = min(capacity, float(tokens) + refill)
+            name = 'global' if key == self.GLOBAL_KEY else 'asin'
+            remaining[name] = {'remaining': int(level), 'capacity': capacity}
+        return remaining
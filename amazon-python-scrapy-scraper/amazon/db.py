@@ -0,0 +1,21 @@
+import os
+
+import mysql.connector
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def get_db_config():
+    return {
+        'user': os.getenv("MYSQL_USER"),
+        'password': os.getenv("MYSQL_PASSWORD"),
+        'host': os.getenv("MYSQL_HOST"),
+        'port': 3306,
+        'database': os.getenv("MSQL_DATABASE"),
+    }
+
+
+def get_db_connection():
+    # Connect to mySQL db
+    return mysql.connector.connect(**get_db_config())
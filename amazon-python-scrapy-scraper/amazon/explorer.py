@@ -0,0 +1,99 @@
+# Paged access to the raw reviews of an asin for the review explorer api.
+#
+# Pages are newest first and use keyset pagination on (date, id): the cursor of
+# a page is the date and id of its last review and the next page starts right
+# after it, so every page is an index range read no matter how deep it is.
+# The reviews_asin_date index below is what makes that possible.
+
+import datetime
+
+
+# columns that can be asked for, id and date are always returned for the cursor
+REVIEW_COLUMNS = ['id', 'asin', 'title', 'text', 'location', 'date', 'verified', 'rating']
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# asin is a text column so only a prefix of it can be indexed, asins are 10 characters
+CREATE_REVIEW_INDEX_QUERY = "CREATE INDEX reviews_asin_date ON reviews (asin(10), date, id)"
+
+
+def ensure_review_index(cursor):
+    # mysql has no CREATE INDEX IF NOT EXISTS
+    cursor.execute("""SELECT COUNT(*) FROM information_schema.statistics
+                      WHERE table_schema = DATABASE() AND table_name = 'reviews'
+                      AND index_name = 'reviews_asin_date'""")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(CREATE_REVIEW_INDEX_QUERY)
+
+
+def encode_cursor(date, review_id):
+    return f"{date}_{review_id}"
+
+
+def decode_cursor(cursor):
+    # raises ValueError for a cursor that didn't come from encode_cursor
+    date, review_id = cursor.rsplit('_', 1)
+    return datetime.date.fromisoformat(date), int(review_id)
+
+
+def select_columns(fields=None):
+    # the requested columns that exist, in table order
+    if not fields:
+        return list(REVIEW_COLUMNS)
+
+    columns = [column for column in REVIEW_COLUMNS if column in fields or column in ('id', 'date')]
+    unknown = set(fields) - set(REVIEW_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return columns
+
+
+def page_reviews(conn, asin, fields=None, ratings=None, verified=None, location=None,
+                 date_from=None, date_to=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    # raises ValueError for unknown fields or badly formatted dates and cursors
+    columns = select_columns(fields)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    where = ["asin = %s"]
+    params = [asin]
+    if ratings:
+        where.append(f"rating IN ({', '.join(['%s'] * len(ratings))})")
+        params += list(ratings)
+    if verified is not None:
+        where.append("verified = %s")
+        params.append(int(verified))
+    if location:
+        where.append("location = %s")
+        params.append(location)
+    if date_from:
+        where.append("date >= %s")
+        params.append(datetime.date.fromisoformat(date_from))
+    if date_to:
+        where.append("date <= %s")
+        params.append(datetime.date.fromisoformat(date_to))
+    if after:
+        after_date, after_id = decode_cursor(after)
+        where.append("(date < %s OR (date = %s AND id < %s))")
+        params += [after_date, after_date, after_id]
+
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""SELECT {', '.join(columns)} FROM reviews
+                       WHERE {' AND '.join(where)}
+                       ORDER BY date DESC, id DESC
+                       LIMIT %s""", params + [limit + 1])
+    reviews = cursor.fetchall()
+    cursor.close()
+
+    # one extra row tells whether there is another page
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor(reviews[-1]['date'], reviews[-1]['id'])
+
+    for review in reviews:
+        review['date'] = str(review['date'])
+        if 'verified' in review:
+            review['verified'] = bool(review['verified'])
+
+    return {"asin": asin, "reviews": reviews, "next": next_cursor}
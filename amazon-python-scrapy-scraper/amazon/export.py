@@ -0,0 +1,250 @@
+# Streaming export of reviews as csv, jsonl or parquet.
+#
+# Rows are read from an unbuffered cursor a batch at a time and written out as
+# they arrive, so memory use stays the same however many reviews are exported.
+# Used by the /api/export endpoint and from the command line:
+#
+#   python -m amazon.export --asin B01GGKYKQM --format csv -o reviews.csv
+#   python -m amazon.export --asin B01GGKYKQM --asin B07FZ8S74R --format jsonl --compression gzip -o reviews.jsonl.gz
+#   python -m amazon.export --asin B01GGKYKQM --format parquet --compression zstd --date-from 2023-01-01 -o reviews.parquet
+#
+# parquet needs pyarrow and zstd compression of csv/jsonl needs zstandard, neither
+# is required for anything else.
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+import zlib
+
+import mysql.connector
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from amazon.db import get_db_connection
+from amazon.explorer import REVIEW_COLUMNS
+
+
+FORMATS = ['csv', 'jsonl', 'parquet']
+COMPRESSIONS = [None, 'gzip', 'zstd']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# rows fetched per round trip, also the size of each parquet row group
+EXPORT_BATCH_SIZE = 5000
+
+
+def export_filename(asins, export_format, compression=None):
+    name = f"reviews_{'_'.join(asins)}.{export_format}"
+    # parquet compresses inside the file
+    if compression and export_format != 'parquet':
+        name += '.gz' if compression == 'gzip' else '.zst'
+    return name
+
+
+def iter_review_batches(conn, asins, date_from=None, date_to=None, batch_size=EXPORT_BATCH_SIZE, exclude_duplicates=False):
+    # lists of review rows, read through an unbuffered cursor so only one batch is in memory
+    # exports have every review, the analysis leaves the marked near-duplicates out
+    where = [f"asin IN ({', '.join(['%s'] * len(asins))})"]
+    params = list(asins)
+    if exclude_duplicates:
+        where.append("duplicate_of IS NULL")
+    if date_from:
+        where.append("date >= %s")
+        params.append(date_from)
+    if date_to:
+        where.append("date <= %s")
+        params.append(date_to)
+
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(f"""SELECT {', '.join(REVIEW_COLUMNS)} FROM reviews
+                           WHERE {' AND '.join(where)}
+                           ORDER BY asin, date, id""", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            # the export was stopped before every row was read, the rows are
+            # dropped when the connection is closed
+            pass
+
+
+def write_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REVIEW_COLUMNS)
+
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    # just the header if there were no reviews
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_jsonl(batches):
+    for rows in batches:
+        lines = [json.dumps(dict(zip(REVIEW_COLUMNS, row)), default=str) for row in rows]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class StreamSink:
+    # write only file object that hands what parquet writes back to a generator
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    return pa.schema([
+        ('id', pa.int32()),
+        ('asin', pa.string()),
+        ('title', pa.string()),
+        ('text', pa.string()),
+        ('location', pa.string()),
+        ('date', pa.date32()),
+        ('verified', pa.bool_()),
+        ('rating', pa.int32()),
+    ])
+
+
+def write_parquet(batches, compression=None):
+    # one row group per batch
+    if pa is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+
+    schema = parquet_schema()
+    sink = StreamSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression=compression or 'none')
+
+    for rows in batches:
+        arrays = []
+        for column, field in zip(zip(*rows), schema):
+            # mysql returns the bool column as 0 and 1
+            if field.name == 'verified':
+                column = [None if value is None else bool(value) for value in column]
+            arrays.append(pa.array(column, type=field.type))
+
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def compress_chunks(chunks, compression):
+    if compression == 'gzip':
+        # wbits=31 writes a gzip header and trailer
+        compressor = zlib.compressobj(wbits=31)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs zstandard installed")
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        yield from chunks
+        return
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def check_export_options(export_format, compression):
+    # fail before anything is streamed, raises ValueError
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown format {export_format}, use one of {', '.join(FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, use gzip or zstd")
+    if export_format == 'parquet' and pa is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+    if export_format != 'parquet' and compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression needs zstandard installed")
+
+
+def export_reviews(asins, export_format='csv', compression=None, date_from=None, date_to=None):
+    # generator of the bytes of the export, opens and closes its own connection
+    check_export_options(export_format, compression)
+    date_from = datetime.date.fromisoformat(date_from) if isinstance(date_from, str) else date_from
+    date_to = datetime.date.fromisoformat(date_to) if isinstance(date_to, str) else date_to
+
+    def generate():
+        conn = get_db_connection()
+        try:
+            batches = iter_review_batches(conn, asins, date_from, date_to)
+            if export_format == 'parquet':
+                yield from write_parquet(batches, compression)
+            elif export_format == 'jsonl':
+                yield from compress_chunks(write_jsonl(batches), compression)
+            else:
+                yield from compress_chunks(write_csv(batches), compression)
+        finally:
+            conn.close()
+
+    return generate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--asin', action='append', required=True, help='can be given more than once')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'])
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('-o', '--output', help='defaults to stdout')
+    args = parser.parse_args()
+
+    chunks = export_reviews(args.asin, args.format, args.compression, args.date_from, args.date_to)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
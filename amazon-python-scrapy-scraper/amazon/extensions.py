@@ -0,0 +1,147 @@
+# Define here your custom extensions
+#
+# Don't forget to add your extension to the EXTENSIONS setting
+# See: https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+
+# stats that count as "something went wrong" for a request
+ERROR_STATS = (
+    'retry/count',
+    'review_page/retry/js_shell',
+)
+CAPTCHA_STATS = (
+    'review_page/classification/captcha',
+)
+THROTTLED_STATUSES = (429, 503)
+
+
+class AdaptiveConcurrency:
+    # Adjusts concurrency and download delay while the crawl is running.
+    #
+    # Every ADAPTIVE_CONCURRENCY_INTERVAL seconds it looks at the responses seen
+    # since the last check: the average download latency, the share of requests
+    # that were retried or throttled (429/503) and whether any captcha pages came
+    # back. Captchas or too many errors halve the concurrency and double the
+    # delay, high latency steps concurrency down by one, and a healthy window
+    # steps it up by one and shrinks the delay. Concurrency always stays between
+    # ADAPTIVE_CONCURRENCY_MIN and ADAPTIVE_CONCURRENCY_MAX. Download slots made
+    # after a change (a new proxy host, ...) get the current values when their
+    # first request reaches the downloader.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+
+        self.min_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MIN', 1)
+        self.max_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MAX', 8)
+        self.target_latency = settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY', 5.0)
+        self.max_error_rate = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE', 0.1)
+        self.min_delay = settings.getfloat('ADAPTIVE_CONCURRENCY_MIN_DELAY', 0.0)
+        self.max_delay = settings.getfloat('ADAPTIVE_CONCURRENCY_MAX_DELAY', 30.0)
+        self.interval = settings.getfloat('ADAPTIVE_CONCURRENCY_INTERVAL', 30.0)
+
+        if self.min_concurrency < 1 or self.max_concurrency < self.min_concurrency:
+            raise NotConfigured('ADAPTIVE_CONCURRENCY_MIN/MAX bounds are invalid')
+
+        start = settings.getint('CONCURRENT_REQUESTS')
+        self.concurrency = max(self.min_concurrency, min(self.max_concurrency, start))
+        self.delay = max(self.min_delay, settings.getfloat('DOWNLOAD_DELAY'))
+
+        self.task = None
+        self.reset_window()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        if crawler.settings.getbool('AUTOTHROTTLE_ENABLED'):
+            raise NotConfigured('AdaptiveConcurrency and AutoThrottle both set the download delay, enable only one')
+
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        return ext
+
+    def spider_opened(self, spider):
+        self.apply(spider)
+        self.task = task.LoopingCall(self.adjust, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        self.latency_total += request.meta.get('download_latency', 0.0)
+        if response.status in THROTTLED_STATUSES:
+            self.throttled += 1
+
+    def request_reached_downloader(self, request, spider):
+        # scrapy creates a slot with the DOWNLOAD_DELAY setting, its request hasn't waited for it yet
+        slot = self.crawler.engine.downloader.slots.get(request.meta.get('download_slot'))
+        if slot is not None:
+            self.apply_slot(slot)
+
+    def reset_window(self):
+        self.responses = 0
+        self.latency_total = 0.0
+        self.throttled = 0
+        self.last_errors = self.sum_stats(ERROR_STATS)
+        self.last_captchas = self.sum_stats(CAPTCHA_STATS)
+
+    def sum_stats(self, keys):
+        return sum(self.stats.get_value(key, 0) for key in keys)
+
+    def adjust(self, spider):
+        responses = self.responses
+        if responses == 0:
+            return
+
+        latency = self.latency_total / responses
+        errors = self.sum_stats(ERROR_STATS) - self.last_errors + self.throttled
+        captchas = self.sum_stats(CAPTCHA_STATS) - self.last_captchas
+        error_rate = errors / responses
+        self.reset_window()
+
+        old_concurrency, old_delay = self.concurrency, self.delay
+        if captchas or error_rate > self.max_error_rate:
+            decision = 'back off'
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, 1.0))
+        elif latency > self.target_latency:
+            decision = 'slow down'
+            self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+        elif error_rate <= self.max_error_rate / 2:
+            decision = 'speed up'
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.delay = max(self.min_delay, self.delay / 2)
+        else:
+            decision = 'hold'
+
+        spider.logger.info(
+            f'Adaptive concurrency {decision}: {responses} responses, latency {latency:.2f}s, '
+            f'error rate {error_rate:.1%}, {captchas} captchas -> '
+            f'concurrency {old_concurrency}->{self.concurrency}, delay {old_delay:.2f}s->{self.delay:.2f}s'
+        )
+        self.stats.set_value('adaptive_concurrency/concurrency', self.concurrency, spider=spider)
+        self.stats.set_value('adaptive_concurrency/delay', self.delay, spider=spider)
+        self.apply(spider)
+
+    def apply(self, spider):
+        downloader = self.crawler.engine.downloader
+        downloader.total_concurrency = self.concurrency
+        downloader.domain_concurrency = self.concurrency
+        for slot in downloader.slots.values():
+            self.apply_slot(slot)
+
+    def apply_slot(self, slot):
+        slot.concurrency = self.concurrency
+        slot.delay = self.delay
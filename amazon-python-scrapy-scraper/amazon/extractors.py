@@ -0,0 +1,52 @@
+import json
+import re
+
+
+# Only the <script> blocks that mention these keys are searched, not the whole page
+IMAGE_SCRIPT_XPATH = '//script[contains(text(), "colorImages")]/text()'
+VARIANT_SCRIPT_XPATH = '//script[contains(text(), "dimensionValuesDisplayData")]/text()'
+
+IMAGE_DATA_RE = re.compile(r"'colorImages'\s*:\s*\{\s*'initial'\s*:\s*(\[.+?\])\s*\},\n")
+VARIANT_DATA_RE = re.compile(r'"dimensionValuesDisplayData"\s*:\s*(\{.+?\}),\n')
+
+
+def search_scripts(response, xpath, pattern):
+    # first match of pattern inside the script blocks found by xpath, or None
+    for script in response.xpath(xpath).getall():
+        match = pattern.search(script)
+        if match:
+            return match.group(1)
+    return None
+
+
+def load_json(data):
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def extract_image_data(response):
+    return load_json(search_scripts(response, IMAGE_SCRIPT_XPATH, IMAGE_DATA_RE)) or []
+
+
+def extract_variant_data(response):
+    return load_json(search_scripts(response, VARIANT_SCRIPT_XPATH, VARIANT_DATA_RE)) or {}
+
+
+def extract_product_data(response):
+    feature_bullets = [bullet.strip() for bullet in response.css("#feature-bullets li ::text").getall()]
+    price = response.css('.a-price span[aria-hidden="true"] ::text').get("")
+    if not price:
+        price = response.css('.a-price .a-offscreen ::text').get("")
+    return {
+        "name": response.css("#productTitle::text").get("").strip(),
+        "price": price,
+        "stars": response.css("i[data-hook=average-star-rating] ::text").get("").strip(),
+        "rating_count": response.css("div[data-hook=total-review-count] ::text").get("").strip(),
+        "feature_bullets": feature_bullets,
+        "images": extract_image_data(response),
+        "variant_data": extract_variant_data(response),
+    }
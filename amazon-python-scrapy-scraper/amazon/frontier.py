@@ -0,0 +1,114 @@
+import os
+import pickle
+
+from scrapy.utils.request import fingerprint, request_from_dict
+
+from amazon.budget import get_redis_connection
+
+
+class LocalFrontierStore:
+    # keeps the frontier in <CRAWL_FRONTIER_DIR>/<job_id>/frontier.pickle
+
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, 'frontier.pickle')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, data):
+        os.makedirs(self.job_dir, exist_ok=True)
+        # write to a temp file first so a killed worker never leaves half a frontier behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RedisFrontierStore:
+    KEY = 'amazon:frontier:{}'
+
+    def __init__(self, redis_conn, job_id):
+        self.redis = redis_conn
+        self.key = self.KEY.format(job_id)
+
+    def load(self):
+        data = self.redis.get(self.key)
+        return pickle.loads(data) if data else None
+
+    def save(self, data):
+        self.redis.set(self.key, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def clear(self):
+        self.redis.delete(self.key)
+
+
+class CrawlFrontier:
+    # The requests a crawl still has to make plus the sort/pagination state of
+    # each ASIN. With a job id it is saved after every parsed page, so a crawl
+    # restarted with the same job id picks up where the last one stopped instead
+    # of paying for page 1 of the first sort again. Without a job id it only
+    # lives in memory.
+
+    def __init__(self, store=None):
+        self.store = store
+        data = (store.load() if store else None) or {}
+        self.pending = data.get('pending', {})
+        self.chains = data.get('chains', {})
+        self.resumed = bool(self.pending or self.chains)
+
+    @classmethod
+    def from_settings(cls, settings, job_id=None):
+        if not job_id:
+            return cls()
+
+        backend = settings.get('CRAWL_FRONTIER_BACKEND', 'local')
+        if backend == 'redis':
+            store = RedisFrontierStore(get_redis_connection(settings), job_id)
+        elif backend == 'local':
+            store = LocalFrontierStore(os.path.join(settings.get('CRAWL_FRONTIER_DIR', 'crawls'), job_id))
+        else:
+            raise ValueError(f'Unknown CRAWL_FRONTIER_BACKEND "{backend}"')
+        return cls(store)
+
+    ## pending requests
+    # keyed by the fingerprint of the request when it was first yielded, kept in
+    # meta because the proxy middleware swaps the url before the response comes back
+    def add(self, request, spider):
+        key = request.meta.setdefault('frontier_key', fingerprint(request).hex())
+        self.pending[key] = request.to_dict(spider=spider)
+
+    def done(self, request):
+        self.pending.pop(request.meta.get('frontier_key'), None)
+
+    def pending_requests(self, spider):
+        return [request_from_dict(d, spider=spider) for d in self.pending.values()]
+
+    ## per asin sort and pagination state
+    def chain_state(self, asin):
+        return self.chains.setdefault(asin, {'current_sort': 0, 'total_pages': 0, 'completed_sorts': []})
+
+    def mark_sort_completed(self, asin, sort):
+        completed = self.chain_state(asin)['completed_sorts']
+        if sort not in completed:
+            completed.append(sort)
+
+    def is_sort_completed(self, asin, sort):
+        return sort in self.chain_state(asin)['completed_sorts']
+
+    def save(self):
+        if self.store:
+            self.store.save({'pending': self.pending, 'chains': self.chains})
+
+    def clear(self):
+        self.pending = {}
+        self.chains = {}
+        if self.store:
+            self.store.clear()
@@ -16,3 +16,30 @@ class AmazonReviewItem(scrapy.Item):
     date = Field()
     verified = Field()
     rating = Field()
+
+
+class AmazonSearchProductItem(scrapy.Item):
+    keyword = Field()
+    asin = Field()
+    url = Field()
+    ad = Field()
+    organic_rank = Field()
+    title = Field()
+    price = Field()
+    real_price = Field()
+    rating = Field()
+    rating_count = Field()
+    thumbnail_url = Field()
+    review_crawl_job = Field()
+
+
+class AmazonProductItem(scrapy.Item):
+    asin = Field()
+    url = Field()
+    name = Field()
+    price = Field()
+    stars = Field()
+    rating_count = Field()
+    feature_bullets = Field()
+    images = Field()
+    variant_data = Field()
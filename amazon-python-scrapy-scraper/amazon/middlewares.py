@@ -3,11 +3,20 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import os
+import random
+
+from redis.exceptions import RedisError
+from scrapy import Request, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from amazon.archive import PageArchive, archive_key
+from amazon.budget import PageBudget
+
 
 class AmazonSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +110,358 @@ class AmazonDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class UserAgentPoolMiddleware:
+    # Sets the User-Agent header on every outgoing request from a pool that is
+    # loaded once when the crawler starts. The pool comes from a bundled
+    # offline list so no request ever has to touch the network to get a header.
+    #
+    # USER_AGENT_ROTATION controls how often the header changes:
+    # - "request": pick a new User-Agent for every request
+    # - "session": keep the same User-Agent for every request that shares a
+    #   request.meta["proxy_session"] value (or the spider if none is set)
+
+    DEFAULT_USER_AGENT_LIST = os.path.join(os.path.dirname(__file__), 'data', 'user_agents.txt')
+
+    def __init__(self, user_agents, rotation='request'):
+        if not user_agents:
+            raise NotConfigured('User-Agent pool is empty')
+        if rotation not in ('request', 'session'):
+            raise NotConfigured(f'Unknown USER_AGENT_ROTATION "{rotation}"')
+
+        self.user_agents = user_agents
+        self.rotation = rotation
+        self.session_user_agents = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get('USER_AGENT_LIST') or cls.DEFAULT_USER_AGENT_LIST
+        s = cls(load_user_agents(path), settings.get('USER_AGENT_ROTATION', 'request'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        if self.rotation == 'session':
+            session = request.meta.get('proxy_session', spider.name)
+            if session not in self.session_user_agents:
+                self.session_user_agents[session] = random.choice(self.user_agents)
+            user_agent = self.session_user_agents[session]
+        else:
+            user_agent = random.choice(self.user_agents)
+
+        request.headers['User-Agent'] = user_agent
+        return None
+
+    def spider_opened(self, spider):
+        spider.logger.info(f'Loaded {len(self.user_agents)} user agents, rotating per {self.rotation}')
+
+
+def load_user_agents(path):
+    # one user agent per line, blank lines and # comments are skipped
+    with open(path, encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+## Review page classifications set in request.meta["review_page_class"]
+HAS_NEXT_PAGE = 'has_next_page'
+LAST_PAGE = 'last_page'
+CAPTCHA = 'captcha'
+JS_SHELL = 'js_shell'
+NOT_FOUND = 'not_found'
+
+RETRYABLE_PAGE_CLASSES = (CAPTCHA, JS_SHELL)
+
+CAPTCHA_MARKERS = (
+    b'/errors/validateCaptcha',
+    b'api-services-support@amazon.com',
+    b'<title dir="ltr">Robot Check</title>',
+    b'Type the characters you see in this image',
+)
+
+
+def classify_review_page(response):
+    # Work out what kind of review page Amazon sent back
+    if response.status == 404:
+        return NOT_FOUND
+
+    if response.status == 503 or any(marker in response.body for marker in CAPTCHA_MARKERS):
+        return CAPTCHA
+
+    # the review list container is only missing when the reviews get rendered by js
+    if not response.css('#cm_cr-review_list'):
+        return JS_SHELL
+
+    if response.css('.a-pagination .a-last>a::attr(href)').get() is not None:
+        return HAS_NEXT_PAGE
+
+    return LAST_PAGE
+
+
+class ReviewPageRetryMiddleware:
+    # Classifies every review page response (requests with meta["review_page"])
+    # as a page with a next link, a real last page, a captcha/robot check, a js
+    # rendered shell or a 404. Only captcha and js shell pages get retried, with
+    # exponential backoff and jitter between attempts. Whether a page ends the
+    # current sort is still decided by the spider.
+
+    def __init__(self, stats, max_retry_times=3, backoff_base=2.0, backoff_max=60.0):
+        self.stats = stats
+        self.max_retry_times = max_retry_times
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        s = cls(
+            crawler.stats,
+            max_retry_times=settings.getint('REVIEW_RETRY_TIMES', 3),
+            backoff_base=settings.getfloat('REVIEW_RETRY_BACKOFF_BASE', 2.0),
+            backoff_max=settings.getfloat('REVIEW_RETRY_BACKOFF_MAX', 60.0),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get('review_page'):
+            return response
+
+        page_class = classify_review_page(response)
+        request.meta['review_page_class'] = page_class
+        self.stats.inc_value(f'review_page/classification/{page_class}', spider=spider)
+
+        # replayed pages would come back the same every time
+        if page_class not in RETRYABLE_PAGE_CLASSES or 'archived' in response.flags:
+            return response
+
+        retries = request.meta.get('review_page_retry_times', 0)
+        if retries >= self.max_retry_times:
+            self.stats.inc_value(f'review_page/retry/max_reached/{page_class}', spider=spider)
+            spider.logger.warning(f'Gave up retrying {request.url} ({page_class}) after {retries} retries')
+            return response
+
+        retry_request = request.copy()
+        retry_request.meta['review_page_retry_times'] = retries + 1
+        retry_request.dont_filter = True
+        self.stats.inc_value(f'review_page/retry/{page_class}', spider=spider)
+
+        delay = self.get_backoff_delay(retries)
+        spider.logger.info(f'Retrying {request.url} ({page_class}) in {delay:.1f}s, retry {retries + 1}')
+        return self.delay_request(retry_request, delay)
+
+    def get_backoff_delay(self, retries):
+        # exponential backoff with "equal jitter": half fixed, half random
+        delay = min(self.backoff_max, self.backoff_base * (2 ** retries))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def delay_request(self, request, delay):
+        from twisted.internet import reactor
+        from twisted.internet.task import deferLater
+
+        return deferLater(reactor, delay, lambda: request)
+
+    def spider_opened(self, spider):
+        spider.logger.info(f'Retrying captcha and js rendered review pages up to {self.max_retry_times} times')
+
+
+class PageBudgetMiddleware:
+    # Takes a page from the shared Redis page budget (amazon.budget.PageBudget)
+    # before every request goes out through the proxy. When the global or the
+    # per-ASIN budget is used up the request is dropped and the spider is closed
+    # with a "page_budget_exhausted_<bucket>" reason.
+
+    def __init__(self, crawler, budget):
+        self.crawler = crawler
+        self.budget = budget
+        self.closing = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PAGE_BUDGET_ENABLED'):
+            raise NotConfigured
+
+        budget = PageBudget.from_settings(settings)
+        try:
+            budget.redis.ping()
+        except RedisError as e:
+            raise NotConfigured(f'Page budget disabled, cannot reach Redis: {e}')
+
+        s = cls(crawler, budget)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def process_request(self, request, spider):
+        # the proxy middleware sends its copy of the request through the chain
+        # again, only the first pass of each attempt takes a page, retries do too
+        attempt = (request.meta.get('retry_times', 0), request.meta.get('review_page_retry_times', 0))
+        if request.meta.get('page_budget_charged') == attempt:
+            return None
+
+        asin = request.meta.get('asin')
+        denied = self.budget.consume(asin)
+        if denied is None:
+            request.meta['page_budget_charged'] = attempt
+            self.crawler.stats.inc_value('page_budget/granted', spider=spider)
+            return None
+
+        self.crawler.stats.inc_value(f'page_budget/denied/{denied}', spider=spider)
+        if not self.closing:
+            self.closing = True
+            spider.logger.warning(f'Page budget ({denied}) exhausted for {asin or "crawl"}, closing spider')
+            self.crawler.engine.close_spider(spider, f'page_budget_exhausted_{denied}')
+        raise IgnoreRequest(f'Page budget ({denied}) exhausted')
+
+    def spider_opened(self, spider):
+        remaining = self.budget.remaining(getattr(spider, 'asin', None))
+        spider.logger.info(f'Page budget remaining: {remaining}')
+
+
+class CrawlFrontierMiddleware:
+    # Records every request a spider yields in its spider.frontier
+    # (amazon.frontier.CrawlFrontier) and removes it again once its response
+    # has been parsed, or its callback failed. A spider keeps a request it
+    # couldn't get through in the frontier by setting meta["frontier_resume"].
+    # On start a resumed frontier replaces the spider's start requests. The
+    # frontier is cleared when the crawl finishes with nothing left to resume
+    # and kept otherwise (worker shutdown, page budget, ...).
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls()
+        crawler.signals.connect(s.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_start_requests(self, start_requests, spider):
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is None:
+            yield from start_requests
+            return
+
+        if frontier.pending:
+            spider.logger.info(f'Resuming crawl with {len(frontier.pending)} pending requests')
+            yield from frontier.pending_requests(spider)
+            return
+
+        for r in start_requests:
+            frontier.add(r, spider)
+            yield r
+        frontier.save()
+
+    def process_spider_output(self, response, result, spider):
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is None:
+            yield from result
+            return
+
+        for i in result:
+            if isinstance(i, Request):
+                frontier.add(i, spider)
+            yield i
+
+        if not response.meta.get('frontier_resume'):
+            frontier.done(response.request)
+        frontier.save()
+
+    def process_spider_exception(self, response, exception, spider):
+        # the response was handled, even if only by an error, so it isn't resumed
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is not None:
+            frontier.done(response.request)
+            frontier.save()
+        return None
+
+    def request_dropped(self, request, spider):
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is not None:
+            frontier.done(request)
+
+    def spider_closed(self, spider, reason):
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is None:
+            return
+
+        if reason == 'finished' and not frontier.pending:
+            frontier.clear()
+        else:
+            spider.logger.info(f'Crawl closed ({reason}), keeping {len(frontier.pending)} pending requests to resume')
+            frontier.save()
+
+
+class PageArchiveMiddleware:
+    # PAGE_ARCHIVE_MODE = "record" appends every raw page the crawl downloads to
+    # the PageArchive in PAGE_ARCHIVE_DIR/<spider name>.
+    # PAGE_ARCHIVE_MODE = "replay" answers requests straight from that archive
+    # instead, so parse_reviews and the item pipelines can be run again over old
+    # pages without touching the network or the proxy budget. Requests for pages
+    # that were never archived are dropped.
+
+    def __init__(self, crawler, mode, archive_dir, segment_size):
+        self.crawler = crawler
+        self.mode = mode
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size
+        self.archive = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        mode = settings.get('PAGE_ARCHIVE_MODE')
+        if mode in (None, '', 'off'):
+            raise NotConfigured
+        if mode not in ('record', 'replay'):
+            raise NotConfigured(f'Unknown PAGE_ARCHIVE_MODE "{mode}"')
+
+        s = cls(crawler, mode, settings.get('PAGE_ARCHIVE_DIR', 'archive'),
+                settings.getint('PAGE_ARCHIVE_SEGMENT_SIZE', 64 * 1024 * 1024))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.archive = PageArchive(os.path.join(self.archive_dir, spider.name), self.segment_size)
+        if self.mode == 'replay':
+            entries = self.archive.load_index()
+            spider.logger.info(f'Replaying {len(entries)} archived pages from {self.archive.path}')
+        else:
+            spider.logger.info(f'Archiving raw pages to {self.archive.path}')
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+    def process_request(self, request, spider):
+        if self.mode != 'replay':
+            # remember the url the spider asked for, the proxy middleware swaps it out
+            request.meta.setdefault('archive_url', request.url)
+            return None
+
+        key = archive_key(request.meta, request.url)
+        entry = self.archive.get(key)
+        if entry is None:
+            self.crawler.stats.inc_value('page_archive/replay_miss', spider=spider)
+            raise IgnoreRequest(f'{key} is not in the page archive')
+
+        self.crawler.stats.inc_value('page_archive/replayed', spider=spider)
+        return HtmlResponse(
+            url=entry['url'],
+            status=entry['status'],
+            body=self.archive.read(entry),
+            encoding='utf-8',
+            request=request,
+            flags=['archived'],
+        )
+
+    def process_response(self, request, response, spider):
+        if self.mode != 'record' or 'archived' in response.flags:
+            return response
+
+        meta = request.meta
+        url = meta.get('archive_url', request.url)
+        self.archive.append(archive_key(meta, url), url, response.status, response.body,
+                            asin=meta.get('asin'), sort=meta.get('sort'), page=meta.get('page'))
+        self.crawler.stats.inc_value('page_archive/recorded', spider=spider)
+        return response
@@ -0,0 +1,354 @@
+# Near-duplicate review detection with MinHash and locality sensitive hashing.
+#
+# Every review gets a MinHash signature of the character shingles of its
+# normalized text (lowercase, punctuation and extra whitespace removed) when
+# DatabasePipeline inserts it. The signature is split into bands and each band
+# is hashed into review_lsh, so reviews sharing any band bucket are candidate
+# near-duplicates. Candidates are confirmed by comparing signatures, which
+# estimates the Jaccard similarity of their shingles. Finding the near-duplicates
+# of an asin or across asins only compares reviews that share a bucket instead
+# of every pair.
+#
+# Near-duplicates aren't deleted, reviews.duplicate_of points them at the older
+# review they duplicate and the analysis stages leave marked reviews out. The
+# tables and the column are created by amazon.schema.
+#
+#   python -m amazon.near_duplicates backfill [ASIN ...]   # sign reviews inserted before this existed
+#   python -m amazon.near_duplicates unmark ASIN ...       # put the near-duplicates back into the analysis
+#   python -m amazon.near_duplicates report [ASIN ...]     # reviews shared across asins
+
+import hashlib
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+
+from amazon.db import get_db_connection
+from amazon.watermarks import get_watermark, set_watermark, reset_watermark
+
+
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows, pairs with a similarity above ~0.5 usually share a bucket
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 5
+# short reviews like "great product" are written independently by many people,
+# only reviews with at least this many normalized characters are signed
+MIN_TEXT_LENGTH = 40
+
+# estimated jaccard similarity from which two reviews count as the same review
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.8))
+
+STAGE = "near_duplicates"
+
+# smallest prime above 2 ** 32, the hash functions are (a * x + b) % PRIME
+PRIME = 4294967311
+# fixed seed so signatures made at different times can be compared
+_rng = np.random.RandomState(1)
+HASH_A = _rng.randint(1, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+HASH_B = _rng.randint(0, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+SIGN_BATCH_SIZE = 1000
+
+CREATE_MINHASH_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_minhash(
+    review_id int NOT NULL,
+    asin VARCHAR(10) NOT NULL,
+    signature VARBINARY(256) NOT NULL,
+    PRIMARY KEY (review_id),
+    KEY asin (asin)
+)
+"""
+
+CREATE_LSH_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_lsh(
+    band tinyint NOT NULL,
+    bucket bigint NOT NULL,
+    review_id int NOT NULL,
+    asin VARCHAR(10) NOT NULL,
+    PRIMARY KEY (band, bucket, review_id),
+    KEY asin (asin)
+)
+"""
+
+# id of the older review a near-duplicate duplicates, null for the reviews that are kept
+ADD_DUPLICATE_COLUMN_QUERY = "ALTER TABLE reviews ADD COLUMN duplicate_of int NULL"
+
+INSERT_MINHASH_QUERY = "INSERT IGNORE INTO review_minhash (review_id, asin, signature) VALUES (%s, %s, %s)"
+INSERT_LSH_QUERY = "INSERT IGNORE INTO review_lsh (band, bucket, review_id, asin) VALUES (%s, %s, %s, %s)"
+
+
+def create_near_duplicate_tables(cursor):
+    # called by amazon.schema, mysql has no ADD COLUMN IF NOT EXISTS
+    cursor.execute(CREATE_MINHASH_TABLE_QUERY)
+    cursor.execute(CREATE_LSH_TABLE_QUERY)
+    cursor.execute("""SELECT COUNT(*) FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = 'reviews'
+                      AND column_name = 'duplicate_of'""")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(ADD_DUPLICATE_COLUMN_QUERY)
+
+
+def normalize_text(text):
+    # syndicated copies differ in case, punctuation and whitespace
+    return ' '.join(re.sub(r'[^\w\s]', ' ', (text or '').lower()).split())
+
+
+def shingles(text):
+    # crc32 of every SHINGLE_SIZE character substring, short texts are one shingle
+    text = normalize_text(text)
+    if len(text) <= SHINGLE_SIZE:
+        return np.array([zlib.crc32(text.encode('utf-8'))], dtype=np.uint64)
+    encoded = {zlib.crc32(text[i:i + SHINGLE_SIZE].encode('utf-8')) for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter(encoded, dtype=np.uint64, count=len(encoded))
+
+
+def minhash(text):
+    # NUM_PERMUTATIONS minimum hashes of the shingles, a and x are below 2 ** 32 so a * x + b fits a uint64
+    hashes = (np.outer(HASH_A, shingles(text)) + HASH_B[:, None]) % PRIME
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signature):
+    # a 63 bit hash of each band of rows of the signature
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'big') >> 1
+            for band in signature.reshape(BANDS, ROWS_PER_BAND)]
+
+
+def similarity(signature, other):
+    # share of equal minimum hashes, an estimate of the jaccard similarity of the shingles
+    return float(np.mean(signature == other))
+
+
+def add_review(cursor, review_id, asin, text):
+    # sign a newly inserted review and put it in its lsh buckets, too short reviews are left out
+    if len(normalize_text(text)) < MIN_TEXT_LENGTH:
+        return
+    signature = minhash(text)
+    cursor.execute(INSERT_MINHASH_QUERY, (review_id, asin, signature.tobytes()))
+    cursor.executemany(INSERT_LSH_QUERY, [(band, bucket, review_id, asin)
+                                          for band, bucket in enumerate(band_buckets(signature))])
+
+
+def prune_near_duplicate_index(cursor, review_ids):
+    # drop the signatures and buckets of reviews that are being deleted, by the
+    # review key and the buckets of their signatures, only DML so it can run inside
+    # the deleting transaction
+    for start in range(0, len(review_ids), SIGN_BATCH_SIZE):
+        chunk = review_ids[start:start + SIGN_BATCH_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT review_id, signature FROM review_minhash WHERE review_id IN ({placeholders})", chunk)
+        buckets = [(band, bucket, review_id) for review_id, signature in cursor.fetchall()
+                   for band, bucket in enumerate(band_buckets(np.frombuffer(bytes(signature), dtype=np.uint32)))]
+        if buckets:
+            cursor.executemany("DELETE FROM review_lsh WHERE band = %s AND bucket = %s AND review_id = %s", buckets)
+        cursor.execute(f"DELETE FROM review_minhash WHERE review_id IN ({placeholders})", chunk)
+
+
+def candidate_pairs(cursor, asin=None, across_asins=False, after=0):
+    # pairs of review ids sharing an lsh bucket, within asin or across asins,
+    # only pairs whose newer review has an id above after
+    query = """SELECT DISTINCT a.review_id, b.review_id FROM review_lsh AS a
+               INNER JOIN review_lsh AS b
+               ON a.band = b.band AND a.bucket = b.bucket AND a.review_id < b.review_id"""
+    where, params = [], []
+    if across_asins:
+        where.append("a.asin <> b.asin")
+        if asin:
+            where.append("(a.asin = %s OR b.asin = %s)")
+            params += [asin, asin]
+    else:
+        where.append("a.asin = %s AND b.asin = %s")
+        params += [asin, asin]
+    if after:
+        where.append("b.review_id > %s")
+        params.append(after)
+
+    cursor.execute(f"{query} WHERE {' AND '.join(where)}", params)
+    return cursor.fetchall()
+
+
+def confirm_pairs(cursor, pairs, threshold=NEAR_DUPLICATE_THRESHOLD):
+    # (review id, review id, similarity, asin, asin) of the candidate pairs similar enough
+    ids = sorted({review_id for pair in pairs for review_id in pair})
+    if not ids:
+        return []
+
+    signatures = {}
+    for start in range(0, len(ids), SIGN_BATCH_SIZE):
+        chunk = ids[start:start + SIGN_BATCH_SIZE]
+        cursor.execute(f"""SELECT review_id, asin, signature FROM review_minhash
+                           WHERE review_id IN ({', '.join(['%s'] * len(chunk))})""", chunk)
+        for review_id, asin, signature in cursor.fetchall():
+            signatures[review_id] = (asin, np.frombuffer(bytes(signature), dtype=np.uint32))
+
+    confirmed = []
+    for first, second in pairs:
+        if first not in signatures or second not in signatures:
+            continue
+        score = similarity(signatures[first][1], signatures[second][1])
+        if score >= threshold:
+            confirmed.append((first, second, score, signatures[first][0], signatures[second][0]))
+    return confirmed
+
+
+def assign_duplicates(pairs, marked=()):
+    # review id -> (id of the review it duplicates, similarity) from confirmed
+    # (older id, newer id, similarity) pairs. Reviews are taken oldest first and each
+    # one points at the most similar older review that is kept, so a review is only
+    # ever marked against a review it is similar to itself, A~B and B~C doesn't make
+    # C a duplicate of A. Reviews in marked are duplicates from an earlier run.
+    older = {}
+    for first, second, score in pairs:
+        older.setdefault(second, []).append((score, -first))
+
+    marked = set(marked)
+    duplicates = {}
+    for review_id in sorted(older):
+        if review_id in marked:
+            continue
+        kept = [(score, first) for score, first in older[review_id]
+                if -first not in marked and -first not in duplicates]
+        if kept:
+            # the most similar, then the oldest
+            score, first = max(kept)
+            duplicates[review_id] = (-first, score)
+    return duplicates
+
+
+def mark_near_duplicates(cursor, asin, threshold=NEAR_DUPLICATE_THRESHOLD):
+    # point the near-duplicates of asin signed since the last run at the review they
+    # duplicate, returns the newly marked review ids. Only DML so it can run inside
+    # the dedup transaction.
+    last_review_id = get_watermark(cursor, asin, STAGE)
+    cursor.execute("SELECT MAX(review_id) FROM review_minhash WHERE asin = %s", (asin,))
+    newest = cursor.fetchone()[0]
+    if newest is None or newest <= last_review_id:
+        return []
+
+    confirmed = confirm_pairs(cursor, candidate_pairs(cursor, asin, after=last_review_id), threshold)
+    ids = sorted({review_id for first, second, _, _, _ in confirmed for review_id in (first, second)})
+    marked = set()
+    for start in range(0, len(ids), SIGN_BATCH_SIZE):
+        chunk = ids[start:start + SIGN_BATCH_SIZE]
+        cursor.execute(f"""SELECT id FROM reviews
+                           WHERE id IN ({', '.join(['%s'] * len(chunk))}) AND duplicate_of IS NOT NULL""", chunk)
+        marked.update(review_id for review_id, in cursor.fetchall())
+
+    duplicates = assign_duplicates([(first, second, score) for first, second, score, _, _ in confirmed], marked)
+    if duplicates:
+        cursor.executemany("UPDATE reviews SET duplicate_of = %s WHERE id = %s",
+                           [(kept, review_id) for review_id, (kept, _) in duplicates.items()])
+    set_watermark(cursor, asin, STAGE, newest)
+    return sorted(duplicates)
+
+
+def unmark_near_duplicates(conn, asin):
+    # put the near-duplicates of asin back into the analysis, they are marked again by
+    # the next dedup if they are still similar enough to the review they duplicate
+    cursor = conn.cursor()
+    cursor.execute("UPDATE reviews SET duplicate_of = NULL WHERE asin = %s AND duplicate_of IS NOT NULL", (asin,))
+    unmarked = cursor.rowcount
+    reset_watermark(cursor, asin, STAGE)
+    conn.commit()
+    cursor.close()
+    return unmarked
+
+
+def near_duplicate_groups(conn, asin):
+    # the marked near-duplicates of asin grouped by the review they duplicate
+    cursor = conn.cursor()
+    cursor.execute("""SELECT duplicate_of, id FROM reviews
+                      WHERE asin = %s AND duplicate_of IS NOT NULL
+                      ORDER BY duplicate_of, id""", (asin,))
+    groups = {}
+    for kept, review_id in cursor.fetchall():
+        groups.setdefault(kept, []).append(review_id)
+    cursor.close()
+    return [{"kept": kept, "duplicates": duplicates} for kept, duplicates in groups.items()]
+
+
+def shared_reviews(conn, asin=None, threshold=NEAR_DUPLICATE_THRESHOLD):
+    # number of near-duplicate review pairs between each two asins, for asin or every asin
+    cursor = conn.cursor()
+    confirmed = confirm_pairs(cursor, candidate_pairs(cursor, asin, across_asins=True), threshold)
+    cursor.close()
+
+    counts = {}
+    for _, _, _, first_asin, second_asin in confirmed:
+        key = tuple(sorted((first_asin, second_asin)))
+        counts[key] = counts.get(key, 0) + 1
+    return [{"asins": list(key), "shared_reviews": count}
+            for key, count in sorted(counts.items(), key=lambda item: -item[1])]
+
+
+def backfill(conn, asins=None):
+    # sign the reviews that have no signature yet, returns how many were read
+    cursor = conn.cursor()
+
+    where = "m.review_id IS NULL"
+    params = []
+    if asins:
+        where += f" AND r.asin IN ({', '.join(['%s'] * len(asins))})"
+        params += list(asins)
+
+    # too short reviews stay unsigned, so page by id instead of rereading them
+    last_review_id = 0
+    signed = 0
+    while True:
+        cursor.execute(f"""SELECT r.id, r.asin, r.text FROM reviews AS r
+                           LEFT JOIN review_minhash AS m ON m.review_id = r.id
+                           WHERE {where} AND r.id > %s
+                           ORDER BY r.id
+                           LIMIT %s""", params + [last_review_id, SIGN_BATCH_SIZE])
+        reviews = cursor.fetchall()
+        if not reviews:
+            break
+        for review_id, asin, text in reviews:
+            add_review(cursor, review_id, asin, text)
+        conn.commit()
+        last_review_id = reviews[-1][0]
+        signed += len(reviews)
+
+    # the reviews signed here are older than the ones already compared, the next
+    # dedup compares every review of these asins again
+    if signed:
+        if asins:
+            cursor.executemany("DELETE FROM analysis_watermarks WHERE asin = %s AND stage = %s",
+                               [(asin, STAGE) for asin in asins])
+        else:
+            cursor.execute("DELETE FROM analysis_watermarks WHERE stage = %s", (STAGE,))
+        conn.commit()
+
+    cursor.close()
+    return signed
+
+
+if __name__ == "__main__":
+    from amazon.rollups import rebuild_rollups
+    from amazon.search_index import rebuild_search_index
+    from amazon.sentiment_scores import reset_review_scores
+    from amazon.term_frequencies import rebuild_term_frequencies
+
+    command, asins = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+
+    conn = get_db_connection()
+    if command == "backfill":
+        print(f"Read {backfill(conn, asins)} unsigned reviews")
+    elif command == "unmark":
+        # the stages that left the near-duplicates out count them again
+        for asin in asins:
+            print(f"Unmarked {unmark_near_duplicates(conn, asin)} near-duplicates of {asin}")
+            rebuild_term_frequencies(conn, asin)
+            rebuild_search_index(conn, asin)
+            reset_review_scores(conn, asin)
+            rebuild_rollups(conn, [asin])
+    elif command == "report":
+        for asin in asins or [None]:
+            for shared in shared_reviews(conn, asin):
+                print(f"{shared['asins'][0]} {shared['asins'][1]}: {shared['shared_reviews']} shared reviews")
+    else:
+        print("usage: python -m amazon.near_duplicates backfill|unmark|report [ASIN ...]")
+    conn.close()
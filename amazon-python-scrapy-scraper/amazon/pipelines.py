@@ -8,10 +8,20 @@
 from itemadapter import ItemAdapter
 
 
+import json
+import re
+
 import mysql.connector
 
+from amazon.items import AmazonProductItem
+from amazon.rollups import increment_rollup, increment_facet
+from amazon.versions import bump_review_version
+from amazon.explorer import ensure_review_index
+from amazon.near_duplicates import add_review
+from amazon.schema import create_analysis_tables
+
 class DatabasePipeline:
-    def __init__(self, host, port, database, user, password):
+    def __init__(self, host, port, database, user, password, replay=False, stats=None):
         self.host = host
         self.port = port
         self.database = database
@@ -20,6 +30,10 @@ class DatabasePipeline:
         self.conn = None
         self.cursor = None
 
+        ## replayed pages hold reviews that were stored when they were first crawled
+        self.replay = replay
+        self.stats = stats
+
         self.conn = mysql.connector.connect(
             host = host,
             user = user,
@@ -56,6 +70,12 @@ class DatabasePipeline:
         )
         """)
 
+        ## index for paging through the reviews of an asin, and the tables of the analysis stages
+        ## (per asin review counts for the dashboard, versions, search index,
+        ## minhash signatures for finding near-duplicate reviews, ...)
+        ensure_review_index(self.cur)
+        create_analysis_tables(self.cur)
+
     @classmethod
     def from_crawler(cls, crawler):
         settings = crawler.settings
@@ -64,7 +84,8 @@ class DatabasePipeline:
         database = settings.get('MYSQL_DATABASE')
         user = "admin"
         password = settings.get('MYSQL_PASSWORD')
-        return cls(host, port, database, user, password)
+        replay = settings.get('PAGE_ARCHIVE_MODE') == 'replay'
+        return cls(host, port, database, user, password, replay=replay, stats=crawler.stats)
 
     def open_spider(self, spider):
         self.conn = mysql.connector.connect(
@@ -79,17 +100,249 @@ class DatabasePipeline:
     def close_spider(self, spider):
         self.conn.close()
 
+    def review_exists(self, item):
+        # same asin, date and text, found through the reviews_asin_date index
+        self.cursor.execute("SELECT id FROM reviews WHERE asin = %s AND date = %s AND text = %s LIMIT 1",
+                            (item['asin'], item['date'].strftime('%Y-%m-%d'), item['text']))
+        return self.cursor.fetchone() is not None
+
     def process_item(self, item, spider):
 
-        
+        # a replay only adds the reviews the first parse of its pages missed
+        if self.replay and self.review_exists(item):
+            if self.stats:
+                self.stats.inc_value('reviews/already_stored', spider=spider)
+            return item
+
         # Adapt this code to match your item structure and database table
         query = "INSERT INTO reviews (asin, text, title, location, date, verified, rating) VALUES (%s, %s, %s, %s, %s, %s, %s)"
         values = (item['asin'], item['text'], item['title'], item['location'], item['date'].strftime('%Y-%m-%d'), item['verified'], item['rating'])
         self.cursor.execute(query, values)
+        review_id = self.cursor.lastrowid
+
+        # keep the rollups in the same transaction as the review
+        increment_rollup(self.cursor, item['asin'], item['date'], item['rating'], item['verified'])
+        increment_facet(self.cursor, item['asin'], item['date'], item['rating'], item['verified'], item['location'])
+        bump_review_version(self.cursor, item['asin'])
+        add_review(self.cursor, review_id, item['asin'], item['text'])
         self.conn.commit()
+        if self.stats:
+            self.stats.inc_value('reviews/inserted', spider=spider)
         return item
 
 
+def parse_count(value):
+    # "1,234" -> 1234
+    digits = re.sub(r"[^\d]", "", value or "")
+    return int(digits) if digits else None
+
+
+def parse_price(value):
+    # "$1,299.99" -> 1299.99
+    match = re.search(r"\d[\d,]*(?:\.\d+)?", value or "")
+    return float(match.group(0).replace(",", "")) if match else None
+
+
+def parse_stars(value):
+    # "4.5 out of 5 stars" -> 4.5
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group(0)) if match else None
+
+
+class ProductCatalogPipeline:
+    # Sink for the search spiders. Search results and product pages are batch
+    # upserted into normalized tables keyed by asin:
+    # - product_catalog: what the search results say about a product
+    # - product_details: what its product page says
+    # - price_history: one price per product per day, updated in place
+    # Items are de-duplicated by asin before every bulk write, so repeated crawls
+    # update rows instead of adding new ones. Products that had a review crawl
+    # queued for them are also added to product_names for the dashboard.
+
+    def __init__(self, host, port, database, user, password, batch_size=100):
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.password = password
+        self.batch_size = batch_size
+        self.conn = None
+        self.cursor = None
+        self.reset_batch()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('MYSQL_HOST'),
+            settings.get('MYSQL_PORT'),
+            settings.get('MYSQL_DATABASE'),
+            settings.get('MYSQL_USER'),
+            settings.get('MYSQL_PASSWORD'),
+            batch_size=settings.getint('PRODUCT_BATCH_SIZE', 100),
+        )
+
+    def open_spider(self, spider):
+        self.conn = mysql.connector.connect(
+            host=self.host,
+            port=self.port,
+            database=self.database,
+            user=self.user,
+            password=self.password
+        )
+        self.cursor = self.conn.cursor()
+
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_catalog(
+            asin VARCHAR(10) NOT NULL,
+            title text,
+            url text,
+            keyword VARCHAR(255),
+            ad bool,
+            organic_rank int,
+            rating float,
+            rating_count int,
+            thumbnail_url text,
+            first_seen datetime,
+            last_seen datetime,
+            PRIMARY KEY (asin)
+        )
+        """)
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_details(
+            asin VARCHAR(10) NOT NULL,
+            name text,
+            url text,
+            stars float,
+            rating_count int,
+            feature_bullets json,
+            images json,
+            variant_data json,
+            updated_at datetime,
+            PRIMARY KEY (asin)
+        )
+        """)
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_history(
+            asin VARCHAR(10) NOT NULL,
+            observed_on date NOT NULL,
+            price decimal(10, 2),
+            list_price decimal(10, 2),
+            PRIMARY KEY (asin, observed_on)
+        )
+        """)
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_names(
+            asin VARCHAR(10),
+            product_name text,
+            PRIMARY KEY (asin)
+        )
+        """)
+        self.conn.commit()
+
+    def close_spider(self, spider):
+        self.flush()
+        self.conn.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        asin = adapter.get('asin')
+        if not asin:
+            return item
+
+        # later sightings of an asin in the same crawl replace the earlier ones
+        if isinstance(item, AmazonProductItem):
+            self.add_product_details(asin, adapter)
+        else:
+            self.add_search_result(asin, adapter)
+
+        if len(self.catalog) + len(self.details) >= self.batch_size:
+            self.flush()
+        return item
+
+    def add_search_result(self, asin, adapter):
+        self.catalog[asin] = (
+            asin,
+            adapter.get('title'),
+            adapter.get('url'),
+            adapter.get('keyword'),
+            adapter.get('ad'),
+            adapter.get('organic_rank'),
+            adapter.get('rating'),
+            parse_count(adapter.get('rating_count')),
+            adapter.get('thumbnail_url'),
+        )
+        self.add_price(asin, adapter.get('price'), adapter.get('real_price'))
+
+        if adapter.get('review_crawl_job'):
+            self.product_names[asin] = (asin, adapter.get('title') or asin)
+
+    def add_product_details(self, asin, adapter):
+        self.details[asin] = (
+            asin,
+            adapter.get('name'),
+            adapter.get('url'),
+            parse_stars(adapter.get('stars')),
+            parse_count(adapter.get('rating_count')),
+            json.dumps(adapter.get('feature_bullets') or []),
+            json.dumps(adapter.get('images') or []),
+            json.dumps(adapter.get('variant_data') or {}),
+        )
+        self.add_price(asin, adapter.get('price'), None)
+
+    def add_price(self, asin, price, list_price):
+        price = parse_price(price)
+        if price is None:
+            return
+        previous = self.prices.get(asin)
+        # keep a list price seen earlier in the crawl if this sighting has none
+        list_price = parse_price(list_price) or (previous[2] if previous else None)
+        self.prices[asin] = (asin, price, list_price)
+
+    def reset_batch(self):
+        self.catalog = {}
+        self.details = {}
+        self.prices = {}
+        self.product_names = {}
+
+    def flush(self):
+        if self.catalog:
+            query = """INSERT INTO product_catalog
+                (asin, title, url, keyword, ad, organic_rank, rating, rating_count, thumbnail_url, first_seen, last_seen)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                ON DUPLICATE KEY UPDATE
+                    title = VALUES(title), url = VALUES(url), keyword = VALUES(keyword), ad = VALUES(ad),
+                    organic_rank = VALUES(organic_rank), rating = VALUES(rating),
+                    rating_count = VALUES(rating_count), thumbnail_url = VALUES(thumbnail_url),
+                    last_seen = NOW()"""
+            self.cursor.executemany(query, list(self.catalog.values()))
+
+        if self.details:
+            query = """INSERT INTO product_details
+                (asin, name, url, stars, rating_count, feature_bullets, images, variant_data, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE
+                    name = VALUES(name), url = VALUES(url), stars = VALUES(stars),
+                    rating_count = VALUES(rating_count), feature_bullets = VALUES(feature_bullets),
+                    images = VALUES(images), variant_data = VALUES(variant_data), updated_at = NOW()"""
+            self.cursor.executemany(query, list(self.details.values()))
+
+        if self.prices:
+            # one row per product per day, so a second crawl on the same day updates the price in place
+            query = """INSERT INTO price_history (asin, observed_on, price, list_price)
+                VALUES (%s, CURDATE(), %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    price = VALUES(price), list_price = COALESCE(VALUES(list_price), list_price)"""
+            self.cursor.executemany(query, list(self.prices.values()))
+
+        if self.product_names:
+            query = "INSERT IGNORE INTO product_names (asin, product_name) VALUES (%s, %s)"
+            self.cursor.executemany(query, list(self.product_names.values()))
+
+        self.conn.commit()
+        self.reset_batch()
+
+
 # from scrapy.exceptions import CloseSpider
 # from twisted.internet import reactor
 
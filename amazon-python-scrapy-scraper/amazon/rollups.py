@@ -0,0 +1,108 @@
+# Per-asin review counts by month and rating.
+#
+# DatabasePipeline bumps these as reviews are inserted so the dashboard can draw
+# the ratings graph and review count from a few dozen rows instead of every
+# review. review_facets splits the same counts further by verified and location,
+# which the dashboard ships to the browser once and filters client side.
+# Near-duplicates marked by the dedup are counted when they are inserted and
+# taken back out when it rebuilds the rows of their asin. Rebuild both from the
+# reviews table with:
+#
+#   python -m amazon.rollups            # every asin
+#   python -m amazon.rollups B01GGKYKQM # just these asins
+
+import sys
+
+from amazon.db import get_db_connection
+
+
+CREATE_ROLLUP_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_rollups(
+    asin VARCHAR(10) NOT NULL,
+    month CHAR(7) NOT NULL,
+    rating int NOT NULL,
+    count int NOT NULL,
+    verified_count int NOT NULL,
+    PRIMARY KEY (asin, month, rating)
+)
+"""
+
+INCREMENT_ROLLUP_QUERY = """
+INSERT INTO review_rollups (asin, month, rating, count, verified_count)
+VALUES (%s, %s, %s, 1, %s)
+ON DUPLICATE KEY UPDATE count = count + 1, verified_count = verified_count + VALUES(verified_count)
+"""
+
+# the %% are escaped for the mysql connector's parameter substitution
+REBUILD_ROLLUP_QUERY = """
+INSERT INTO review_rollups (asin, month, rating, count, verified_count)
+SELECT asin, DATE_FORMAT(date, '%%Y-%%m'), rating, COUNT(*), SUM(verified)
+FROM reviews
+WHERE duplicate_of IS NULL{where}
+GROUP BY asin, DATE_FORMAT(date, '%%Y-%%m'), rating
+"""
+
+# location is part of the key so it can't be null, reviews without one use ''
+CREATE_FACET_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_facets(
+    asin VARCHAR(10) NOT NULL,
+    month CHAR(7) NOT NULL,
+    rating int NOT NULL,
+    verified bool NOT NULL,
+    location VARCHAR(64) NOT NULL,
+    count int NOT NULL,
+    PRIMARY KEY (asin, month, rating, verified, location)
+)
+"""
+
+INCREMENT_FACET_QUERY = """
+INSERT INTO review_facets (asin, month, rating, verified, location, count)
+VALUES (%s, %s, %s, %s, %s, 1)
+ON DUPLICATE KEY UPDATE count = count + 1
+"""
+
+REBUILD_FACET_QUERY = """
+INSERT INTO review_facets (asin, month, rating, verified, location, count)
+SELECT asin, DATE_FORMAT(date, '%%Y-%%m'), rating, COALESCE(verified, 0), LEFT(COALESCE(location, ''), 64), COUNT(*)
+FROM reviews
+WHERE duplicate_of IS NULL{where}
+GROUP BY asin, DATE_FORMAT(date, '%%Y-%%m'), rating, COALESCE(verified, 0), LEFT(COALESCE(location, ''), 64)
+"""
+
+
+def increment_rollup(cursor, asin, date, rating, verified):
+    cursor.execute(INCREMENT_ROLLUP_QUERY, (asin, date.strftime('%Y-%m'), int(float(rating)), int(bool(verified))))
+
+
+def increment_facet(cursor, asin, date, rating, verified, location):
+    cursor.execute(INCREMENT_FACET_QUERY, (asin, date.strftime('%Y-%m'), int(float(rating)), int(bool(verified)), (location or '')[:64]))
+
+
+def create_rollup_tables(cursor):
+    cursor.execute(CREATE_ROLLUP_TABLE_QUERY)
+    cursor.execute(CREATE_FACET_TABLE_QUERY)
+
+
+def rebuild_rollup_rows(cursor, asins=None):
+    # recount the rollups and facets of asins from the reviews, without committing
+    for table, rebuild_query in (("review_rollups", REBUILD_ROLLUP_QUERY), ("review_facets", REBUILD_FACET_QUERY)):
+        if asins:
+            placeholders = ', '.join(['%s'] * len(asins))
+            cursor.execute(f"DELETE FROM {table} WHERE asin IN ({placeholders})", tuple(asins))
+            cursor.execute(rebuild_query.format(where=f" AND asin IN ({placeholders})"), tuple(asins))
+        else:
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(rebuild_query.format(where=""), ())
+
+
+def rebuild_rollups(conn, asins=None):
+    cursor = conn.cursor()
+    rebuild_rollup_rows(cursor, asins)
+    conn.commit()
+    cursor.close()
+
+
+if __name__ == "__main__":
+    conn = get_db_connection()
+    rebuild_rollups(conn, sys.argv[1:])
+    conn.close()
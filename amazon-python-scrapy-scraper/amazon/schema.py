@@ -0,0 +1,48 @@
+# Tables the analysis stages and the api read and write.
+#
+# MySQL commits the open transaction before every DDL statement, so a CREATE
+# TABLE in the middle of a stage would split its writes into separate commits.
+# The tables are created here once instead, when DatabasePipeline starts, when
+# the api starts, or by hand with:
+#
+#   python -m amazon.schema
+
+from amazon.db import get_db_connection
+from amazon.near_duplicates import create_near_duplicate_tables
+from amazon.rollups import create_rollup_tables
+from amazon.search_index import create_postings_table
+from amazon.sentiment_scores import create_score_tables
+from amazon.term_frequencies import CREATE_TERM_TABLE_QUERY
+from amazon.versions import CREATE_VERSION_TABLE_QUERY
+from amazon.watermarks import CREATE_WATERMARK_TABLE_QUERY
+
+
+CREATE_ANALYSIS_RUNS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS analysis_runs(
+    asin VARCHAR(10) NOT NULL,
+    finished_at datetime(6),
+    PRIMARY KEY (asin)
+)
+"""
+
+
+def create_analysis_tables(cursor):
+    # the watermarks first, create_postings_table may reset the search index watermarks
+    cursor.execute(CREATE_WATERMARK_TABLE_QUERY)
+    cursor.execute(CREATE_VERSION_TABLE_QUERY)
+    cursor.execute(CREATE_ANALYSIS_RUNS_TABLE_QUERY)
+    create_rollup_tables(cursor)
+    cursor.execute(CREATE_TERM_TABLE_QUERY)
+    create_postings_table(cursor)
+    create_score_tables(cursor)
+    create_near_duplicate_tables(cursor)
+
+
+if __name__ == "__main__":
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    create_analysis_tables(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print("Created the analysis tables")
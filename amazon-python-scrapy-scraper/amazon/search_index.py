@@ -0,0 +1,235 @@
+# Inverted index of review text for keyword search.
+#
+# review_postings maps (asin, term) to the reviews containing it and the token
+# positions of the term in each review, so a search reads a few index rows
+# instead of every review of the product. Every token is indexed as written
+# (kind "w") and as its WordNet lemma (kind "l"), so searching "cable" also finds
+# "cables" while an exact search only finds "cable". The index is updated
+# incrementally after each crawl (see analysis_pipeline.index_reviews), the
+# postings of deleted reviews are removed with them (see delete_review_postings),
+# and it can be updated or rebuilt by hand with:
+#
+#   python -m amazon.search_index B01GGKYKQM
+#   python -m amazon.search_index --rebuild B01GGKYKQM
+
+import re
+import sys
+
+from amazon.db import get_db_connection
+from amazon.text import get_stop_words, lemmatize
+from amazon.watermarks import get_watermark, set_watermark, reset_watermark
+
+
+STAGE = "search_index"
+
+TOKEN_RE = re.compile(r"\w+(?:'\w+)?")
+MAX_TERM_LENGTH = 64
+
+# reviews read and indexed per transaction
+INDEX_BATCH_SIZE = 1000
+
+# kinds of postings, tokens as written and their lemmas
+WORD = 'w'
+LEMMA = 'l'
+
+# tokens shown either side of a match, and matches shown per review
+SNIPPET_WINDOW = 8
+MAX_SNIPPETS = 3
+
+CREATE_POSTINGS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_postings(
+    asin VARCHAR(10) NOT NULL,
+    kind CHAR(1) NOT NULL,
+    term VARCHAR(64) NOT NULL,
+    review_id int NOT NULL,
+    rating int,
+    positions text NOT NULL,
+    PRIMARY KEY (asin, kind, term, review_id),
+    KEY review (asin, review_id)
+)
+"""
+
+INSERT_POSTINGS_QUERY = """
+INSERT IGNORE INTO review_postings (asin, kind, term, review_id, rating, positions)
+VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+def tokenize(text):
+    # (normalized token, (start, end) in text) for every token
+    return [(match.group().lower(), match.span()) for match in TOKEN_RE.finditer(text or '')]
+
+
+def index_terms(text):
+    # (kind, term) -> positions of the tokens it was indexed from
+    postings = {}
+    stop_words = get_stop_words()
+
+    for position, (token, _) in enumerate(tokenize(text)):
+        if token in stop_words or len(token) > MAX_TERM_LENGTH:
+            continue
+        postings.setdefault((WORD, token), []).append(position)
+        postings.setdefault((LEMMA, lemmatize(token)), []).append(position)
+
+    return postings
+
+
+def create_postings_table(cursor):
+    # called by amazon.schema, postings from before terms had a kind can't tell words from lemmas, they are
+    # dropped and the index is rebuilt by the next update
+    cursor.execute("""SELECT COUNT(*), SUM(column_name = 'kind') FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = 'review_postings'""")
+    columns, has_kind = cursor.fetchone()
+    if columns and not has_kind:
+        cursor.execute("DROP TABLE review_postings")
+        cursor.execute("DELETE FROM analysis_watermarks WHERE stage = %s", (STAGE,))
+    cursor.execute(CREATE_POSTINGS_TABLE_QUERY)
+
+
+def delete_review_postings(cursor, asin, review_ids):
+    # remove reviews that are about to be deleted from the index, by the review key
+    for start in range(0, len(review_ids), INDEX_BATCH_SIZE):
+        chunk = review_ids[start:start + INDEX_BATCH_SIZE]
+        cursor.execute(f"""DELETE FROM review_postings
+                           WHERE asin = %s AND review_id IN ({', '.join(['%s'] * len(chunk))})""", [asin] + chunk)
+
+
+def update_search_index(conn, asin):
+    # index the reviews of asin added since the last update, returns how many were indexed
+    cursor = conn.cursor()
+
+    last_review_id = get_watermark(cursor, asin, STAGE)
+    conn.commit()
+
+    indexed = 0
+    while True:
+        cursor.execute("SELECT id, text, rating FROM reviews WHERE asin = %s AND id > %s AND duplicate_of IS NULL ORDER BY id LIMIT %s",
+                       (asin, last_review_id, INDEX_BATCH_SIZE))
+        reviews = cursor.fetchall()
+        if not reviews:
+            break
+
+        rows = []
+        for review_id, text, rating in reviews:
+            for (kind, term), positions in index_terms(text).items():
+                rows.append((asin, kind, term, review_id, rating, ','.join(map(str, positions))))
+        if rows:
+            cursor.executemany(INSERT_POSTINGS_QUERY, rows)
+
+        # the postings and the watermark are committed together
+        last_review_id = reviews[-1][0]
+        set_watermark(cursor, asin, STAGE, last_review_id)
+        conn.commit()
+        indexed += len(reviews)
+
+    cursor.close()
+    return indexed
+
+
+def rebuild_search_index(conn, asin):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM review_postings WHERE asin = %s", (asin,))
+    reset_watermark(cursor, asin, STAGE)
+    conn.commit()
+    cursor.close()
+
+    return update_search_index(conn, asin)
+
+
+def keyword_in_context(text, positions, window=SNIPPET_WINDOW, max_snippets=MAX_SNIPPETS):
+    # the words around each matched token, split into before, match and after
+    spans = [span for _, span in tokenize(text)]
+    snippets = []
+
+    for position in sorted(set(positions)):
+        if position >= len(spans):
+            continue
+        if len(snippets) == max_snippets:
+            break
+
+        start, end = spans[position]
+        before_start = spans[max(position - window, 0)][0]
+        after_end = spans[min(position + window, len(spans) - 1)][1]
+
+        snippets.append({
+            "before": ('...' if position > window else '') + text[before_start:start],
+            "match": text[start:end],
+            "after": text[end:after_end] + ('...' if position + window < len(spans) - 1 else ''),
+        })
+
+    return snippets
+
+
+def search_reviews(conn, asin, query, ratings=None, after=None, limit=20, exact=False):
+    # newest reviews of asin containing every word of query, limit at a time
+    # pass the returned next value as after to get the following page
+    stop_words = get_stop_words()
+    tokens = [token for token, _ in tokenize(query) if token not in stop_words]
+
+    # lemmas match every form of a word, exact only matches it as written
+    terms = sorted({token if exact else lemmatize(token) for token in tokens})
+    if not terms:
+        return {"query": query, "terms": [], "results": [], "next": None}
+
+    where = f"asin = %s AND kind = %s AND term IN ({', '.join(['%s'] * len(terms))})"
+    params = [asin, WORD if exact else LEMMA] + terms
+    if after:
+        where += " AND review_id < %s"
+        params.append(after)
+    if ratings:
+        where += f" AND rating IN ({', '.join(['%s'] * len(ratings))})"
+        params += list(ratings)
+
+    cursor = conn.cursor()
+
+    # the positions of every term are concatenated, make sure long reviews aren't cut off
+    cursor.execute("SET SESSION group_concat_max_len = 1048576")
+
+    # one row per term per review, so a review matching every term has len(terms) rows
+    cursor.execute(f"""SELECT review_id, GROUP_CONCAT(positions) FROM review_postings
+                       WHERE {where}
+                       GROUP BY review_id
+                       HAVING COUNT(*) = %s
+                       ORDER BY review_id DESC
+                       LIMIT %s""", params + [len(terms), limit + 1])
+    hits = cursor.fetchall()
+
+    # one extra row tells whether there is another page
+    next_review_id = hits[limit - 1][0] if len(hits) > limit else None
+    hits = hits[:limit]
+
+    reviews = {}
+    if hits:
+        ids = [review_id for review_id, _ in hits]
+        cursor.execute(f"""SELECT id, title, text, date, rating, verified, location FROM reviews
+                           WHERE id IN ({', '.join(['%s'] * len(ids))})""", ids)
+        reviews = {row[0]: row for row in cursor.fetchall()}
+
+    cursor.close()
+
+    results = []
+    for review_id, positions in hits:
+        if review_id not in reviews:
+            continue
+        _, title, text, date, rating, verified, location = reviews[review_id]
+        results.append({
+            "id": review_id,
+            "title": title,
+            "date": str(date),
+            "rating": rating,
+            "verified": bool(verified),
+            "location": location,
+            "snippets": keyword_in_context(text, [int(p) for p in positions.split(',')]),
+        })
+
+    return {"query": query, "terms": terms, "results": results, "next": next_review_id}
+
+
+if __name__ == "__main__":
+    rebuild = "--rebuild" in sys.argv[1:]
+    asins = [arg for arg in sys.argv[1:] if arg != "--rebuild"]
+
+    conn = get_db_connection()
+    for asin in asins:
+        indexed = rebuild_search_index(conn, asin) if rebuild else update_search_index(conn, asin)
+        print(f"Indexed {indexed} reviews of {asin}")
+    conn.close()
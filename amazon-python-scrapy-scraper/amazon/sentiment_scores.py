@@ -0,0 +1,139 @@
+# Predicted sentiment of every review.
+#
+# After the sentiment model of an asin is trained, the reviews inserted since the
+# last run are scored with it in batches and the probability that each review is
+# positive is stored in review_scores, scaled to a small int. sentiment_rollups
+# sums the scores per month so the dashboard can chart the monthly average
+# without reading the scores. The tables are created by amazon.schema. Rescore
+# every review of an asin with the next model with:
+#
+#   python -m amazon.sentiment_scores --rescore B01GGKYKQM
+
+import sys
+
+from amazon.db import get_db_connection
+from amazon.watermarks import get_watermark, set_watermark, reset_watermark
+
+
+STAGE = "sentiment_scores"
+
+# probabilities are stored as round(probability * SCORE_SCALE) in a SMALLINT UNSIGNED
+SCORE_SCALE = 10000
+
+# reviews read and scored per transaction
+SCORE_BATCH_SIZE = 2000
+
+CREATE_SCORES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_scores(
+    review_id int NOT NULL,
+    asin VARCHAR(10) NOT NULL,
+    month CHAR(7) NOT NULL,
+    score SMALLINT UNSIGNED NOT NULL,
+    PRIMARY KEY (review_id),
+    KEY asin_month (asin, month)
+)
+"""
+
+CREATE_SENTIMENT_ROLLUP_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS sentiment_rollups(
+    asin VARCHAR(10) NOT NULL,
+    month CHAR(7) NOT NULL,
+    score_sum bigint NOT NULL,
+    count int NOT NULL,
+    PRIMARY KEY (asin, month)
+)
+"""
+
+INSERT_SCORES_QUERY = """
+INSERT INTO review_scores (review_id, asin, month, score)
+VALUES (%s, %s, %s, %s)
+"""
+
+ADD_SENTIMENT_ROLLUP_QUERY = """
+INSERT INTO sentiment_rollups (asin, month, score_sum, count)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE score_sum = score_sum + VALUES(score_sum), count = count + VALUES(count)
+"""
+
+
+def create_score_tables(cursor):
+    cursor.execute(CREATE_SCORES_TABLE_QUERY)
+    cursor.execute(CREATE_SENTIMENT_ROLLUP_TABLE_QUERY)
+
+
+def score_new_reviews(conn, asin, pipeline):
+    # score the reviews of asin added since the last run with a fitted sentiment pipeline,
+    # returns how many were scored
+    cursor = conn.cursor()
+
+    positive = list(pipeline.classes_).index('positive')
+    last_review_id = get_watermark(cursor, asin, STAGE)
+    conn.commit()
+
+    scored = 0
+    while True:
+        # the %% are escaped for the mysql connector's parameter substitution
+        cursor.execute("SELECT id, text, DATE_FORMAT(date, '%%Y-%%m') FROM reviews WHERE asin = %s AND id > %s AND duplicate_of IS NULL ORDER BY id LIMIT %s",
+                       (asin, last_review_id, SCORE_BATCH_SIZE))
+        reviews = cursor.fetchall()
+        if not reviews:
+            break
+
+        # one predict_proba call per batch
+        probabilities = pipeline.predict_proba([text or '' for _, text, _ in reviews])[:, positive]
+        scores = (probabilities * SCORE_SCALE).round().astype(int).tolist()
+
+        rollups = {}
+        for (_, _, month), score in zip(reviews, scores):
+            score_sum, count = rollups.get(month, (0, 0))
+            rollups[month] = (score_sum + score, count + 1)
+
+        cursor.executemany(INSERT_SCORES_QUERY, [(review_id, asin, month, score)
+                                                 for (review_id, _, month), score in zip(reviews, scores)])
+        cursor.executemany(ADD_SENTIMENT_ROLLUP_QUERY, [(asin, month, score_sum, count)
+                                                        for month, (score_sum, count) in rollups.items()])
+
+        # the scores, rollups and watermark are committed together
+        last_review_id = reviews[-1][0]
+        set_watermark(cursor, asin, STAGE, last_review_id)
+        conn.commit()
+        scored += len(reviews)
+
+    cursor.close()
+    return scored
+
+
+def prune_review_scores(cursor, asin, review_ids):
+    # drop the scores of reviews of asin that are being deleted and recount its rollups
+    # from the scores left, only DML so it can run inside the deleting transaction
+    for start in range(0, len(review_ids), SCORE_BATCH_SIZE):
+        chunk = review_ids[start:start + SCORE_BATCH_SIZE]
+        cursor.execute(f"DELETE FROM review_scores WHERE review_id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+    cursor.execute("DELETE FROM sentiment_rollups WHERE asin = %s", (asin,))
+    cursor.execute("""INSERT INTO sentiment_rollups (asin, month, score_sum, count)
+                      SELECT asin, month, SUM(score), COUNT(*) FROM review_scores
+                      WHERE asin = %s
+                      GROUP BY asin, month""", (asin,))
+
+
+def reset_review_scores(conn, asin):
+    # the next run scores every review of asin again
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM review_scores WHERE asin = %s", (asin,))
+    cursor.execute("DELETE FROM sentiment_rollups WHERE asin = %s", (asin,))
+    reset_watermark(cursor, asin, STAGE)
+    conn.commit()
+    cursor.close()
+
+
+if __name__ == "__main__":
+    # the scores are written by the next sentiment model run, see analysis_pipeline
+    if sys.argv[1:2] != ["--rescore"] or len(sys.argv) < 3:
+        print("usage: python -m amazon.sentiment_scores --rescore ASIN [ASIN ...]")
+        sys.exit(1)
+
+    conn = get_db_connection()
+    for asin in sys.argv[2:]:
+        reset_review_scores(conn, asin)
+        print(f"Every review of {asin} will be scored by its next sentiment model")
+    conn.close()
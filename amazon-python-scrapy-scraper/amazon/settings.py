@@ -20,27 +20,83 @@ SCRAPEOPS_PROXY_SETTINGS = {'country': 'us'}
 # Add In The ScrapeOps Monitoring Extension
 EXTENSIONS = {
 'scrapeops_scrapy.extension.ScrapeOpsMonitor': 500, 
+'amazon.extensions.AdaptiveConcurrency': 510,
 }
 
 LOG_LEVEL = 'INFO'
 
+SPIDER_MIDDLEWARES = {
+    ## Persisted request frontier for resumable crawls
+    'amazon.middlewares.CrawlFrontierMiddleware': 50,
+}
+
 DOWNLOADER_MIDDLEWARES = {
 
     ## ScrapeOps Monitor
     'scrapeops_scrapy.middleware.retry.RetryMiddleware': 550,
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
     
+    ## Captcha / js rendered review page retries
+    'amazon.middlewares.ReviewPageRetryMiddleware': 540,
+
+    ## Raw page archive, records after the proxy and replays before the budget and proxy
+    'amazon.middlewares.PageArchiveMiddleware': 600,
+
+    ## Shared proxy page budget, checked right before the proxy
+    'amazon.middlewares.PageBudgetMiddleware': 700,
+
     ## Proxy Middleware
     'scrapeops_scrapy_proxy_sdk.scrapeops_scrapy_proxy_sdk.ScrapeOpsScrapyProxySdk': 725,
 
-    # Enable Scrapy-Fake-UserAgent
-    # 'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
-    # 'scrapy_fake_useragent.middleware.RandomUserAgentMiddleware': 400,    
+    ## User-Agent pool, loaded once from amazon/data/user_agents.txt
+    'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
+    'amazon.middlewares.UserAgentPoolMiddleware': 400,
 }
 
+# User-Agent rotation: "request" picks a new one per request,
+# "session" keeps one per request.meta["proxy_session"]
+USER_AGENT_LIST = None
+USER_AGENT_ROTATION = 'request'
+
+# Retries for captcha and js rendered review pages, backoff in seconds
+REVIEW_RETRY_TIMES = 3
+REVIEW_RETRY_BACKOFF_BASE = 2.0
+REVIEW_RETRY_BACKOFF_MAX = 60.0
+
 # Max Concurrency On ScrapeOps Proxy Free Plan is 1 thread
 CONCURRENT_REQUESTS = 1
 
+# Adaptive concurrency - turn on for paid proxy plans, CONCURRENT_REQUESTS is the starting point
+# and concurrency/delay move within these bounds based on latency, retries and captchas
+ADAPTIVE_CONCURRENCY_ENABLED = False
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX = 8
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 5.0
+ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE = 0.1
+ADAPTIVE_CONCURRENCY_MIN_DELAY = 0.0
+ADAPTIVE_CONCURRENCY_MAX_DELAY = 30.0
+ADAPTIVE_CONCURRENCY_INTERVAL = 30.0
+
+# Redis - task queue and shared page budget
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# Proxy page budget shared by all workers, buckets refill over PAGE_BUDGET_PERIOD seconds
+# ScrapeOps free plan allows 1000 pages a month
+PAGE_BUDGET_ENABLED = True
+PAGE_BUDGET_GLOBAL = 1000
+PAGE_BUDGET_PER_ASIN = 200
+PAGE_BUDGET_PERIOD = 30 * 24 * 60 * 60
+
+# Resumable crawls - where the request frontier of a job id is kept, "local" or "redis"
+CRAWL_FRONTIER_BACKEND = 'local'
+CRAWL_FRONTIER_DIR = 'crawls'
+
+# Raw page archive - "off", "record" every downloaded page or "replay" pages from the archive
+PAGE_ARCHIVE_MODE = os.getenv("PAGE_ARCHIVE_MODE", "off")
+PAGE_ARCHIVE_DIR = 'archive'
+PAGE_ARCHIVE_SEGMENT_SIZE = 64 * 1024 * 1024
+
 # MySQL database settings
 MYSQL_HOST = os.getenv("MYSQL_HOST")
 MYSQL_PORT = 3306
@@ -52,6 +108,12 @@ ITEM_PIPELINES = {
     'amazon.pipelines.DatabasePipeline': 300,
 }
 
+# rows per bulk write in the product catalog pipeline
+PRODUCT_BATCH_SIZE = 100
+
+# a product's reviews count as fresh this long after a review crawl finished
+REVIEW_FRESHNESS_DAYS = 7
+
 REQUEST_FINGERPRINTER_IMPLEMENTATION = '2.7'
 
 
@@ -1,7 +1,6 @@
 import scrapy
 from scrapy.exceptions import CloseSpider
 from scrapy.crawler import CrawlerProcess, CrawlerRunner
-import fake_useragent
 from urllib.parse import urljoin
 import pandas as pd
 import mysql.connector
@@ -10,11 +9,20 @@ from scrapy.item import Item, Field
 import re
 from twisted.internet import reactor
 import datetime
+from redis.exceptions import RedisError
+from amazon.budget import get_redis_connection
+from amazon.frontier import CrawlFrontier
+from amazon.middlewares import LAST_PAGE, NOT_FOUND
+from amazon.tasks import mark_reviews_fresh
 from amazon.analysis_pipeline import (
-    fetch_product,
     create_and_upload_wordclouds,
-    create_and_upload_sentiment_model,
+    create_and_upload_sentiment_model_sampled,
+    create_and_upload_aspects,
+    sample_reviews,
     remove_duplicate_reviews,
+    index_reviews,
+    count_review_terms,
+    record_analysis_run,
 )
 import logging
 
@@ -34,15 +42,30 @@ class AmazonReviewItem(scrapy.Item):
 class AmazonReviewsSpider(scrapy.Spider):
     name = "amazon_reviews"
 
-    def __init__(self, asin=None, *args, **kwargs):
+    # HttpErrorMiddleware would drop these before parse_reviews, which has to see
+    # them to move on to the next sort and to clear them from the frontier
+    handle_httpstatus_list = [404, 503]
+
+    def __init__(self, asin=None, job_id=None, *args, **kwargs):
         super(AmazonReviewsSpider, self).__init__(*args, **kwargs)
 
         ## take in arguemnt for asin of product to scrape
         self.asin = asin
 
+        ## crawls started with the same job id resume from the saved frontier
+        self.job_id = job_id
+        self.frontier = CrawlFrontier()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(AmazonReviewsSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.frontier = CrawlFrontier.from_settings(crawler.settings, spider.job_id)
+        return spider
+
     max_pages = 200
 
-    current_sort = 0
+    # sort 0 is the default review order, the others are tried in order once it runs out
+    last_sort = 10
 
     sorting_options = {
         4: "sortBy=reviewerType&filterByStar=four_star",
@@ -58,29 +81,44 @@ class AmazonReviewsSpider(scrapy.Spider):
         # Add more sorting options if needed
     }
 
+    def sort_url(self, asin, sort):
+        if sort == 0:
+            return f"https://www.amazon.com/product-reviews/{asin}/"
+        return f"https://www.amazon.com/product-reviews/{asin}/?{self.sorting_options[sort]}"
+
+    def next_sort(self, asin, sort):
+        # next sort after this one whose pages haven't all been walked yet
+        for next_sort in range(sort + 1, self.last_sort + 1):
+            if not self.frontier.is_sort_completed(asin, next_sort):
+                return next_sort
+        return None
+
     def start_requests(self):
         asin_list = [self.asin]
 
-        ua = fake_useragent.UserAgent()
-        headers = {"User-Agent": ua.random}
-
         for asin in asin_list:
-            amazon_reviews_url = f"https://www.amazon.com/product-reviews/{asin}/"
+            # start at the sort a previous run of this job got to
+            chain = self.frontier.chain_state(asin)
+            sort = chain["current_sort"]
+            if self.frontier.is_sort_completed(asin, sort):
+                sort = self.next_sort(asin, sort)
+                if sort is None:
+                    self.logger.info(f"All sorts already crawled for {asin}")
+                    continue
+                chain["current_sort"] = sort
+
             yield scrapy.Request(
-                url=amazon_reviews_url,
-                headers=headers,
+                url=self.sort_url(asin, sort),
                 callback=self.parse_reviews,
-                meta={"asin": asin, "retry_count": 0, "total_pages": 0},
+                meta={"asin": asin, "review_page": True, "sort": sort, "page": 1, "total_pages": chain["total_pages"]},
             )
 
     def parse_reviews(self, response):
         asin = response.meta["asin"]
-        retry_count = response.meta["retry_count"]
+        sort = response.meta["sort"]
+        page = response.meta["page"]
         total_pages = response.meta["total_pages"]
 
-        ua = fake_useragent.UserAgent()
-        headers = {"User-Agent": ua.random}
-
         self.logger.info(response)
 
         next_page_relative_url = response.css(
@@ -90,56 +128,58 @@ class AmazonReviewsSpider(scrapy.Spider):
             f"Spider on url https://www.amazon.com/{next_page_relative_url}"
         )
 
+        chain = self.frontier.chain_state(asin)
+
         if next_page_relative_url is not None:
             self.logger.info(f"Spider on page {total_pages}")
 
             total_pages += 1
-            retry_count = 0
+            chain["total_pages"] = total_pages
             next_page = urljoin("https://www.amazon.com/", next_page_relative_url)
             yield scrapy.Request(
                 url=next_page,
-                headers=headers,
                 callback=self.parse_reviews,
                 meta={
                     "asin": asin,
-                    "retry_count": retry_count,
-                    "total_pages": total_pages,
-                },
-            )
-
-        ## Adding this retry_count here so we retry any amazon js rendered review pages
-        elif retry_count < 3:
-            retry_count = retry_count + 1
-            yield scrapy.Request(
-                url=response.url,
-                headers=headers,
-                callback=self.parse_reviews,
-                dont_filter=True,
-                meta={
-                    "asin": asin,
-                    "retry_count": retry_count,
+                    "review_page": True,
+                    "sort": sort,
+                    "page": page + 1,
                     "total_pages": total_pages,
                 },
             )
 
         # after 10 pages amazon disables next page of reviews
         # work around: sort by stars after these 10 pages get ~100 extra reviews pper new sort
-        elif self.current_sort < 10:
-            self.current_sort += 1
-            # get url for sorted reviews to get extra reviews
-            url_stars_sorted = f"https://www.amazon.com/product-reviews/{asin}/?{self.sorting_options[self.current_sort]}"
-
-            yield scrapy.Request(
-                url=url_stars_sorted,
-                headers=headers,
-                callback=self.parse_reviews,
-                dont_filter=True,
-                meta={
-                    "asin": asin,
-                    "retry_count": retry_count,
-                    "total_pages": total_pages,
-                },
-            )
+        # js rendered and captcha pages are retried by ReviewPageRetryMiddleware before they get here
+        else:
+            page_class = response.meta.get("review_page_class")
+            if page_class in (LAST_PAGE, NOT_FOUND):
+                # mark this sort as walked so a resumed crawl doesn't start it over
+                self.frontier.mark_sort_completed(asin, sort)
+            else:
+                # retries ran out on a captcha or js shell, the page stays in the
+                # frontier so a resumed crawl picks the sort up from here
+                self.logger.warning(f"Leaving sort {sort} on a {page_class} page, it is resumed from page {page}")
+                response.meta["frontier_resume"] = True
+
+            next_sort = self.next_sort(asin, sort)
+
+            if next_sort is not None:
+                chain["current_sort"] = next_sort
+
+                # get url for sorted reviews to get extra reviews
+                yield scrapy.Request(
+                    url=self.sort_url(asin, next_sort),
+                    callback=self.parse_reviews,
+                    dont_filter=True,
+                    meta={
+                        "asin": asin,
+                        "review_page": True,
+                        "sort": next_sort,
+                        "page": 1,
+                        "total_pages": total_pages,
+                    },
+                )
         ## Parse Product Reviews
         review_elements = response.css("#cm_cr-review_list div.review")
 
@@ -190,11 +230,39 @@ class AmazonReviewsSpider(scrapy.Spider):
             yield review
 
     def closed(self, reason):
+        replay = self.settings.get("PAGE_ARCHIVE_MODE") == "replay"
+
+        # a replay never asked amazon, so the reviews aren't any fresher
+        if reason == "finished" and not replay:
+            self.mark_fresh()
+
+        # budget and shutdown closes are resumed later, the analysis runs when the crawl finishes
+        if reason != "finished":
+            self.logger.info(f"Crawl closed ({reason}), leaving the analysis of {self.asin} for when it finishes")
+            return
+        if replay and not self.crawler.stats.get_value("reviews/inserted"):
+            self.logger.info(f"Replay stored no new reviews of {self.asin}, nothing to analyze")
+            return
+
+        self.analyze()
+
+    def analyze(self):
         remove_duplicate_reviews(self.asin)
-        product_df = fetch_product(asin=self.asin)
-        self.logger.info(f"Product df has {len(product_df)} reviews")
-        create_and_upload_wordclouds(product_df, self.asin)
-        create_and_upload_sentiment_model(product_df, self.asin)
+        self.logger.info(f"Indexed {index_reviews(self.asin)} new reviews for search")
+        self.logger.info(f"Counted terms of {count_review_terms(self.asin)} new reviews")
+        create_and_upload_wordclouds(self.asin)
+        # the sentiment model and the aspects are made from the same sample of reviews
+        sample = sample_reviews(self.asin)
+        create_and_upload_sentiment_model_sampled(self.asin, sample=sample)
+        create_and_upload_aspects(self.asin, sample=sample)
+        record_analysis_run(self.asin)
+
+    def mark_fresh(self):
+        # lets the search spider skip this product when it queues review crawls
+        try:
+            mark_reviews_fresh(get_redis_connection(self.settings), self.asin, self.settings.getfloat("REVIEW_FRESHNESS_DAYS", 7))
+        except RedisError as e:
+            self.logger.warning(f"Could not mark reviews of {self.asin} as fresh: {e}")
 
 
 def process_scrape_request(asin):
@@ -205,13 +273,25 @@ def process_scrape_request(asin):
     reactor.run()
 
 
-def run_scrapy_scraper(asin):
+def replay_scrapy_scraper(asin):
+    # re-run parse_reviews and the item pipelines over the archived pages of this asin,
+    # reviews that are already stored are skipped by DatabasePipeline
     settings = get_project_settings()
+    settings.set("PAGE_ARCHIVE_MODE", "replay")
+    settings.set("CONCURRENT_REQUESTS", 16)
+    settings.set("ADAPTIVE_CONCURRENCY_ENABLED", False)
     process = CrawlerProcess(settings)
     process.crawl(AmazonReviewsSpider, asin=asin)
     process.start()
 
 
+def run_scrapy_scraper(asin, job_id=None):
+    settings = get_project_settings()
+    process = CrawlerProcess(settings)
+    process.crawl(AmazonReviewsSpider, asin=asin, job_id=job_id)
+    process.start()
+
+
 if __name__ == "__main__":
     settings = get_project_settings()
     process = CrawlerRunner(settings)
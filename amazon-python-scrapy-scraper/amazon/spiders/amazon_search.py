@@ -1,41 +1,123 @@
 import scrapy
-from urllib.parse import urljoin
+from urllib.parse import urljoin, quote_plus
+
+from amazon.budget import get_redis_connection
+from amazon.items import AmazonSearchProductItem
+from amazon.tasks import enqueue_review_crawl, get_task_queue, has_fresh_reviews
+
+
+def load_keywords(keywords=None, keyword_file=None):
+    # keywords is a comma separated list, keyword_file has one keyword per line
+    keyword_list = []
+    if keywords:
+        keyword_list += [keyword.strip() for keyword in keywords.split(',')]
+    if keyword_file:
+        with open(keyword_file, encoding='utf-8') as f:
+            keyword_list += [line.strip() for line in f if not line.startswith('#')]
+
+    # drop blanks and repeats but keep the order
+    return list(dict.fromkeys(keyword for keyword in keyword_list if keyword))
+
 
 class AmazonSearchSpider(scrapy.Spider):
     name = "amazon_search"
 
     custom_settings = {
-        'FEEDS': { 'data/%(name)s_%(time)s.csv': { 'format': 'csv',}}
+        'ITEM_PIPELINES': {'amazon.pipelines.ProductCatalogPipeline': 300},
         }
 
+    # organic results counted for each page when ranking, ranks stay in page order
+    # as long as no page has more organic results than this
+    organic_per_page = 48
+
+    def __init__(self, keywords=None, keyword_file=None, max_pages=None, enqueue_top=0, *args, **kwargs):
+        super(AmazonSearchSpider, self).__init__(*args, **kwargs)
+
+        ## scrapy crawl amazon_search -a keywords="ipad,ipad case" or -a keyword_file=keywords.txt
+        self.keyword_list = load_keywords(keywords, keyword_file) or ['ipad']
+        self.max_pages = int(max_pages) if max_pages else None
+
+        ## start review crawls for the top N organic results of every keyword
+        self.enqueue_top = int(enqueue_top)
+
+        # asins already emitted as organic results and as ads, shared across all keywords
+        # and pages. Kept apart so a sponsored listing doesn't hide the organic one.
+        self.seen_asins = set()
+        self.seen_ads = set()
+        self.enqueued_asins = set()
+
+        self.redis_conn = None
+        self.task_queue = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(AmazonSearchSpider, cls).from_crawler(crawler, *args, **kwargs)
+        if spider.enqueue_top > 0:
+            spider.redis_conn = get_redis_connection(crawler.settings)
+            spider.task_queue = get_task_queue(spider.redis_conn)
+        return spider
+
+    def search_url(self, keyword, page):
+        return f'https://www.amazon.com/s?k={quote_plus(keyword)}&page={page}'
+
     def start_requests(self):
-        keyword_list = ['ipad']
-        for keyword in keyword_list:
-            amazon_search_url = f'https://www.amazon.com/s?k={keyword}&page=1'
-            yield scrapy.Request(url=amazon_search_url, callback=self.parse_search_results, meta={'keyword': keyword, 'page': 1})
+        # page 1 of every keyword goes out at once, the rest of the pages fan out from there
+        for keyword in self.keyword_list:
+            yield scrapy.Request(url=self.search_url(keyword, 1), callback=self.parse_search_results, meta={'keyword': keyword, 'page': 1})
 
     def parse_search_results(self, response):
         page = response.meta['page']
         keyword = response.meta['keyword'] 
 
         ## Extract Overview Product Data
+        # pages come back in any order, so organic ranks come from the page number
+        # and the position among the organic results of the page
+        organic_position = 0
         search_products = response.css("div.s-result-item[data-component-type=s-search-result]")
         for product in search_products:
             relative_url = product.css("h2>a::attr(href)").get()
-            asin = relative_url.split('/')[3] if len(relative_url.split('/')) >= 4 else None
+            if relative_url is None:
+                continue
+
             product_url = urljoin('https://www.amazon.com/', relative_url).split("?")[0]
-            yield  {
-                    "keyword": keyword,
-                    "asin": asin,
-                    "url": product_url,
-                    "ad": True if "/slredirect/" in product_url else False, 
-                    "title": product.css("h2>a>span::text").get(),
-                    "price": product.css(".a-price[data-a-size=xl] .a-offscreen::text").get(),
-                    "real_price": product.css(".a-price[data-a-size=b] .a-offscreen::text").get(),
-                    "rating": (product.css("span[aria-label~=stars]::attr(aria-label)").re(r"(\d+\.*\d*) out") or [None])[0],
-                    "rating_count": product.css("span[aria-label~=stars] + span::attr(aria-label)").get(),
-                    "thumbnail_url": product.xpath("//img[has-class('s-image')]/@src").get(),
-                }
+            # sponsored results link through /slredirect/ so the asin isn't in their url
+            asin = product.attrib.get('data-asin') or (relative_url.split('/')[3] if len(relative_url.split('/')) >= 4 else None)
+            ad = "/slredirect/" in product_url
+
+            organic_rank = None
+            enqueue = False
+            if not ad:
+                organic_position += 1
+                organic_rank = (page - 1) * self.organic_per_page + organic_position
+                enqueue = asin is not None and organic_rank <= self.enqueue_top and asin not in self.enqueued_asins
+
+            # an organic listing already emitted for another keyword or page is only emitted
+            # again when it is ranked high enough for a review crawl here, an ad is left out
+            # once the asin was seen at all so it can't overwrite the organic rank in the catalog
+            if asin is None or (asin in self.seen_asins and not enqueue) or (ad and (asin in self.seen_ads or asin in self.seen_asins)):
+                self.crawler.stats.inc_value('search/duplicate_asin')
+                continue
+            (self.seen_ads if ad else self.seen_asins).add(asin)
+
+            item = AmazonSearchProductItem(
+                keyword=keyword,
+                asin=asin,
+                url=product_url,
+                ad=ad,
+                organic_rank=organic_rank,
+                title=product.css("h2>a>span::text").get(),
+                price=product.css(".a-price[data-a-size=xl] .a-offscreen::text").get(),
+                real_price=product.css(".a-price[data-a-size=b] .a-offscreen::text").get(),
+                rating=(product.css("span[aria-label~=stars]::attr(aria-label)").re(r"(\d+\.*\d*) out") or [None])[0],
+                rating_count=product.css("span[aria-label~=stars] + span::attr(aria-label)").get(),
+                thumbnail_url=product.xpath(".//img[has-class('s-image')]/@src").get(),
+            )
+
+            if enqueue:
+                self.enqueued_asins.add(asin)
+                item['review_crawl_job'] = self.enqueue_reviews(asin)
+
+            yield item
 
 
         ## Get All Pages
@@ -44,12 +126,20 @@ class AmazonSearchSpider(scrapy.Spider):
                 '//*[contains(@class, "s-pagination-item")][not(has-class("s-pagination-separator"))]/text()'
             ).getall()
 
-            last_page = available_pages[-1]
-            for page_num in range(2, int(last_page)):
-                amazon_search_url = f'https://www.amazon.com/s?k={keyword}&page={page_num}'
-                yield scrapy.Request(url=amazon_search_url, callback=self.parse_search_results, meta={'keyword': keyword, 'page': page_num})
+            last_page = int(available_pages[-1]) if available_pages else 1
+            if self.max_pages:
+                last_page = min(last_page, self.max_pages)
 
+            for page_num in range(2, last_page + 1):
+                yield scrapy.Request(url=self.search_url(keyword, page_num), callback=self.parse_search_results, meta={'keyword': keyword, 'page': page_num})
 
-        
-    
+    def enqueue_reviews(self, asin):
+        # skip products a review crawl finished for recently
+        if has_fresh_reviews(self.redis_conn, asin):
+            self.crawler.stats.inc_value('search/reviews_fresh')
+            return None
 
+        job = enqueue_review_crawl(self.task_queue, asin)
+        self.crawler.stats.inc_value('search/reviews_enqueued')
+        self.logger.info(f'Enqueued review crawl for {asin} with id {job.id}')
+        return job.id
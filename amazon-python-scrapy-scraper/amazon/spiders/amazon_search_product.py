@@ -1,13 +1,14 @@
-import json
 import scrapy
 from urllib.parse import urljoin
-import re
+
+from amazon.extractors import extract_product_data
+from amazon.items import AmazonProductItem
 
 class AmazonSearchProductSpider(scrapy.Spider):
     name = "amazon_search_product"
 
     custom_settings = {
-        'FEEDS': { 'data/%(name)s_%(time)s.csv': { 'format': 'csv',}}
+        'ITEM_PIPELINES': {'amazon.pipelines.ProductCatalogPipeline': 300},
         }
 
     def start_requests(self):
@@ -25,7 +26,8 @@ class AmazonSearchProductSpider(scrapy.Spider):
         for product in search_products:
             relative_url = product.css("h2>a::attr(href)").get()
             product_url = urljoin('https://www.amazon.com/', relative_url).split("?")[0]
-            yield scrapy.Request(url=product_url, callback=self.parse_product_data, meta={'keyword': keyword, 'page': page})
+            asin = product.attrib.get('data-asin')
+            yield scrapy.Request(url=product_url, callback=self.parse_product_data, meta={'keyword': keyword, 'page': page, 'asin': asin})
             
         ## Get All Pages
         if page == 1:
@@ -40,18 +42,8 @@ class AmazonSearchProductSpider(scrapy.Spider):
 
 
     def parse_product_data(self, response):
-        image_data = json.loads(re.findall(r"colorImages':.*'initial':\s*(\[.+?\])},\n", response.text)[0])
-        variant_data = re.findall(r'dimensionValuesDisplayData"\s*:\s* ({.+?}),\n', response.text)
-        feature_bullets = [bullet.strip() for bullet in response.css("#feature-bullets li ::text").getall()]
-        price = response.css('.a-price span[aria-hidden="true"] ::text').get("")
-        if not price:
-            price = response.css('.a-price .a-offscreen ::text').get("")
-        yield {
-            "name": response.css("#productTitle::text").get("").strip(),
-            "price": price,
-            "stars": response.css("i[data-hook=average-star-rating] ::text").get("").strip(),
-            "rating_count": response.css("div[data-hook=total-review-count] ::text").get("").strip(),
-            "feature_bullets": feature_bullets,
-            "images": image_data,
-            "variant_data": variant_data,
-        }
\ No newline at end of file
+        yield AmazonProductItem(
+            asin=response.meta['asin'],
+            url=response.url.split("?")[0],
+            **extract_product_data(response)
+        )
@@ -0,0 +1,26 @@
+import uuid
+
+from rq import Queue
+
+
+# set when a review crawl of an asin finishes, expires after REVIEW_FRESHNESS_DAYS
+FRESH_REVIEWS_KEY = 'amazon:fresh_reviews:{}'
+
+
+def enqueue_review_crawl(task_queue, asin, job_id=None):
+    # passing the id of an unfinished job resumes that crawl instead of starting over
+    job_id = job_id or str(uuid.uuid4())
+    return task_queue.enqueue('amazon.spiders.amazon_reviews.run_scrapy_scraper',
+                              args=(asin, job_id), job_id=job_id, job_timeout=3600)
+
+
+def get_task_queue(redis_conn):
+    return Queue(connection=redis_conn)
+
+
+def mark_reviews_fresh(redis_conn, asin, days):
+    redis_conn.set(FRESH_REVIEWS_KEY.format(asin), 1, ex=int(days * 24 * 60 * 60))
+
+
+def has_fresh_reviews(redis_conn, asin):
+    return bool(redis_conn.exists(FRESH_REVIEWS_KEY.format(asin)))
@@ -0,0 +1,156 @@
+# Per-asin word and phrase counts by sentiment.
+#
+# term_frequencies holds how often each word (n = 1) and two word phrase (n = 2)
+# appears in the positive (rating > 3) and negative reviews of an asin. It's
+# updated with only the reviews inserted since the last update, so wordclouds
+# and top phrase queries read the vocabulary of a product instead of every review.
+# The table is created by amazon.schema. Update or rebuild by hand with:
+#
+#   python -m amazon.term_frequencies B01GGKYKQM
+#   python -m amazon.term_frequencies --rebuild B01GGKYKQM
+
+import re
+import sys
+from collections import Counter
+
+from wordcloud import STOPWORDS
+
+from amazon.db import get_db_connection
+from amazon.watermarks import get_watermark, set_watermark, reset_watermark
+
+
+STAGE = "term_frequencies"
+
+# same words as WordCloud.generate picks out of text
+WORD_RE = re.compile(r"\w[\w']+")
+NGRAM_SIZES = (1, 2)
+MAX_TERM_LENGTH = 255
+
+# reviews read and counted per transaction
+COUNT_BATCH_SIZE = 1000
+
+CREATE_TERM_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS term_frequencies(
+    asin VARCHAR(10) NOT NULL,
+    sentiment VARCHAR(8) NOT NULL,
+    n tinyint NOT NULL,
+    term VARCHAR(255) NOT NULL,
+    count int NOT NULL,
+    PRIMARY KEY (asin, sentiment, n, term),
+    KEY top_terms (asin, sentiment, count)
+)
+"""
+
+ADD_COUNTS_QUERY = """
+INSERT INTO term_frequencies (asin, sentiment, n, term, count)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+"""
+
+
+def review_sentiment(rating):
+    return 'positive' if rating > 3 else 'negative'
+
+
+def review_terms(text):
+    # (n, term) for every word and phrase of text, phrases never include a stopword
+    words = [word.lower() for word in WORD_RE.findall(text or '')]
+    keep = [word not in STOPWORDS for word in words]
+
+    terms = [(1, word) for word, kept in zip(words, keep) if kept]
+    for n in NGRAM_SIZES:
+        if n == 1:
+            continue
+        for start in range(len(words) - n + 1):
+            if all(keep[start:start + n]):
+                terms.append((n, ' '.join(words[start:start + n])))
+
+    return [(n, term) for n, term in terms if len(term) <= MAX_TERM_LENGTH]
+
+
+def count_terms(reviews):
+    # Counter of (sentiment, n, term) over (text, rating) pairs
+    counts = Counter()
+    for text, rating in reviews:
+        sentiment = review_sentiment(rating)
+        counts.update((sentiment, n, term) for n, term in review_terms(text))
+    return counts
+
+
+def update_term_frequencies(conn, asin):
+    # count the reviews of asin added since the last update, returns how many were counted
+    cursor = conn.cursor()
+
+    last_review_id = get_watermark(cursor, asin, STAGE)
+    conn.commit()
+
+    counted = 0
+    while True:
+        cursor.execute("SELECT id, text, rating FROM reviews WHERE asin = %s AND id > %s AND duplicate_of IS NULL ORDER BY id LIMIT %s",
+                       (asin, last_review_id, COUNT_BATCH_SIZE))
+        reviews = cursor.fetchall()
+        if not reviews:
+            break
+
+        counts = count_terms((text, rating) for _, text, rating in reviews)
+        if counts:
+            cursor.executemany(ADD_COUNTS_QUERY, [(asin, sentiment, n, term, count)
+                                                  for (sentiment, n, term), count in counts.items()])
+
+        # the counts and the watermark are committed together
+        last_review_id = reviews[-1][0]
+        set_watermark(cursor, asin, STAGE, last_review_id)
+        conn.commit()
+        counted += len(reviews)
+
+    cursor.close()
+    return counted
+
+
+def subtract_review_terms(cursor, asin, reviews):
+    # take (id, text, rating) reviews that are about to be deleted back out of the counts
+    # only reviews at or below the watermark were counted
+    last_review_id = get_watermark(cursor, asin, STAGE)
+
+    counts = count_terms((text, rating) for review_id, text, rating in reviews if review_id <= last_review_id)
+    if not counts:
+        return
+
+    cursor.executemany("""UPDATE term_frequencies SET count = count - %s
+                          WHERE asin = %s AND sentiment = %s AND n = %s AND term = %s""",
+                       [(count, asin, sentiment, n, term) for (sentiment, n, term), count in counts.items()])
+    cursor.execute("DELETE FROM term_frequencies WHERE asin = %s AND count <= 0", (asin,))
+
+
+def rebuild_term_frequencies(conn, asin):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM term_frequencies WHERE asin = %s", (asin,))
+    reset_watermark(cursor, asin, STAGE)
+    conn.commit()
+    cursor.close()
+
+    return update_term_frequencies(conn, asin)
+
+
+def fetch_term_frequencies(conn, asin, sentiment, ngram_sizes=NGRAM_SIZES, limit=200):
+    # the limit most frequent terms of asin as a dict of term to count, most frequent first
+    cursor = conn.cursor()
+    cursor.execute(f"""SELECT term, count FROM term_frequencies
+                       WHERE asin = %s AND sentiment = %s AND n IN ({', '.join(['%s'] * len(ngram_sizes))})
+                       ORDER BY count DESC
+                       LIMIT %s""", (asin, sentiment, *ngram_sizes, limit))
+    frequencies = dict(cursor.fetchall())
+    cursor.close()
+
+    return frequencies
+
+
+if __name__ == "__main__":
+    rebuild = "--rebuild" in sys.argv[1:]
+    asins = [arg for arg in sys.argv[1:] if arg != "--rebuild"]
+
+    conn = get_db_connection()
+    for asin in asins:
+        counted = rebuild_term_frequencies(conn, asin) if rebuild else update_term_frequencies(conn, asin)
+        print(f"Counted terms of {counted} reviews of {asin}")
+    conn.close()
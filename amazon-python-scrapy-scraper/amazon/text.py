@@ -0,0 +1,60 @@
+# Text preprocessing shared by the sentiment model, the search index and the
+# aspect miner.
+#
+# The NLTK stopword list and lemmatizer are loaded once per process instead of on
+# every call, and nothing here downloads NLTK data, so worker processes can import
+# it cheaply. analysis_pipeline downloads the data it needs when it's imported.
+
+from functools import lru_cache
+
+from nltk import pos_tag
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+
+@lru_cache(maxsize=1)
+def get_stop_words():
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=1)
+def get_lemmatizer():
+    return WordNetLemmatizer()
+
+
+@lru_cache(maxsize=100000)
+def lemmatize(token):
+    return get_lemmatizer().lemmatize(token)
+
+
+# Define the preprocessing functions
+def preprocess_text(text):
+    # Convert to lowercase
+    text = text.lower()
+
+    # Tokenize the text
+    tokens = word_tokenize(text)
+
+    # Remove stop words
+    stop_words = get_stop_words()
+    tokens = [token for token in tokens if token not in stop_words]
+
+    # Lemmatize the tokens
+    tokens = [lemmatize(token) for token in tokens]
+
+    # Join tokens back to a string
+    preprocessed_text = ' '.join(tokens)
+
+    return preprocessed_text
+
+
+def preprocess_texts(texts):
+    # one chunk of a corpus, for preprocessing in worker processes
+    return [preprocess_text(text or '') for text in texts]
+
+
+@lru_cache(maxsize=100000)
+def is_noun_phrase(term):
+    # a noun or a compound of nouns like "battery life", tagged without the review around it
+    return all(tag.startswith('NN') for _, tag in pos_tag(term.split()))
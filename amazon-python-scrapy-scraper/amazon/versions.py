@@ -0,0 +1,33 @@
+# Per-asin write version of the reviews table.
+#
+# Bumped in the same transaction as every insert into or delete from the reviews
+# of an asin, so readers can tell whether anything changed with a primary key
+# lookup instead of scanning the reviews. The review explorer api uses it for
+# its ETags. The table is created by amazon.schema.
+
+
+CREATE_VERSION_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS review_versions(
+    asin VARCHAR(10) NOT NULL,
+    version bigint NOT NULL,
+    updated_at datetime(6),
+    PRIMARY KEY (asin)
+)
+"""
+
+BUMP_VERSION_QUERY = """
+INSERT INTO review_versions (asin, version, updated_at)
+VALUES (%s, 1, NOW(6))
+ON DUPLICATE KEY UPDATE version = version + 1, updated_at = NOW(6)
+"""
+
+
+def bump_review_version(cursor, asin):
+    cursor.execute(BUMP_VERSION_QUERY, (asin,))
+
+
+def get_review_version(cursor, asin):
+    # 0 if nothing was written for asin since versions were added
+    cursor.execute("SELECT version FROM review_versions WHERE asin = %s", (asin,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
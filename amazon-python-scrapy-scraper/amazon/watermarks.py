@@ -0,0 +1,37 @@
+# Per-asin progress of the incremental analysis stages.
+#
+# Each stage (search index, term counts, ...) remembers the highest review id it
+# has processed for an asin, so the next run only reads the reviews inserted since.
+# Review ids come from the auto increment key of the reviews table, so newer
+# reviews always have higher ids. The table is created by amazon.schema, these
+# helpers only read and write rows so they can run inside a stage's transaction.
+
+
+CREATE_WATERMARK_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS analysis_watermarks(
+    asin VARCHAR(10) NOT NULL,
+    stage VARCHAR(32) NOT NULL,
+    last_review_id int NOT NULL,
+    updated_at datetime,
+    PRIMARY KEY (asin, stage)
+)
+"""
+
+
+def get_watermark(cursor, asin, stage):
+    # highest review id already processed by stage, 0 if it never ran for this asin
+    cursor.execute("SELECT last_review_id FROM analysis_watermarks WHERE asin = %s AND stage = %s", (asin, stage))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def set_watermark(cursor, asin, stage, last_review_id):
+    cursor.execute("""INSERT INTO analysis_watermarks (asin, stage, last_review_id, updated_at)
+                      VALUES (%s, %s, %s, NOW())
+                      ON DUPLICATE KEY UPDATE last_review_id = VALUES(last_review_id), updated_at = NOW()""",
+                   (asin, stage, last_review_id))
+
+
+def reset_watermark(cursor, asin, stage):
+    # the next run of stage starts over from the first review
+    cursor.execute("DELETE FROM analysis_watermarks WHERE asin = %s AND stage = %s", (asin, stage))
@@ -2,7 +2,7 @@ import sys
 sys.path.append('./')
 
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 # from amazon_reviews import process_scrape_request, AmazonReviewsSpider
 from amazon.spiders.amazon_reviews import AmazonReviewsSpider, run_scrapy_scraper
 from flask import Flask, request
@@ -20,7 +20,16 @@ from rq import Queue
 from rq.job import Job
 from redis import Redis
 
-from amazon.analysis_pipeline import fetch_product, create_and_upload_wordclouds, create_and_upload_sentiment_model
+from amazon.budget import PageBudget, get_redis_connection
+from amazon.tasks import enqueue_review_crawl, get_task_queue
+from amazon.analysis_pipeline import count_review_terms, create_and_upload_wordclouds, create_and_upload_sentiment_model_sampled, record_analysis_run
+from amazon.search_index import search_reviews
+from amazon.explorer import page_reviews, ensure_review_index
+from amazon.versions import get_review_version
+from amazon.schema import create_analysis_tables
+from amazon.export import CONTENT_TYPES, export_filename, export_reviews
+from amazon.near_duplicates import shared_reviews, near_duplicate_groups
+import hashlib
 
 import crochet
 crochet.setup()
@@ -36,16 +45,20 @@ load_dotenv()
 
 app = Flask(__name__)
 
+project_settings = get_project_settings()
+
 ## set up for task queue
-redis_conn = Redis(host='localhost', port=6379)
-task_queue = Queue(connection=redis_conn)
+redis_conn = get_redis_connection(project_settings)
+task_queue = get_task_queue(redis_conn)
+
+## proxy page budget shared with the crawl workers
+page_budget = PageBudget.from_settings(project_settings, redis_conn=redis_conn)
 
 
 # Set up logging for Flask app
 app_logger = logging.getLogger('flask_app')
 app_logger.setLevel(logging.DEBUG)
 
-project_settings = get_project_settings()
 crawler = CrawlerRunner(settings=project_settings)
 
 stop_flag = False
@@ -77,7 +90,8 @@ def start_spider():
     # Thread(target=run_spider, args=(asin,)).start() # Pass the asin as an argument to run_spider
     # app_logger.debug('Started running spider')
 
-    job = task_queue.enqueue(run_scrapy_scraper, asin, job_timeout=3600)
+    # passing the id of an unfinished job resumes that crawl instead of starting over
+    job = enqueue_review_crawl(task_queue, asin, job_id=request.json.get('job_id'))
 
 
     return jsonify({'status': 'success', 'message': f'Spider "amazon_reviews" added to the queue with id {job.id}.'}), 200
@@ -90,30 +104,139 @@ def stop_spider():
     app_logger.debug('Spider stopped in stop API endpoint')
     return 'Spider stopped'
     
+@app.route('/api/budget', methods=['GET'])
+def budget():
+    asin = request.args.get('asin')  # optional - include the budget left for this asin
+
+    return jsonify(page_budget.remaining(asin))
+
 @app.route('/api/wordclouds', methods=['PUT'])
 def wordclouds():
     asin = request.json['asin']  # Get the asin from the API request
 
-    product_df = fetch_product(asin=asin)
-    create_and_upload_wordclouds(product_df, asin=asin)
+    count_review_terms(asin)
+    create_and_upload_wordclouds(asin=asin)
+    record_analysis_run(asin)
     return "Started creating and uploading wordclouds"
 
 @app.route('/api/sentiment-model', methods=['PUT'])
 def sentiment_model():
     asin = request.json['asin']  # Get the asin from the API request
 
-    product_df = fetch_product(asin=asin)
-
-    # Impute positive or negative based on the 'rating' column
-    product_df['sentiment'] = product_df['rating'].apply(lambda x: 'positive' if x >= 4 else 'negative')
-
-    if product_df["sentiment"].nunique() < 2:
+    # trains on a sample of up to SENTIMENT_SAMPLE_SIZE reviews per sentiment
+    if create_and_upload_sentiment_model_sampled(asin) is None:
         return "Only one class of sentiment for this products model - all positive or all negative so\
             I can't make a model"
 
-    create_and_upload_sentiment_model(product_df, asin=asin)
+    record_analysis_run(asin)
     return "Started creating and uploading sentiment model important words"
 
+@app.route('/api/search/<asin>', methods=['GET'])
+def search(asin):
+    # keyword search over the reviews of asin
+    # ?q=cable&rating=1,2&limit=20&after=<next from the previous page>&exact=1
+    query = request.args.get('q', '')
+    ratings = [int(rating) for rating in request.args.get('rating', '').split(',') if rating.isdigit()]
+    after = request.args.get('after', type=int)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    exact = request.args.get('exact') == '1'
+
+    connection = get_mysql_connection()
+    try:
+        results = search_reviews(connection, asin, query, ratings=ratings, after=after, limit=limit, exact=exact)
+    except mysql.connector.Error as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        connection.close()
+
+    return jsonify(results)
+
+@app.route('/api/reviews/<asin>', methods=['GET'])
+def reviews(asin):
+    # pages of raw reviews, newest first
+    # ?fields=title,rating&rating=1,2&verified=1&location=the United States
+    #  &date_from=2023-01-01&date_to=2023-06-30&limit=50&after=<next from the previous page>
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    ratings = [int(rating) for rating in request.args.get('rating', '').split(',') if rating.isdigit()]
+    verified = request.args.get('verified')
+
+    connection = get_mysql_connection()
+    try:
+        cursor = connection.cursor()
+        version = get_review_version(cursor, asin)
+        cursor.close()
+
+        # the same query gives the same page until the reviews of asin are written to again
+        query_hash = hashlib.sha1(request.query_string).hexdigest()[:16]
+        etag = f'{asin}-{version}-{query_hash}'
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
+
+        page = page_reviews(
+            connection, asin,
+            fields=fields,
+            ratings=ratings,
+            verified=None if verified is None else verified == '1',
+            location=request.args.get('location'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            after=request.args.get('after'),
+            limit=request.args.get('limit', 50, type=int),
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except mysql.connector.Error as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        connection.close()
+
+    response = jsonify(page)
+    response.set_etag(etag)
+    # clients can keep the page but have to check it is still current
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/near-duplicates/<asin>', methods=['GET'])
+def near_duplicates(asin):
+    # the marked near-duplicates of asin by the review they duplicate, and the asins it shares reviews with
+    connection = get_mysql_connection()
+    try:
+        groups = near_duplicate_groups(connection, asin)
+        shared = shared_reviews(connection, asin)
+    except mysql.connector.Error as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        connection.close()
+
+    return jsonify({'asin': asin, 'groups': groups, 'shared': shared})
+
+@app.route('/api/export', methods=['GET'])
+def export():
+    # streams the reviews of one or more asins as a file
+    # ?asin=B01GGKYKQM&asin=B07FZ8S74R&format=csv|jsonl|parquet&compression=gzip|zstd
+    #  &date_from=2023-01-01&date_to=2023-06-30
+    asins = request.args.getlist('asin')
+    export_format = request.args.get('format', 'csv')
+    compression = request.args.get('compression') or None
+
+    if not asins:
+        return jsonify({'status': 'error', 'message': 'Give at least one asin'}), 400
+
+    try:
+        chunks = export_reviews(asins, export_format, compression,
+                                request.args.get('date_from'), request.args.get('date_to'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # the file is compressed, not the transfer, so it's served as a gzip or zstd file
+    # rather than with a Content-Encoding
+    content_type = CONTENT_TYPES[export_format]
+    if compression and export_format != 'parquet':
+        content_type = 'application/gzip' if compression == 'gzip' else 'application/zstd'
+
+    headers = {'Content-Disposition': f'attachment; filename={export_filename(asins, export_format, compression)}'}
+    return Response(stream_with_context(chunks), mimetype=content_type, headers=headers)
+
 
 ## request to add product info to the db
 def get_mysql_connection():
@@ -202,6 +325,10 @@ if __name__ == '__main__':
             PRIMARY KEY (id)
         );'''
     cursor_db.execute(create_review_table_query)
+
+    # index for paging through the reviews of an asin, and the tables of the analysis stages
+    ensure_review_index(cursor_db)
+    create_analysis_tables(cursor_db)
     
 
     # create product names table
@@ -0,0 +1,71 @@
+# Benchmark product page extraction over saved product pages.
+#
+#   python benchmarks/bench_product_extraction.py --pages saved_pages/
+#   python benchmarks/bench_product_extraction.py --archive archive/amazon_search_product
+#
+# Compares the old whole-page regexes with amazon.extractors and prints pages per second.
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from scrapy.http import HtmlResponse
+
+from amazon.archive import PageArchive
+from amazon.extractors import extract_image_data, extract_variant_data
+
+
+def legacy_extract(response):
+    # what AmazonSearchProductSpider.parse_product_data used to do
+    images = re.findall(r"colorImages':.*'initial':\s*(\[.+?\])},\n", response.text)
+    image_data = json.loads(images[0]) if images else []
+    variant_data = re.findall(r'dimensionValuesDisplayData"\s*:\s* ({.+?}),\n', response.text)
+    return image_data, variant_data
+
+
+def extract(response):
+    return extract_image_data(response), extract_variant_data(response)
+
+
+def load_pages(pages_dir=None, archive_dir=None):
+    bodies = []
+    if pages_dir:
+        for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+            with open(path, 'rb') as f:
+                bodies.append((path, f.read()))
+    if archive_dir:
+        for entry, body in PageArchive(archive_dir).iter_pages():
+            bodies.append((entry['url'], body))
+    return bodies
+
+
+def run(name, fn, bodies, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url, body in bodies:
+            # a fresh response each time so cached selectors don't skew the numbers
+            fn(HtmlResponse(url='https://www.amazon.com/', body=body, encoding='utf-8'))
+    elapsed = time.perf_counter() - start
+    pages = len(bodies) * repeat
+    print(f'{name:>8}: {pages} pages in {elapsed:.2f}s - {pages / elapsed:.1f} pages/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', help='directory of saved product page .html files')
+    parser.add_argument('--archive', help='page archive directory (PAGE_ARCHIVE_DIR/<spider name>)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bodies = load_pages(args.pages, args.archive)
+    if not bodies:
+        sys.exit('No pages found, pass --pages or --archive')
+
+    run('legacy', legacy_extract, bodies, args.repeat)
+    run('scripts', extract, bodies, args.repeat)
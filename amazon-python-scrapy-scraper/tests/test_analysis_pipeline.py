@@ -0,0 +1,127 @@
+# Tests for the dedup bookkeeping in analysis_pipeline, with a stub connection
+# standing in for mysql and the per-stage helpers recorded instead of run
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+import nltk
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class Cursor:
+    # answers the queries remove_duplicate_reviews runs itself
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=()):
+        self.rowcount = 0
+        if query.lstrip().startswith('SELECT DISTINCT S1.id'):
+            self.rows = [row for row in self.db.exact_duplicates]
+        elif query.lstrip().startswith('DELETE S1'):
+            self.rowcount = len(self.db.exact_duplicates)
+        elif query.startswith('SELECT id, text, rating FROM reviews WHERE id IN'):
+            self.rows = [self.db.reviews[review_id] for review_id in params]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self):
+        self.reviews = {}
+        self.exact_duplicates = []
+        self.commits = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # importing analysis_pipeline downloads the nltk data
+    monkeypatch.setattr(nltk, 'download', lambda *args, **kwargs: True)
+    from amazon import analysis_pipeline
+
+    conn = Connection()
+    calls = {'subtracted': [], 'postings': [], 'scores': [], 'marked': []}
+    monkeypatch.setattr(analysis_pipeline, 'get_db_connection', lambda: conn)
+    monkeypatch.setattr(analysis_pipeline, 'subtract_review_terms',
+                        lambda cursor, asin, reviews: calls['subtracted'].extend(review_id for review_id, _, _ in reviews))
+    monkeypatch.setattr(analysis_pipeline, 'delete_review_postings',
+                        lambda cursor, asin, review_ids: calls['postings'].extend(review_ids))
+    monkeypatch.setattr(analysis_pipeline, 'prune_review_scores',
+                        lambda cursor, asin, review_ids: calls['scores'].extend(review_ids))
+    monkeypatch.setattr(analysis_pipeline, 'mark_near_duplicates', lambda cursor, asin: calls['marked'])
+    monkeypatch.setattr(analysis_pipeline, 'prune_near_duplicate_index', lambda cursor, review_ids: None)
+    monkeypatch.setattr(analysis_pipeline, 'bump_review_version', lambda cursor, asin: None)
+    monkeypatch.setattr(analysis_pipeline, 'rebuild_rollup_rows', lambda cursor, asins: None)
+    return analysis_pipeline, conn, calls
+
+
+def test_exact_duplicates_are_subtracted(pipeline):
+    analysis_pipeline, conn, calls = pipeline
+    conn.exact_duplicates = [(3, 'Works well', 5, None)]
+
+    analysis_pipeline.remove_duplicate_reviews('B01')
+
+    assert calls['subtracted'] == [3]
+    assert calls['postings'] == [3]
+    assert calls['scores'] == [3]
+    assert conn.commits == 1
+
+
+def test_marked_review_deleted_as_exact_copy_is_subtracted_once(pipeline):
+    analysis_pipeline, conn, calls = pipeline
+    text = 'I bought this cable for my laptop and it charges really fast'
+
+    # the first run marks review 7 as a near-duplicate of review 2
+    conn.reviews[7] = (7, text, 5)
+    calls['marked'] = [7]
+    analysis_pipeline.remove_duplicate_reviews('B01')
+    assert calls['subtracted'] == [7]
+
+    # review 9 is an exact copy of review 7, which gets deleted by the next run
+    calls['marked'] = []
+    conn.exact_duplicates = [(7, text, 5, 2)]
+    analysis_pipeline.remove_duplicate_reviews('B01')
+
+    assert calls['subtracted'] == [7]
+    # its postings and score go with it either way
+    assert calls['postings'] == [7, 7]
+    assert calls['scores'] == [7, 7]
+
+
+def test_sample_training_set_weights_keep_the_class_prior(pipeline):
+    analysis_pipeline, _, _ = pipeline
+    # 90 positive and 10 negative reviews seen, at most 2 of each kept
+    reservoirs = {'positive': ['good', 'great'], 'negative': ['bad', 'awful']}
+    seen = {'positive': 90, 'negative': 10}
+
+    assert analysis_pipeline.sample_weights(reservoirs, seen) == {'positive': 45.0, 'negative': 5.0}
+    texts, sentiments, weights = analysis_pipeline.sample_training_set(reservoirs, seen)
+    assert texts == ['good', 'great', 'bad', 'awful']
+    assert sentiments == ['positive', 'positive', 'negative', 'negative']
+    assert weights == [45.0, 45.0, 5.0, 5.0]
+
+
+def test_sample_weights_of_an_empty_reservoir(pipeline):
+    analysis_pipeline, _, _ = pipeline
+    reservoirs = {'positive': ['a', 'b'], 'negative': []}
+    seen = {'positive': 10, 'negative': 0}
+
+    assert analysis_pipeline.sample_weights(reservoirs, seen) == {'positive': 5.0, 'negative': 0.0}
@@ -0,0 +1,69 @@
+# Tests for the raw page archive
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.archive import PageArchive, archive_key
+
+
+def test_archive_key():
+    assert archive_key({'asin': 'B01', 'sort': 3, 'page': 2}, 'https://www.amazon.com/x') == 'B01/3/2'
+    assert archive_key({'asin': 'B01'}, 'https://www.amazon.com/dp/B01') == 'https://www.amazon.com/dp/B01'
+
+
+def test_pages_read_back(tmp_path):
+    archive = PageArchive(str(tmp_path))
+    archive.append('B01/0/1', 'https://www.amazon.com/a', 200, b'<html>page 1</html>', asin='B01')
+    archive.append('B02/0/1', 'https://www.amazon.com/b', 200, b'<html>other</html>', asin='B02')
+    archive.close()
+
+    reader = PageArchive(str(tmp_path))
+    entry = reader.get('B01/0/1')
+    assert entry['url'] == 'https://www.amazon.com/a'
+    assert entry['status'] == 200
+    assert reader.read(entry) == b'<html>page 1</html>'
+    assert [body for _, body in reader.iter_pages('B02')] == [b'<html>other</html>']
+    assert reader.get('B03/0/1') is None
+
+
+def test_newest_page_wins(tmp_path):
+    archive = PageArchive(str(tmp_path))
+    archive.append('B01/0/1', 'https://www.amazon.com/a', 503, b'robot check')
+    archive.append('B01/0/1', 'https://www.amazon.com/a', 200, b'reviews')
+    archive.close()
+
+    reader = PageArchive(str(tmp_path))
+    entry = reader.get('B01/0/1')
+    assert entry['status'] == 200
+    assert reader.read(entry) == b'reviews'
+
+
+def test_segments_roll_over(tmp_path, monkeypatch):
+    # segment names only change every second, give each one its own pid instead
+    pids = iter(range(100, 200))
+    monkeypatch.setattr(os, 'getpid', lambda: next(pids))
+
+    archive = PageArchive(str(tmp_path), segment_size=10)
+    for page in range(3):
+        archive.append(f'B01/0/{page}', 'https://www.amazon.com/a', 200, os.urandom(64))
+    archive.close()
+
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.seg')]) == 3
+    assert len(PageArchive(str(tmp_path)).load_index()) == 3
+
+
+def test_partial_index_line_is_skipped(tmp_path):
+    archive = PageArchive(str(tmp_path))
+    archive.append('B01/0/1', 'https://www.amazon.com/a', 200, b'reviews')
+    index_path = os.path.join(tmp_path, archive.segment_name.replace('segment-', 'index-').replace('.seg', '.jsonl'))
+    archive.close()
+
+    # a worker killed in the middle of writing an index line
+    with open(index_path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "B01/0/2", "url"')
+
+    assert list(PageArchive(str(tmp_path)).load_index()) == ['B01/0/1']
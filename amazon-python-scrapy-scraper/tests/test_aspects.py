@@ -0,0 +1,62 @@
+# Tests for the aspect mining, with the nltk preprocessing and tagging stubbed out
+# so no nltk data is needed
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import aspects
+from amazon.aspects import ASPECT_COLUMNS, mine_aspects
+
+
+NOUNS = {'battery', 'life', 'battery life', 'screen', 'charger'}
+
+
+@pytest.fixture(autouse=True)
+def no_nltk(monkeypatch):
+    monkeypatch.setattr(aspects, 'preprocess_texts', lambda texts: [text.lower() for text in texts])
+    monkeypatch.setattr(aspects, 'is_noun_phrase', lambda term: term in NOUNS)
+
+
+def test_mentions_split_by_sentiment():
+    texts = ['battery life great', 'battery life bad', 'screen great', 'screen bad', 'screen ok']
+    sentiments = ['positive', 'negative', 'positive', 'negative', 'positive']
+    mined = mine_aspects(texts, sentiments, min_df=1)
+
+    assert list(mined.columns) == ASPECT_COLUMNS
+    assert mined.to_dict('records') == [
+        {'aspect': 'screen', 'mentions': 3, 'positive': 2, 'negative': 1, 'positive_ratio': 0.667},
+        {'aspect': 'battery life', 'mentions': 2, 'positive': 1, 'negative': 1, 'positive_ratio': 0.5},
+    ]
+
+
+def test_words_only_seen_in_a_phrase_are_left_out():
+    # "life" is never mentioned outside "battery life", "battery" is mentioned on its own too
+    mined = mine_aspects(['battery life', 'battery life', 'battery'], ['positive'] * 3, min_df=1)
+
+    assert 'life' not in set(mined['aspect'])
+    assert set(mined['aspect']) == {'battery life', 'battery'}
+
+
+def test_weights_scale_mentions():
+    mined = mine_aspects(['charger', 'charger'], ['positive', 'negative'], weights=[3.0, 1.0], min_df=1)
+
+    assert mined.to_dict('records') == [
+        {'aspect': 'charger', 'mentions': 4, 'positive': 3, 'negative': 1, 'positive_ratio': 0.75},
+    ]
+
+
+def test_min_df_and_max_aspects():
+    texts = ['screen', 'screen', 'charger']
+    assert list(mine_aspects(texts, ['positive'] * 3, min_df=2)['aspect']) == ['screen']
+    assert list(mine_aspects(texts, ['positive'] * 3, min_df=1, max_aspects=1)['aspect']) == ['screen']
+
+
+def test_no_aspects():
+    assert mine_aspects([], [], min_df=1).empty
+    assert mine_aspects(['great great'], ['positive'], min_df=1).empty
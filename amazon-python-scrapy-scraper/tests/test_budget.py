@@ -0,0 +1,130 @@
+# Tests for the shared Redis page budget, run against fakeredis with lua and
+# skipped without it
+#
+#   pip install "fakeredis[lua]"
+#   python -m pytest tests
+
+import os
+import sys
+
+import pytest
+from scrapy import Request, Spider
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import budget
+from amazon.budget import PageBudget
+from amazon.middlewares import PageBudgetMiddleware
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+
+class Clock:
+    # stands in for time.time
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(budget.time, 'time', clock)
+    return clock
+
+
+def page_budget(global_capacity=5, asin_capacity=3, period=60.0):
+    return PageBudget(fakeredis.FakeRedis(), global_capacity, asin_capacity, period)
+
+
+def test_asin_bucket_runs_out_first(clock):
+    pages = page_budget()
+
+    assert [pages.consume('B01') for _ in range(4)] == [None, None, None, 'asin']
+    assert pages.remaining('B01') == {
+        'global': {'remaining': 2, 'capacity': 5},
+        'asin': {'remaining': 0, 'capacity': 3},
+    }
+
+
+def test_global_bucket_is_shared_by_asins(clock):
+    pages = page_budget()
+
+    assert [pages.consume('B01') for _ in range(3)] == [None, None, None]
+    assert [pages.consume('B02') for _ in range(3)] == [None, None, 'global']
+
+
+def test_denied_pages_take_no_tokens(clock):
+    # the asin bucket is empty, so the global bucket keeps its token
+    pages = page_budget(global_capacity=5, asin_capacity=1)
+
+    assert pages.consume('B01') is None
+    assert pages.consume('B01') == 'asin'
+    assert pages.remaining()['global']['remaining'] == 4
+
+
+def test_buckets_refill_over_the_period(clock):
+    pages = page_budget(global_capacity=5, asin_capacity=3, period=60.0)
+    for _ in range(3):
+        pages.consume('B01')
+    assert pages.consume('B01') == 'asin'
+
+    # 3 pages per 60 seconds, one page every 20 seconds
+    clock.now += 20
+    assert pages.consume('B01') is None
+    assert pages.consume('B01') == 'asin'
+
+    # never above capacity
+    clock.now += 3600
+    assert pages.remaining('B01')['asin']['remaining'] == 3
+
+
+def test_several_pages_at_once(clock):
+    pages = page_budget(global_capacity=5, asin_capacity=5)
+
+    assert pages.consume('B01', pages=4) is None
+    assert pages.consume('B01', pages=2) == 'global'
+    assert pages.consume('B01', pages=1) is None
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, spider=None):
+        self.values[key] = self.values.get(key, 0) + 1
+
+
+class Crawler:
+    stats = Stats()
+
+
+def test_proxied_copy_is_not_charged_again(clock):
+    pages = page_budget()
+    middleware = PageBudgetMiddleware(Crawler(), pages)
+    spider = Spider('budget_test')
+
+    request = Request('https://www.amazon.com/product-reviews/B01/', meta={'asin': 'B01'})
+    assert middleware.process_request(request, spider) is None
+    # what the proxy middleware hands back to the start of the chain
+    proxied = request.replace(url='https://proxy.scrapeops.io/v1/?url=https://www.amazon.com/product-reviews/B01/')
+    assert middleware.process_request(proxied, spider) is None
+
+    assert pages.remaining('B01')['asin']['remaining'] == 2
+
+
+def test_retries_are_charged(clock):
+    pages = page_budget()
+    middleware = PageBudgetMiddleware(Crawler(), pages)
+    spider = Spider('budget_test')
+
+    request = Request('https://www.amazon.com/product-reviews/B01/', meta={'asin': 'B01'})
+    middleware.process_request(request, spider)
+    retry = request.copy()
+    retry.meta['review_page_retry_times'] = 1
+    middleware.process_request(retry, spider)
+
+    assert pages.remaining('B01')['asin']['remaining'] == 1
@@ -0,0 +1,108 @@
+# Tests for the export writers
+#
+#   python -m pytest tests
+
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import sys
+import zlib
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import export
+from amazon.explorer import REVIEW_COLUMNS
+from amazon.export import check_export_options, compress_chunks, export_filename, write_csv, write_jsonl
+
+
+# rows as the mysql connector returns them, in REVIEW_COLUMNS order
+BATCHES = [
+    [(1, 'B01ABC', 'Great', 'Works, "really" well', 'the United States', datetime.date(2023, 5, 1), 1, 5),
+     (2, 'B01ABC', 'Bad', 'Broke after\na week', None, datetime.date(2023, 5, 2), 0, 1)],
+    [(3, 'B01ABC', 'Ok', 'Fine', 'Canada', datetime.date(2023, 6, 1), 1, 3)],
+]
+
+
+def test_write_csv_streams_one_chunk_per_batch():
+    chunks = list(write_csv(iter(BATCHES)))
+    assert len(chunks) == 2
+
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+    assert rows[0] == REVIEW_COLUMNS
+    assert [row[0] for row in rows[1:]] == ['1', '2', '3']
+    assert rows[1][3] == 'Works, "really" well'
+    assert rows[2][3] == 'Broke after\na week'
+
+
+def test_write_csv_without_reviews_is_just_the_header():
+    assert b''.join(write_csv(iter([]))).decode('utf-8').splitlines() == [','.join(REVIEW_COLUMNS)]
+
+
+def test_write_jsonl():
+    lines = b''.join(write_jsonl(iter(BATCHES))).decode('utf-8').splitlines()
+    reviews = [json.loads(line) for line in lines]
+
+    assert [review['id'] for review in reviews] == [1, 2, 3]
+    assert reviews[0]['date'] == '2023-05-01'
+    assert reviews[1]['location'] is None
+    assert set(reviews[0]) == set(REVIEW_COLUMNS)
+
+
+def test_gzip_roundtrip():
+    chunks = list(write_jsonl(iter(BATCHES)))
+    compressed = b''.join(compress_chunks(iter(chunks), 'gzip'))
+
+    assert gzip.decompress(compressed) == b''.join(chunks)
+
+
+def test_gzip_can_be_read_as_it_streams():
+    decompressor = zlib.decompressobj(wbits=31)
+    data = b''.join(decompressor.decompress(chunk) for chunk in compress_chunks(write_csv(iter(BATCHES)), 'gzip'))
+
+    assert data == b''.join(write_csv(iter(BATCHES)))
+
+
+def test_no_compression_passes_chunks_through():
+    assert list(compress_chunks(iter([b'a', b'b']), None)) == [b'a', b'b']
+
+
+def test_export_filename():
+    assert export_filename(['B01', 'B02'], 'csv') == 'reviews_B01_B02.csv'
+    assert export_filename(['B01'], 'jsonl', 'gzip') == 'reviews_B01.jsonl.gz'
+    assert export_filename(['B01'], 'csv', 'zstd') == 'reviews_B01.csv.zst'
+    # parquet compresses inside the file
+    assert export_filename(['B01'], 'parquet', 'zstd') == 'reviews_B01.parquet'
+
+
+def test_check_export_options():
+    check_export_options('csv', 'gzip')
+    with pytest.raises(ValueError):
+        check_export_options('xml', None)
+    with pytest.raises(ValueError):
+        check_export_options('csv', 'bz2')
+
+
+def test_optional_dependencies_are_checked(monkeypatch):
+    monkeypatch.setattr(export, 'pa', None)
+    monkeypatch.setattr(export, 'zstandard', None)
+
+    with pytest.raises(ValueError):
+        check_export_options('parquet', None)
+    with pytest.raises(ValueError):
+        check_export_options('jsonl', 'zstd')
+
+
+def test_write_parquet():
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    chunks = list(export.write_parquet(iter(BATCHES), 'gzip'))
+    table = pq.read_table(io.BytesIO(b''.join(chunks)))
+
+    assert table.num_rows == 3
+    assert table.column('id').to_pylist() == [1, 2, 3]
+    assert table.column('verified').to_pylist() == [True, False, True]
@@ -0,0 +1,204 @@
+# Tests for the adaptive concurrency extension, with a stub downloader and the
+# LoopingCall driven by a twisted Clock
+#
+#   python -m pytest tests
+
+import logging
+import os
+import sys
+
+import pytest
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from twisted.internet import task
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import extensions
+from amazon.extensions import AdaptiveConcurrency
+
+
+URL = 'https://www.amazon.com/product-reviews/B01/'
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def get_value(self, key, default=None, spider=None):
+        return self.values.get(key, default)
+
+    def set_value(self, key, value, spider=None):
+        self.values[key] = value
+
+    def inc_value(self, key, count=1, spider=None):
+        self.values[key] = self.values.get(key, 0) + count
+
+
+class Slot:
+    # the attributes of scrapy.core.downloader.Slot the extension sets
+    def __init__(self, concurrency, delay):
+        self.concurrency = concurrency
+        self.delay = delay
+
+
+class Downloader:
+    def __init__(self):
+        self.total_concurrency = 0
+        self.domain_concurrency = 0
+        self.slots = {}
+
+
+class Engine:
+    def __init__(self):
+        self.downloader = Downloader()
+
+
+class Crawler:
+    def __init__(self, settings):
+        self.settings = Settings(settings)
+        self.stats = Stats()
+        self.engine = Engine()
+
+
+class Spider:
+    logger = logging.getLogger('test')
+
+
+SETTINGS = {
+    'CONCURRENT_REQUESTS': 4,
+    'DOWNLOAD_DELAY': 2.0,
+    'ADAPTIVE_CONCURRENCY_MIN': 1,
+    'ADAPTIVE_CONCURRENCY_MAX': 8,
+    'ADAPTIVE_CONCURRENCY_TARGET_LATENCY': 5.0,
+    'ADAPTIVE_CONCURRENCY_MAX_ERROR_RATE': 0.1,
+    'ADAPTIVE_CONCURRENCY_MAX_DELAY': 30.0,
+    'ADAPTIVE_CONCURRENCY_INTERVAL': 30.0,
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = task.Clock()
+    LoopingCall = task.LoopingCall
+
+    def looping_call(f, *args, **kwargs):
+        call = LoopingCall(f, *args, **kwargs)
+        call.clock = clock
+        return call
+
+    monkeypatch.setattr(extensions.task, 'LoopingCall', looping_call)
+    return clock
+
+
+@pytest.fixture
+def extension(clock):
+    extension = AdaptiveConcurrency(Crawler(SETTINGS))
+    extension.crawler.engine.downloader.slots['www.amazon.com'] = Slot(4, 2.0)
+    extension.spider_opened(Spider())
+    yield extension
+    extension.spider_closed(Spider(), 'finished')
+
+
+def receive(extension, count, status=200, latency=1.0):
+    for _ in range(count):
+        request = Request(URL, meta={'download_latency': latency})
+        extension.response_received(HtmlResponse(URL, status=status, request=request), request, Spider())
+
+
+def tick(extension, clock):
+    clock.advance(extension.interval)
+    return extension.concurrency, extension.delay
+
+
+def test_captchas_back_off(extension, clock):
+    receive(extension, 20)
+    extension.stats.inc_value('review_page/classification/captcha')
+
+    assert tick(extension, clock) == (2, 4.0)
+
+
+def test_error_rate_backs_off(extension, clock):
+    # 3 of 20 throttled is above the 10% max error rate
+    receive(extension, 17)
+    receive(extension, 3, status=503)
+
+    assert tick(extension, clock) == (2, 4.0)
+
+
+def test_retries_count_as_errors(extension, clock):
+    receive(extension, 10)
+    extension.stats.inc_value('retry/count', 2)
+
+    assert tick(extension, clock) == (2, 4.0)
+
+
+def test_back_off_stops_at_the_bounds(extension, clock):
+    for _ in range(6):
+        receive(extension, 10)
+        extension.stats.inc_value('review_page/classification/captcha')
+        tick(extension, clock)
+
+    assert (extension.concurrency, extension.delay) == (1, 30.0)
+
+
+def test_high_latency_steps_down(extension, clock):
+    receive(extension, 10, latency=8.0)
+
+    assert tick(extension, clock) == (3, 2.0)
+
+
+def test_healthy_window_speeds_up(extension, clock):
+    receive(extension, 10, latency=1.0)
+    assert tick(extension, clock) == (5, 1.0)
+
+    for _ in range(5):
+        receive(extension, 10, latency=1.0)
+        tick(extension, clock)
+    assert extension.concurrency == 8
+
+
+def test_some_errors_hold(extension, clock):
+    # 1 of 15 is above half the max error rate but not above it
+    receive(extension, 14)
+    receive(extension, 1, status=429)
+
+    assert tick(extension, clock) == (4, 2.0)
+
+
+def test_no_responses_change_nothing(extension, clock):
+    assert tick(extension, clock) == (4, 2.0)
+
+
+def test_apply_updates_the_downloader(extension, clock):
+    receive(extension, 10)
+    tick(extension, clock)
+
+    downloader = extension.crawler.engine.downloader
+    slot = downloader.slots['www.amazon.com']
+    assert (downloader.total_concurrency, downloader.domain_concurrency) == (5, 5)
+    assert (slot.concurrency, slot.delay) == (5, 1.0)
+    assert extension.stats.values['adaptive_concurrency/concurrency'] == 5
+
+
+def test_slots_made_later_get_the_current_delay(extension, clock):
+    receive(extension, 10)
+    tick(extension, clock)
+
+    # scrapy makes the slot of a new host with DOWNLOAD_DELAY, then sends the signal
+    downloader = extension.crawler.engine.downloader
+    downloader.slots['proxy.scrapeops.io'] = Slot(8, 2.0)
+    request = Request('https://proxy.scrapeops.io/v1/', meta={'download_slot': 'proxy.scrapeops.io'})
+    extension.request_reached_downloader(request, Spider())
+
+    slot = downloader.slots['proxy.scrapeops.io']
+    assert (slot.concurrency, slot.delay) == (5, 1.0)
+
+
+def test_autothrottle_conflicts():
+    from scrapy.exceptions import NotConfigured
+
+    crawler = Crawler(dict(SETTINGS, ADAPTIVE_CONCURRENCY_ENABLED=True, AUTOTHROTTLE_ENABLED=True))
+    with pytest.raises(NotConfigured):
+        AdaptiveConcurrency.from_crawler(crawler)
@@ -0,0 +1,96 @@
+# Tests for the product page extractors
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+from scrapy.http import HtmlResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.extractors import (
+    IMAGE_DATA_RE,
+    VARIANT_DATA_RE,
+    extract_image_data,
+    extract_product_data,
+    extract_variant_data,
+)
+
+
+IMAGE_SCRIPT = """
+P.when('A').register("ImageBlockATF", function(A){
+var data = {
+  'colorImages': { 'initial': [{"hiRes":"https://m.media-amazon.com/1.jpg","variant":"MAIN"},{"hiRes":null,"variant":"PT01"}]},
+  'colorToAsin': {'initial': {}},
+};
+});
+"""
+
+VARIANT_SCRIPT = """
+var dataToReturn = {
+  "dimensionValuesDisplayData" : {"B01ABC":["Black","Large"],"B01ABD":["White","Small"]},
+  "isTabletWeb" : 0,
+};
+"""
+
+
+def product_page(*scripts, body=''):
+    html = ''.join(f'<script type="text/javascript">{script}</script>' for script in scripts)
+    return HtmlResponse(url='https://www.amazon.com/dp/B01ABC', body=f'<html><head>{html}</head><body>{body}</body></html>',
+                        encoding='utf-8')
+
+
+def test_image_regex_captures_initial_list():
+    match = IMAGE_DATA_RE.search(IMAGE_SCRIPT)
+    assert match.group(1).startswith('[{"hiRes"')
+    assert match.group(1).endswith('"PT01"}]')
+
+
+def test_variant_regex_captures_object():
+    match = VARIANT_DATA_RE.search(VARIANT_SCRIPT)
+    assert match.group(1) == '{"B01ABC":["Black","Large"],"B01ABD":["White","Small"]}'
+
+
+def test_extract_image_data():
+    images = extract_image_data(product_page(IMAGE_SCRIPT))
+    assert [image['variant'] for image in images] == ['MAIN', 'PT01']
+    assert images[0]['hiRes'] == 'https://m.media-amazon.com/1.jpg'
+
+
+def test_extract_variant_data():
+    assert extract_variant_data(product_page(VARIANT_SCRIPT)) == {
+        'B01ABC': ['Black', 'Large'],
+        'B01ABD': ['White', 'Small'],
+    }
+
+
+def test_only_matching_script_blocks_are_searched():
+    # the same text outside a script block is not product data
+    response = product_page(body=f'<pre>{VARIANT_SCRIPT}</pre>')
+    assert extract_variant_data(response) == {}
+
+
+def test_missing_or_broken_data():
+    assert extract_image_data(product_page()) == []
+    broken = IMAGE_SCRIPT.replace('"MAIN"}', '"MAIN"')
+    assert extract_image_data(product_page(broken)) == []
+
+
+def test_extract_product_data():
+    body = """
+    <span id="productTitle">  USB-C Cable  </span>
+    <span class="a-price"><span class="a-offscreen">$9.99</span></span>
+    <i data-hook="average-star-rating"><span>4.5 out of 5 stars</span></i>
+    <div data-hook="total-review-count"><span>1,234 global ratings</span></div>
+    <div id="feature-bullets"><ul><li> Fast charging </li><li>6 ft long</li></ul></div>
+    """
+    product = extract_product_data(product_page(IMAGE_SCRIPT, VARIANT_SCRIPT, body=body))
+
+    assert product['name'] == 'USB-C Cable'
+    assert product['price'] == '$9.99'
+    assert product['stars'] == '4.5 out of 5 stars'
+    assert product['rating_count'] == '1,234 global ratings'
+    assert product['feature_bullets'] == ['Fast charging', '6 ft long']
+    assert len(product['images']) == 2
+    assert set(product['variant_data']) == {'B01ABC', 'B01ABD'}
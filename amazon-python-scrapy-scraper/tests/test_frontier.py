@@ -0,0 +1,165 @@
+# Tests for the persisted crawl frontier
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+import nltk
+import pytest
+import scrapy
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.frontier import CrawlFrontier, LocalFrontierStore
+from amazon.middlewares import CAPTCHA, JS_SHELL, LAST_PAGE, NOT_FOUND, CrawlFrontierMiddleware
+
+
+class Spider(scrapy.Spider):
+    name = 'frontier_test'
+
+    def parse_reviews(self, response):
+        pass
+
+
+def local_frontier(tmp_path, job_id='job-1'):
+    return CrawlFrontier.from_settings(Settings({'CRAWL_FRONTIER_DIR': str(tmp_path)}), job_id)
+
+
+def test_without_job_id_nothing_is_saved(tmp_path):
+    frontier = CrawlFrontier.from_settings(Settings({'CRAWL_FRONTIER_DIR': str(tmp_path)}))
+    frontier.mark_sort_completed('B01', 0)
+    frontier.save()
+
+    assert frontier.store is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_resumed_crawl_gets_pending_requests_back(tmp_path):
+    spider = Spider()
+    request = Request('https://www.amazon.com/product-reviews/B01/?pageNumber=3', callback=spider.parse_reviews,
+                      meta={'asin': 'B01', 'sort': 0, 'page': 3})
+
+    frontier = local_frontier(tmp_path)
+    assert not frontier.resumed
+    frontier.add(request, spider)
+    frontier.save()
+
+    resumed = local_frontier(tmp_path)
+    assert resumed.resumed
+    [pending] = resumed.pending_requests(spider)
+    assert pending.url == request.url
+    assert pending.callback == spider.parse_reviews
+    assert pending.meta['page'] == 3
+
+
+def test_done_uses_the_key_from_when_the_request_was_added(tmp_path):
+    spider = Spider()
+    request = Request('https://www.amazon.com/product-reviews/B01/', meta={'asin': 'B01'})
+
+    frontier = local_frontier(tmp_path)
+    frontier.add(request, spider)
+    # the proxy middleware swaps the url before the response comes back
+    proxied = request.replace(url='https://proxy.example.com/?url=https://www.amazon.com/product-reviews/B01/')
+    frontier.done(proxied)
+
+    assert frontier.pending == {}
+
+
+def test_sort_state_is_kept(tmp_path):
+    frontier = local_frontier(tmp_path)
+    chain = frontier.chain_state('B01')
+    chain['current_sort'] = 2
+    chain['total_pages'] = 14
+    frontier.mark_sort_completed('B01', 0)
+    frontier.mark_sort_completed('B01', 0)
+    frontier.mark_sort_completed('B01', 1)
+    frontier.save()
+
+    resumed = local_frontier(tmp_path)
+    assert resumed.chain_state('B01') == {'current_sort': 2, 'total_pages': 14, 'completed_sorts': [0, 1]}
+    assert resumed.is_sort_completed('B01', 1)
+    assert not resumed.is_sort_completed('B01', 2)
+    assert not resumed.is_sort_completed('B02', 0)
+
+
+def test_clear_removes_the_saved_frontier(tmp_path):
+    frontier = local_frontier(tmp_path)
+    frontier.mark_sort_completed('B01', 0)
+    frontier.save()
+    frontier.clear()
+
+    assert not local_frontier(tmp_path).resumed
+
+
+def test_save_leaves_no_temp_file(tmp_path):
+    store = LocalFrontierStore(str(tmp_path / 'job'))
+    store.save({'pending': {}, 'chains': {}})
+
+    assert os.listdir(tmp_path / 'job') == ['frontier.pickle']
+    assert store.load() == {'pending': {}, 'chains': {}}
+
+
+@pytest.fixture
+def reviews_spider(tmp_path, monkeypatch):
+    # importing the spider imports analysis_pipeline, which downloads the nltk data
+    monkeypatch.setattr(nltk, 'download', lambda *args, **kwargs: True)
+    from amazon.spiders.amazon_reviews import AmazonReviewsSpider
+
+    spider = AmazonReviewsSpider(asin='B01', job_id='job-1')
+    spider.frontier = local_frontier(tmp_path)
+    return spider
+
+
+def review_page(spider, page_class, sort=3, page=4):
+    url = f'https://www.amazon.com/product-reviews/B01/?sort={sort}&pageNumber={page}'
+    request = Request(url, callback=spider.parse_reviews, meta={
+        'asin': 'B01', 'review_page': True, 'sort': sort, 'page': page, 'total_pages': page,
+        'review_page_class': page_class,
+    })
+    spider.frontier.add(request, spider)
+    return HtmlResponse(url=url, body=b'<html><body></body></html>', request=request)
+
+
+def crawl_page(spider, response):
+    middleware = CrawlFrontierMiddleware()
+    return list(middleware.process_spider_output(response, spider.parse_reviews(response), spider))
+
+
+@pytest.mark.parametrize('page_class', [LAST_PAGE, NOT_FOUND])
+def test_sort_is_completed_on_its_last_page(reviews_spider, page_class):
+    response = review_page(reviews_spider, page_class)
+    [next_sort] = crawl_page(reviews_spider, response)
+
+    assert reviews_spider.frontier.is_sort_completed('B01', 3)
+    assert next_sort.meta['sort'] == 4
+    assert list(reviews_spider.frontier.pending) == [next_sort.meta['frontier_key']]
+
+
+@pytest.mark.parametrize('page_class', [CAPTCHA, JS_SHELL])
+def test_page_retries_ran_out_on_is_resumed(tmp_path, reviews_spider, page_class):
+    response = review_page(reviews_spider, page_class)
+    [next_sort] = crawl_page(reviews_spider, response)
+
+    # the crawl moves on to the next sort but keeps this one to resume
+    assert next_sort.meta['sort'] == 4
+    assert not reviews_spider.frontier.is_sort_completed('B01', 3)
+    assert response.meta['frontier_key'] in reviews_spider.frontier.pending
+
+    # the other sorts finish, the crawl does too and the failed page is kept
+    reviews_spider.frontier.done(next_sort)
+    CrawlFrontierMiddleware().spider_closed(reviews_spider, 'finished')
+
+    resumed = local_frontier(tmp_path)
+    [request] = resumed.pending_requests(reviews_spider)
+    assert (request.meta['sort'], request.meta['page']) == (3, 4)
+
+
+def test_finished_crawl_clears_the_frontier(tmp_path, reviews_spider):
+    crawl_page(reviews_spider, review_page(reviews_spider, LAST_PAGE, sort=10))
+    CrawlFrontierMiddleware().spider_closed(reviews_spider, 'finished')
+
+    assert not local_frontier(tmp_path).resumed
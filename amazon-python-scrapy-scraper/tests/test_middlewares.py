@@ -0,0 +1,117 @@
+# Tests for the review page classification and retries
+#
+#   python -m pytest tests
+
+import logging
+import os
+import sys
+
+import pytest
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.middlewares import (
+    CAPTCHA,
+    HAS_NEXT_PAGE,
+    JS_SHELL,
+    LAST_PAGE,
+    NOT_FOUND,
+    ReviewPageRetryMiddleware,
+    classify_review_page,
+)
+
+
+URL = 'https://www.amazon.com/product-reviews/B01ABC/'
+
+REVIEW_LIST = '<div id="cm_cr-review_list"><div class="review">Works well</div></div>'
+NEXT_LINK = '<ul class="a-pagination"><li class="a-last"><a href="/product-reviews/B01ABC/?pageNumber=2">Next</a></li></ul>'
+DISABLED_NEXT = '<ul class="a-pagination"><li class="a-disabled a-last">Next</li></ul>'
+
+
+def review_page(body, status=200):
+    return HtmlResponse(url=URL, status=status, body=f'<html><body>{body}</body></html>', encoding='utf-8')
+
+
+@pytest.mark.parametrize('body, status, page_class', [
+    (REVIEW_LIST + NEXT_LINK, 200, HAS_NEXT_PAGE),
+    (REVIEW_LIST + DISABLED_NEXT, 200, LAST_PAGE),
+    (REVIEW_LIST, 200, LAST_PAGE),
+    ('<div id="a-page"><script>P.load("reviews")</script></div>', 200, JS_SHELL),
+    ('<form action="/errors/validateCaptcha"></form>', 200, CAPTCHA),
+    ('<title dir="ltr">Robot Check</title>', 200, CAPTCHA),
+    ('Service Unavailable', 503, CAPTCHA),
+    ('Page Not Found', 404, NOT_FOUND),
+    # a 404 wins over anything in its body
+    (REVIEW_LIST + NEXT_LINK, 404, NOT_FOUND),
+])
+def test_classify_review_page(body, status, page_class):
+    assert classify_review_page(review_page(body, status)) == page_class
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, spider=None):
+        self.values[key] = self.values.get(key, 0) + 1
+
+
+class Spider:
+    logger = logging.getLogger('test')
+
+
+class RetryMiddleware(ReviewPageRetryMiddleware):
+    # hands the retry request back instead of scheduling it on the reactor
+    def delay_request(self, request, delay):
+        self.delay = delay
+        return request
+
+
+def test_captcha_pages_are_retried():
+    middleware = RetryMiddleware(Stats(), max_retry_times=2, backoff_base=2.0)
+    request = Request(URL, meta={'review_page': True})
+
+    retry = middleware.process_response(request, review_page('Robot Check', 503), Spider())
+
+    assert isinstance(retry, Request)
+    assert retry.meta['review_page_retry_times'] == 1
+    assert retry.dont_filter
+    assert 1.0 <= middleware.delay <= 2.0
+    assert middleware.stats.values['review_page/retry/captcha'] == 1
+
+
+def test_retries_stop_at_max_retry_times():
+    middleware = RetryMiddleware(Stats(), max_retry_times=2)
+    request = Request(URL, meta={'review_page': True, 'review_page_retry_times': 2})
+    response = review_page('', 200)
+
+    assert middleware.process_response(request, response, Spider()) is response
+    assert request.meta['review_page_class'] == JS_SHELL
+    assert middleware.stats.values['review_page/retry/max_reached/js_shell'] == 1
+
+
+@pytest.mark.parametrize('body, status', [(REVIEW_LIST, 200), ('Page Not Found', 404)])
+def test_other_pages_are_not_retried(body, status):
+    middleware = RetryMiddleware(Stats())
+    request = Request(URL, meta={'review_page': True})
+    response = review_page(body, status)
+
+    assert middleware.process_response(request, response, Spider()) is response
+
+
+def test_archived_pages_are_not_retried():
+    middleware = RetryMiddleware(Stats())
+    request = Request(URL, meta={'review_page': True})
+    response = HtmlResponse(url=URL, status=503, body=b'', flags=['archived'])
+
+    assert middleware.process_response(request, response, Spider()) is response
+
+
+def test_backoff_delay_is_capped():
+    middleware = ReviewPageRetryMiddleware(Stats(), backoff_base=2.0, backoff_max=10.0)
+    for retries in range(8):
+        delay = middleware.get_backoff_delay(retries)
+        cap = min(10.0, 2.0 * 2 ** retries)
+        assert cap / 2 <= delay <= cap
@@ -0,0 +1,80 @@
+# Tests for the MinHash signatures and near-duplicate grouping
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.near_duplicates import (
+    BANDS,
+    NEAR_DUPLICATE_THRESHOLD,
+    NUM_PERMUTATIONS,
+    assign_duplicates,
+    band_buckets,
+    minhash,
+    normalize_text,
+    similarity,
+)
+
+
+REVIEW = ("I bought this cable for my laptop and it charges really fast, "
+          "the braided cord feels sturdy and it still works after six months.")
+SYNDICATED = ("I bought this cable for my laptop and it charges REALLY fast!! "
+              "The braided cord feels sturdy, and it still works after six months")
+EDITED = REVIEW.replace("six months", "seven months of daily use")
+UNRELATED = ("The blender is loud and the lid cracked on the second day, "
+             "customer service never answered my emails about a replacement.")
+
+
+def test_normalize_text():
+    assert normalize_text("  Great,   product!!\nWould BUY again. ") == "great product would buy again"
+    assert normalize_text(None) == ""
+
+
+def test_signature_is_deterministic():
+    signature = minhash(REVIEW)
+    assert signature.shape == (NUM_PERMUTATIONS,)
+    assert (signature == minhash(REVIEW)).all()
+
+
+def test_similarity_of_copies():
+    assert similarity(minhash(REVIEW), minhash(SYNDICATED)) == 1.0
+    assert similarity(minhash(REVIEW), minhash(EDITED)) >= NEAR_DUPLICATE_THRESHOLD
+    assert similarity(minhash(REVIEW), minhash(UNRELATED)) < 0.2
+
+
+def test_copies_share_buckets():
+    buckets = band_buckets(minhash(REVIEW))
+    assert len(buckets) == BANDS
+    assert all(0 <= bucket < 2 ** 63 for bucket in buckets)
+
+    assert buckets == band_buckets(minhash(SYNDICATED))
+    assert set(buckets) & set(band_buckets(minhash(EDITED)))
+    assert not set(buckets) & set(band_buckets(minhash(UNRELATED)))
+
+
+def test_duplicates_point_at_an_older_review():
+    assert assign_duplicates([(1, 2, 0.9), (1, 3, 0.85)]) == {2: (1, 0.9), 3: (1, 0.85)}
+
+
+def test_duplicates_are_not_transitive():
+    # 1~2 and 2~3, but 3 isn't similar to 1, which is the review that's kept
+    assert assign_duplicates([(1, 2, 0.9), (2, 3, 0.9)]) == {2: (1, 0.9)}
+
+
+def test_most_similar_kept_review_wins():
+    assert assign_duplicates([(1, 3, 0.85), (2, 3, 0.95)]) == {3: (2, 0.95)}
+    # ties go to the oldest
+    assert assign_duplicates([(1, 3, 0.9), (2, 3, 0.9)]) == {3: (1, 0.9)}
+
+
+def test_marked_reviews_are_not_kept():
+    # 2 was marked by an earlier run, so 3 can only duplicate 1
+    assert assign_duplicates([(1, 3, 0.85), (2, 3, 0.95)], marked={2}) == {3: (1, 0.85)}
+    assert assign_duplicates([(2, 3, 0.95)], marked={2}) == {}
+
+
+def test_no_pairs():
+    assert assign_duplicates([]) == {}
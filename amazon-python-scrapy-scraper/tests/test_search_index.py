@@ -0,0 +1,172 @@
+# Tests for the keyword search index, with the nltk stopwords and lemmatizer
+# stubbed out and a stub cursor standing in for mysql
+#
+#   python -m pytest tests
+
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import search_index
+from amazon.search_index import LEMMA, WORD, index_terms, keyword_in_context, search_reviews, tokenize
+
+
+STOP_WORDS = frozenset({'the', 'a', 'is', 'it', 'and', 'after'})
+
+
+@pytest.fixture(autouse=True)
+def no_nltk(monkeypatch):
+    monkeypatch.setattr(search_index, 'get_stop_words', lambda: STOP_WORDS)
+    monkeypatch.setattr(search_index, 'lemmatize', lambda token: token[:-1] if token.endswith('s') else token)
+
+
+def test_tokenize_keeps_apostrophes_and_spans():
+    assert tokenize("Didn't work, CABLES!") == [("didn't", (0, 6)), ('work', (7, 11)), ('cables', (13, 19))]
+
+
+def test_index_terms():
+    terms = index_terms('The cables and the cable broke')
+
+    assert terms == {
+        (WORD, 'cables'): [1],
+        (LEMMA, 'cable'): [1, 4],
+        (WORD, 'cable'): [4],
+        (WORD, 'broke'): [5],
+        (LEMMA, 'broke'): [5],
+    }
+
+
+def test_index_terms_skips_long_tokens():
+    assert index_terms('x' * 65) == {}
+
+
+TEXT = 'one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen'
+
+
+def test_snippet_in_the_middle_gets_ellipses():
+    [snippet] = keyword_in_context(TEXT, [7], window=2)
+
+    assert snippet == {'before': '...six seven ', 'match': 'eight', 'after': ' nine ten...'}
+
+
+def test_snippet_at_the_edges_has_no_ellipses():
+    first, last = keyword_in_context(TEXT, [0, 14], window=2)
+
+    assert first == {'before': '', 'match': 'one', 'after': ' two three...'}
+    assert last == {'before': '...thirteen fourteen ', 'match': 'fifteen', 'after': ''}
+
+
+def test_snippet_exactly_window_away_from_the_edges():
+    [snippet] = keyword_in_context('one two three four five', [2], window=2)
+
+    assert snippet == {'before': 'one two ', 'match': 'three', 'after': ' four five'}
+
+
+def test_snippets_are_capped_and_skip_stale_positions():
+    snippets = keyword_in_context(TEXT, [99, 3, 1, 3, 5, 9], window=1, max_snippets=3)
+
+    assert [snippet['match'] for snippet in snippets] == ['two', 'four', 'six']
+
+
+class Cursor:
+    # returns the postings hits for the search query and the reviews they point at
+    def __init__(self, hits, reviews):
+        self.hits = hits
+        self.reviews = reviews
+        self.queries = []
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.queries.append((query, list(params)))
+        if 'FROM review_postings' in query:
+            limit = params[-1]
+            self.rows = self.hits[:limit]
+        elif 'FROM reviews' in query:
+            self.rows = [self.reviews[review_id] for review_id in params if review_id in self.reviews]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def review(review_id, text):
+    return (review_id, 'title', text, datetime.date(2023, 5, 1), 5, 1, 'the United States')
+
+
+def postings_query(cursor):
+    return [query for query in cursor.queries if 'FROM review_postings' in query[0]][-1]
+
+
+def search(cursor, query, **kwargs):
+    return search_reviews(Connection(cursor), 'B01', query, **kwargs)
+
+
+def test_stopword_only_query_reads_nothing():
+    cursor = Cursor([], {})
+    result = search(cursor, 'the and it')
+
+    assert result == {'query': 'the and it', 'terms': [], 'results': [], 'next': None}
+    assert cursor.queries == []
+
+
+def test_lemma_and_exact_terms():
+    cursor = Cursor([], {})
+    assert search(cursor, 'The Cables')['terms'] == ['cable']
+    query, params = postings_query(cursor)
+    assert params[:3] == ['B01', LEMMA, 'cable']
+
+    assert search(cursor, 'The Cables', exact=True)['terms'] == ['cables']
+    query, params = postings_query(cursor)
+    assert params[:3] == ['B01', WORD, 'cables']
+
+
+def test_every_term_has_to_match():
+    cursor = Cursor([], {})
+    search(cursor, 'cable broke cables', ratings=[1, 2])
+    query, params = postings_query(cursor)
+
+    # cable and cables are one lemma, so two terms
+    assert 'HAVING COUNT(*) = %s' in query
+    assert params == ['B01', LEMMA, 'broke', 'cable', 1, 2, 2, 21]
+
+
+def test_paging():
+    texts = {review_id: f'cable {review_id}' for review_id in (9, 7, 5, 3)}
+    hits = [(review_id, '0') for review_id in (9, 7, 5, 3)]
+    cursor = Cursor(hits, {review_id: review(review_id, text) for review_id, text in texts.items()})
+
+    first = search(cursor, 'cable', limit=2)
+    assert [result['id'] for result in first['results']] == [9, 7]
+    # the next page starts below the last review shown
+    assert first['next'] == 7
+
+    cursor.hits = hits[2:]
+    second = search(cursor, 'cable', limit=2, after=first['next'])
+    query, params = postings_query(cursor)
+    assert 'review_id < %s' in query and 7 in params
+    assert [result['id'] for result in second['results']] == [5, 3]
+    assert second['next'] is None
+
+
+def test_results_have_snippets_and_skip_deleted_reviews():
+    cursor = Cursor([(4, '1'), (2, '0')], {4: review(4, 'great cable really')})
+    [result] = search(cursor, 'cable')['results']
+
+    assert result['id'] == 4
+    assert result['verified'] is True
+    assert result['date'] == '2023-05-01'
+    assert result['snippets'] == [{'before': 'great ', 'match': 'cable', 'after': ' really'}]
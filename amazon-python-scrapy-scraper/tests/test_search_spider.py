@@ -0,0 +1,95 @@
+# Tests for the organic ranks and asin dedup of the search spider
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon.items import AmazonSearchProductItem
+from amazon.spiders.amazon_search import AmazonSearchSpider
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, spider=None):
+        self.values[key] = self.values.get(key, 0) + 1
+
+
+class Crawler:
+    def __init__(self):
+        self.stats = Stats()
+
+
+def result(asin, ad=False):
+    href = f'/gp/slredirect/picassoRedirect.html/ref=sr_1_1?url=%2F{asin}' if ad else f'/Some-Product/dp/{asin}/ref=sr_1_1'
+    return (f'<div class="s-result-item" data-component-type="s-search-result" data-asin="{asin}">'
+            f'<h2><a href="{href}"><span>{asin}</span></a></h2></div>')
+
+
+def search_page(keyword, page, *results):
+    url = f'https://www.amazon.com/s?k={keyword}&page={page}'
+    return HtmlResponse(url=url, encoding='utf-8', body=f'<html><body>{"".join(results)}</body></html>',
+                        request=Request(url, meta={'keyword': keyword, 'page': page}))
+
+
+def spider(enqueue_top=0):
+    spider = AmazonSearchSpider(keywords='ipad,ipad case', enqueue_top=enqueue_top)
+    spider.crawler = Crawler()
+    spider.enqueued = []
+    spider.enqueue_reviews = lambda asin: spider.enqueued.append(asin) or f'job-{asin}'
+    return spider
+
+
+def parse(spider, keyword, page, *results):
+    items = spider.parse_search_results(search_page(keyword, page, *results))
+    return [item for item in items if isinstance(item, AmazonSearchProductItem)]
+
+
+def ranks(items):
+    return [(item['asin'], item['ad'], item['organic_rank']) for item in items]
+
+
+def test_ranks_come_from_page_and_position():
+    search = spider()
+    # page 2 comes back before page 1
+    page_2 = parse(search, 'ipad', 2, result('B0000000C'), result('B0000000X', ad=True), result('B0000000D'))
+    page_1 = parse(search, 'ipad', 1, result('B0000000A'), result('B0000000B'))
+
+    assert ranks(page_1) == [('B0000000A', False, 1), ('B0000000B', False, 2)]
+    per_page = AmazonSearchSpider.organic_per_page
+    assert ranks(page_2) == [('B0000000C', False, per_page + 1), ('B0000000X', True, None), ('B0000000D', False, per_page + 2)]
+
+
+def test_sponsored_listing_does_not_hide_the_organic_one():
+    search = spider(enqueue_top=3)
+    items = parse(search, 'ipad', 1, result('B0000000A', ad=True), result('B0000000B'), result('B0000000A'))
+
+    assert ranks(items) == [('B0000000A', True, None), ('B0000000B', False, 1), ('B0000000A', False, 2)]
+    assert search.enqueued == ['B0000000B', 'B0000000A']
+
+
+def test_ad_after_organic_is_left_out():
+    search = spider()
+    items = parse(search, 'ipad', 1, result('B0000000A'), result('B0000000A', ad=True))
+
+    assert ranks(items) == [('B0000000A', False, 1)]
+    assert search.crawler.stats.values['search/duplicate_asin'] == 1
+
+
+def test_asins_are_deduplicated_across_keywords():
+    search = spider(enqueue_top=1)
+    first = parse(search, 'ipad', 1, result('B0000000A'), result('B0000000B'))
+    # B is only emitted again because it's ranked high enough here to get its review crawl
+    second = parse(search, 'ipad case', 1, result('B0000000B'), result('B0000000A'))
+
+    assert ranks(first) == [('B0000000A', False, 1), ('B0000000B', False, 2)]
+    assert ranks(second) == [('B0000000B', False, 1)]
+    assert search.enqueued == ['B0000000A', 'B0000000B']
+    assert second[0]['review_crawl_job'] == 'job-B0000000B'
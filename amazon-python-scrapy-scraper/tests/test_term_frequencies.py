@@ -0,0 +1,93 @@
+# Tests for the per-asin term counts behind the wordclouds and the dedup subtraction
+#
+#   python -m pytest tests
+
+import os
+import sys
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from amazon import term_frequencies
+from amazon.term_frequencies import count_terms, review_sentiment, review_terms, subtract_review_terms
+
+
+def test_review_sentiment():
+    assert [review_sentiment(rating) for rating in (1, 3, 4, 5)] == ['negative', 'negative', 'positive', 'positive']
+
+
+def test_review_terms_words_and_phrases():
+    assert review_terms("Great cable, doesn't fray") == [
+        (1, 'great'), (1, 'cable'), (1, 'fray'),
+        (2, 'great cable'),
+    ]
+
+
+def test_phrases_never_span_a_stopword():
+    terms = review_terms('The charger is fast and the cable is long')
+
+    assert [term for n, term in terms if n == 2] == []
+    assert [term for n, term in terms if n == 1] == ['charger', 'fast', 'cable', 'long']
+
+
+def test_review_terms_skips_single_letters_and_long_terms():
+    long_word = 'x' * 300
+
+    assert review_terms(f'a {long_word} b') == []
+    assert review_terms(None) == []
+
+
+def test_count_terms_by_sentiment():
+    counts = count_terms([
+        ('Cable broke. Cable frayed', 1),
+        ('Cable works', 5),
+    ])
+
+    assert counts == Counter({
+        ('negative', 1, 'cable'): 2,
+        ('negative', 1, 'broke'): 1,
+        ('negative', 1, 'frayed'): 1,
+        ('negative', 2, 'cable broke'): 1,
+        ('negative', 2, 'broke cable'): 1,
+        ('negative', 2, 'cable frayed'): 1,
+        ('positive', 1, 'cable'): 1,
+        ('positive', 1, 'works'): 1,
+        ('positive', 2, 'cable works'): 1,
+    })
+
+
+class Cursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query, params=()):
+        self.executed.append((' '.join(query.split()), params))
+
+    def executemany(self, query, rows):
+        self.executed.append((' '.join(query.split()), list(rows)))
+
+
+def test_subtract_only_counted_reviews(monkeypatch):
+    monkeypatch.setattr(term_frequencies, 'get_watermark', lambda cursor, asin, stage: 10)
+    cursor = Cursor()
+
+    subtract_review_terms(cursor, 'B01', [(10, 'Cable broke', 1), (11, 'Cable works', 5)])
+
+    (update, rows), (delete, params) = cursor.executed
+    assert update.startswith('UPDATE term_frequencies SET count = count - %s')
+    assert sorted(rows) == [
+        (1, 'B01', 'negative', 1, 'broke'),
+        (1, 'B01', 'negative', 1, 'cable'),
+        (1, 'B01', 'negative', 2, 'cable broke'),
+    ]
+    assert delete == 'DELETE FROM term_frequencies WHERE asin = %s AND count <= 0'
+    assert params == ('B01',)
+
+
+def test_subtract_nothing_counted_yet(monkeypatch):
+    monkeypatch.setattr(term_frequencies, 'get_watermark', lambda cursor, asin, stage: 0)
+    cursor = Cursor()
+
+    subtract_review_terms(cursor, 'B01', [(1, 'Cable broke', 1)])
+
+    assert cursor.executed == []
@@ -1,20 +1,17 @@
-import pandas as pd
-import plotly.express as px
+# pandas, plotly express and boto3 are imported where they are first used
+# so the layout can be served without waiting on them
 import dash
 from dash import dcc
 from dash import html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash import dash_table
 from dash.dash_table.Format import Format, Scheme
 
 import re
 import requests
-
-# for importing images from aws
-import boto3
-from PIL import Image
-from io import BytesIO
+from flask import jsonify
+from concurrent.futures import ThreadPoolExecutor
 
 # for importing environment variables and secrets
 from dotenv import load_dotenv, find_dotenv
@@ -23,6 +20,37 @@ import os
 
 import mysql.connector
 
+import threading
+from cache import ttl_lru_cache, invalidate_asin, cache_stats, Uncached
+
+# seconds to cache each kind of result for
+WORDCLOUD_URL_TTL = 1800  # less than the 1 hour the presigned urls are valid for
+IMPORTANT_WORDS_TTL = 3600
+ASPECTS_TTL = 3600
+ROLLUPS_TTL = 300
+# how often to check whether a new analysis finished for an asin
+ANALYSIS_CHECK_TTL = 30
+PRODUCTS_TTL = 300
+
+# reviews shown per page of keyword search results
+SEARCH_PAGE_SIZE = 10
+
+# most products that can be compared at once, and threads used to load them
+MAX_COMPARE_PRODUCTS = 4
+COMPARE_WORKERS = 8
+
+# one long lived S3 client, boto3 clients are thread safe
+s3_client = None
+s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    global s3_client
+    with s3_client_lock:
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client('s3', region_name=os.getenv("AWS_BUCKET_REGION"))
+    return s3_client
+
 def get_mysql_connection():
     connection = mysql.connector.connect(
         host=os.getenv("MYSQL_HOST"),
@@ -33,12 +61,10 @@ def get_mysql_connection():
     return connection
 
 # function to grab the wordclouds from the bucket
+@ttl_lru_cache(maxsize=256, ttl=WORDCLOUD_URL_TTL)
 def fetch_wordclouds(asin_to_fetch):
 
-    bucket_region = os.getenv("AWS_BUCKET_REGION")
-    print(f"Bucket Region is {bucket_region}")
-    # Create a Boto3 S3 client
-    s3_client = boto3.client('s3', region_name=bucket_region)
+    s3_client = get_s3_client()
 
     # Specify the S3 bucket name
     bucket_name = os.getenv("AWS_BUCKET_NAME")
@@ -64,12 +90,10 @@ def fetch_wordclouds(asin_to_fetch):
     return {"neg_image_url": neg_image_url, "pos_image_url": pos_image_url}
 
 # function to grab important words from the s3 bucket
+@ttl_lru_cache(maxsize=256, ttl=IMPORTANT_WORDS_TTL)
 def fetch_important_words_csv(asin):
 
-    load_dotenv()
-
-    # Create a Boto3 S3 client
-    s3_client = boto3.client('s3', region_name=os.getenv("AWS_BUCKET_REGION"))
+    s3_client = get_s3_client()
 
     # Specify the S3 bucket name
     bucket_name = os.getenv("AWS_BUCKET_NAME")
@@ -82,43 +106,140 @@ def fetch_important_words_csv(asin):
         response = s3_client.get_object(Bucket=bucket_name, Key=file_name)
 
         # Read the CSV file using pandas
+        import pandas as pd
         df = pd.read_csv(response['Body'])
 
         return df
 
+    except s3_client.exceptions.NoSuchKey:
+        # not analyzed yet, the cache is dropped when an analysis finishes
+        return None
+
     except Exception as e:
+        # anything else may work on the next try, so it isn't cached
         print(f"Error fetching important words CSV for ASIN {asin}: {str(e)}")
-        return None
+        return Uncached(None)
     
-# function to fetch reviews withg certain asin
-def fetch_reviews(asin):
-    # Establish a connection to your MySQL database
+# function to grab the precomputed aspect table from the s3 bucket
+@ttl_lru_cache(maxsize=256, ttl=ASPECTS_TTL)
+def fetch_aspects_csv(asin):
+
+    s3_client = get_s3_client()
+    bucket_name = os.getenv("AWS_BUCKET_NAME")
+
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=f'aspects_{asin}.csv')
+
+        import pandas as pd
+        return pd.read_csv(response['Body'])
+
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+    except Exception as e:
+        print(f"Error fetching aspects CSV for ASIN {asin}: {str(e)}")
+        return Uncached(None)
+
+# function to fetch the per month and rating review counts for an asin
+# these rollups are kept up to date by the scraper as reviews are inserted
+@ttl_lru_cache(maxsize=256, ttl=ROLLUPS_TTL)
+def fetch_rating_rollups(asin):
+    import pandas as pd
+
     conn = get_mysql_connection()
+    cursor = None
 
     try:
-        # Create a cursor object to execute SQL queries
         cursor = conn.cursor()
 
-        # Define the SQL query to fetch reviews for the specified ASIN
-        query = f"SELECT * FROM reviews WHERE asin = '{asin}'"
+        query = """SELECT month, rating, count, verified_count FROM review_rollups
+                   WHERE asin = %s ORDER BY month, rating"""
+        cursor.execute(query, (asin,))
+
+        df = pd.DataFrame(cursor.fetchall(), columns=['month', 'rating', 'count', 'verified_count'])
 
-        # Execute the SQL query
-        cursor.execute(query)
+        return df
 
-        # Fetch all the reviews
-        reviews = cursor.fetchall()
+    except mysql.connector.Error as e:
+        print(f"Error fetching rating rollups for ASIN {asin}: {str(e)}")
+        return Uncached(pd.DataFrame(columns=['month', 'rating', 'count', 'verified_count']))
 
-        # Get the column names from the cursor description
-        column_names = [desc[0] for desc in cursor.description]
+    finally:
+        # Close the cursor and connection
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
 
-        # Create a pandas DataFrame from the fetched reviews
-        df = pd.DataFrame(reviews, columns=column_names)
+# function to fetch the monthly average predicted sentiment of an asin
+# the scraper scores every review with the asin's sentiment model and keeps per month sums
+# of the scores, which are stored as the probability of positive times 10000
+@ttl_lru_cache(maxsize=256, ttl=ROLLUPS_TTL)
+def fetch_sentiment_rollups(asin):
+    conn = get_mysql_connection()
+    cursor = None
 
-        return df
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""SELECT month, score_sum / count / 10000, count FROM sentiment_rollups
+                          WHERE asin = %s ORDER BY month""", (asin,))
+        return [{'month': month, 'sentiment': float(sentiment), 'count': count}
+                for month, sentiment, count in cursor.fetchall()]
 
     except mysql.connector.Error as e:
-        print(f"Error fetching reviews for ASIN {asin}: {str(e)}")
-        return None
+        print(f"Error fetching sentiment rollups for ASIN {asin}: {str(e)}")
+        return Uncached([])
+
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+def create_sentiment_plot(rollups, sentiment):
+    import plotly.graph_objects as go
+
+    # average star rating per month from the rating rollups
+    months = {}
+    for rollup in rollups:
+        rating_total, count = months.get(rollup['month'], (0, 0))
+        months[rollup['month']] = (rating_total + rollup['rating'] * rollup['count'], count + rollup['count'])
+    rating_months = sorted(months)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=rating_months, y=[months[month][0] / months[month][1] for month in rating_months],
+                             name='Average Rating', mode='lines'))
+    fig.add_trace(go.Scatter(x=[row['month'] for row in sentiment], y=[row['sentiment'] for row in sentiment],
+                             name='Predicted Positive', mode='lines', yaxis='y2'))
+    fig.update_layout(
+        xaxis={'title': 'Month'},
+        yaxis={'title': 'Average Rating', 'range': [1, 5]},
+        yaxis2={'title': 'Predicted Positive', 'range': [0, 1], 'overlaying': 'y', 'side': 'right', 'tickformat': '.0%'},
+        legend={'orientation': 'h', 'y': 1.1},
+    )
+
+    return fig
+
+# function to fetch the review counts of an asin split by month, rating, verified and location
+# it's sent to the browser once and the ratings graph filters are applied there
+# (see assets/ratings_filters.js), so it's kept compact: months and locations are
+# listed once and each row is [month index, rating, verified, location index, count]
+@ttl_lru_cache(maxsize=256, ttl=ROLLUPS_TTL)
+def fetch_review_facets(asin):
+    conn = get_mysql_connection()
+    cursor = None
+
+    try:
+        cursor = conn.cursor()
+
+        query = """SELECT month, rating, verified, location, count FROM review_facets
+                   WHERE asin = %s ORDER BY month, rating"""
+        cursor.execute(query, (asin,))
+        results = cursor.fetchall()
+
+    except mysql.connector.Error as e:
+        print(f"Error fetching review facets for ASIN {asin}: {str(e)}")
+        return Uncached({"months": [], "locations": [], "rows": []})
 
     finally:
         # Close the cursor and connection
@@ -127,26 +248,139 @@ def fetch_reviews(asin):
         if conn and conn.is_connected():
             conn.close()
 
-def create_ratings_plot(df):
-    
-    df['date'] = pd.to_datetime(df['date'])
+    months = sorted({result[0] for result in results})
+    locations = sorted({result[3] for result in results})
+    month_index = {month: i for i, month in enumerate(months)}
+    location_index = {location: i for i, location in enumerate(locations)}
 
-    # Extract month and year for grouping
-    df['month'] = df['date'].dt.strftime('%Y-%m')
+    rows = [[month_index[month], rating, int(verified), location_index[location], count]
+            for month, rating, verified, location, count in results]
 
-    # Group the data by month and rating
-    grouped = df.groupby(['month', 'rating']).size().reset_index(name='count')
+    return {"months": months, "locations": locations, "rows": rows}
+
+# function to get when the last analysis of an asin finished
+# the scraper records this in analysis_runs after uploading new wordclouds and important words
+@ttl_lru_cache(maxsize=1024, ttl=ANALYSIS_CHECK_TTL)
+def fetch_analysis_version(asin):
+    conn = get_mysql_connection()
+    cursor = None
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT finished_at FROM analysis_runs WHERE asin = %s", (asin,))
+        row = cursor.fetchone()
+        return str(row[0]) if row else None
+
+    except mysql.connector.Error as e:
+        print(f"Error fetching analysis version for ASIN {asin}: {str(e)}")
+        return Uncached(None)
+
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+# last analysis version seen for each asin
+analysis_versions = {}
+
+def refresh_if_reanalyzed(asin):
+    # drop the cached results of an asin once a newer analysis of it has finished
+    version = fetch_analysis_version(asin)
+    if asin in analysis_versions and analysis_versions[asin] != version:
+        invalidate_asin(asin)
+    analysis_versions[asin] = version
+
+# function to load everything the figures need for an asin in one pass
+# the rollups, important words, aspects and wordcloud urls are fetched at the same time
+def load_product_bundle(asin):
+    refresh_if_reanalyzed(asin)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        rollups_future = executor.submit(fetch_rating_rollups, asin)
+        sentiment_future = executor.submit(fetch_sentiment_rollups, asin)
+        facets_future = executor.submit(fetch_review_facets, asin)
+        important_words_future = executor.submit(fetch_important_words_csv, asin)
+        aspects_future = executor.submit(fetch_aspects_csv, asin)
+        wordclouds_future = executor.submit(fetch_wordclouds, asin)
+
+        rollups_df = rollups_future.result()
+        sentiment = sentiment_future.result()
+        facets = facets_future.result()
+        important_words_df = important_words_future.result()
+        aspects_df = aspects_future.result()
+        image_urls = wordclouds_future.result()
+
+    # only json friendly values can go in a dcc.Store
+    return {
+        "asin": asin,
+        "rollups": rollups_df.to_dict('records'),
+        "facets": facets,
+        "sentiment": sentiment,
+        "important_words": important_words_df.to_dict('records') if important_words_df is not None else None,
+        "aspects": aspects_df.to_dict('records') if aspects_df is not None else None,
+        "wordclouds": image_urls,
+    }
+
+# shared pool for loading the products in the comparison view
+compare_executor = ThreadPoolExecutor(max_workers=COMPARE_WORKERS)
+
+# function to load the rollups and important words of several asins at the same time
+# each fetch is cached per asin, so adding a product to a comparison only loads that product
+def load_comparison_bundle(asins):
+    for asin in asins:
+        refresh_if_reanalyzed(asin)
+
+    rollups_futures = {asin: compare_executor.submit(fetch_rating_rollups, asin) for asin in asins}
+    important_words_futures = {asin: compare_executor.submit(fetch_important_words_csv, asin) for asin in asins}
+
+    products = []
+    for asin in asins:
+        rollups_df = rollups_futures[asin].result()
+        important_words_df = important_words_futures[asin].result()
+        products.append({
+            "asin": asin,
+            "rollups": rollups_df.to_dict('records'),
+            "important_words": important_words_df.to_dict('records') if important_words_df is not None else None,
+        })
+
+    return {"products": products}
+
+def create_comparison_plot(products, labels):
+    import pandas as pd
+    import plotly.express as px
+
+    # average rating per month for each product, overlaid on one graph
+    frames = []
+    for product in products:
+        rollups_df = pd.DataFrame(product["rollups"], columns=['month', 'rating', 'count', 'verified_count'])
+        if rollups_df.empty:
+            continue
+        rollups_df['rating_total'] = rollups_df['rating'] * rollups_df['count']
+        monthly = rollups_df.groupby('month', as_index=False)[['rating_total', 'count']].sum()
+        monthly['average_rating'] = monthly['rating_total'] / monthly['count']
+        monthly['product'] = labels.get(product["asin"], product["asin"])
+        frames.append(monthly)
+
+    trends = pd.concat(frames) if frames else pd.DataFrame(columns=['month', 'average_rating', 'count', 'product'])
+
+    fig = px.line(trends, x='month', y='average_rating', color='product',
+                hover_data=['count'],
+                labels={'month': 'Month', 'average_rating': 'Average Rating', 'count': 'Reviews', 'product': 'Product'})
+    fig.update_yaxes(range=[1, 5])
 
-    # Create the line graph
-    fig = px.line(grouped, x='month', y='count', color='rating',
-                labels={'month': 'Month', 'count': 'Number of Ratings'},
-                category_orders={'rating': [1, 2, 3, 4, 5]})
-    
     return fig
 
+# the product list is loaded by the refresh callback when the page first loads
+# instead of at import time, so a slow database can't hold up startup
+@ttl_lru_cache(maxsize=1, ttl=PRODUCTS_TTL)
 def get_products():
     # get all the unique product ASIN values
-    db = get_mysql_connection()
+    try:
+        db = get_mysql_connection()
+    except mysql.connector.Error as e:
+        print(f"Error fetching products: {str(e)}")
+        return Uncached(([], []))
 
     # Create a cursor object to execute MySQL queries
     cursor = db.cursor()
@@ -168,8 +402,6 @@ def get_products():
 
     return product_names, asins
 
-product_names, asins = get_products()
-
 # Custom circular component to display number of products reviews
 def CircularComponent(value):
     return html.Div([
@@ -183,6 +415,11 @@ def CircularComponent(value):
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP])
 app.title = 'Amazon Reviews Dashboard'
 
+# hit/miss counters for the data caches
+@app.server.route('/cache-stats')
+def show_cache_stats():
+    return jsonify(cache_stats())
+
 # Define the layout of the app
 app.layout = html.Div(
     style={'padding': '20px', 'justify-content': 'center'},
@@ -198,7 +435,7 @@ app.layout = html.Div(
         dbc.Col([        
                 dcc.Dropdown(
                 id='product-dropdown',
-                options=[{'label': product_name, 'value': asin} for product_name, asin in zip(product_names, asins)],
+                options=[],
                 placeholder='Select a product',
                 style={'color': 'black', 'padding-left': "20px", 'padding-right': "0px"}
             ),], width=9), 
@@ -241,6 +478,9 @@ app.layout = html.Div(
     ], id='form-modal', centered=True, is_open=False),
     html.Div(id='output-container'),
 
+    # data for the selected product, loaded once and shared by all the figure callbacks
+    dcc.Store(id='product-data'),
+
     # div with all of the figures
     html.Div([
         # div to display what product is selected
@@ -263,7 +503,34 @@ app.layout = html.Div(
                                     ],
                         width = 3, className = 'figure'), 
                 dbc.Col([
-                    html.Div("Ratings Graph", id="ratings-graph"),
+                    html.Div([
+                        html.Div('Number of Ratings by Month and Rating', className="main-subtitles",
+                                 style={'display': 'flex',
+                                        'justify-content': 'center',
+                                        'padding-bottom':'0ch'}),
+                        # drawn in the browser from the facets in product-data
+                        dcc.Graph(id='rating-counts-plot'),
+
+                        # filters for the ratings graph, applied client side
+                        dcc.RangeSlider(id='month-range-filter', min=0, max=0, step=1, value=[0, 0], marks=None),
+                        dbc.Row([
+                            dbc.Col([
+                                dcc.Checklist(id='rating-filter',
+                                              options=[{'label': f' {rating}', 'value': rating} for rating in range(1, 6)],
+                                              value=[1, 2, 3, 4, 5], inline=True,
+                                              inputStyle={'margin-left': '10px'})
+                            ], width=5),
+                            dbc.Col([
+                                dcc.Checklist(id='verified-filter',
+                                              options=[{'label': ' Verified only', 'value': 'verified'}],
+                                              value=[])
+                            ], width=3),
+                            dbc.Col([
+                                dcc.Dropdown(id='location-filter', options=[], multi=True,
+                                             placeholder='All locations', style={'color': 'black'})
+                            ], width=4),
+                        ]),
+                    ], id="ratings-graph"),
                 ], width = 5, style={'margin': '0px'}),
 
                 
@@ -278,13 +545,66 @@ app.layout = html.Div(
                     html.Div("Negative Wordcloud", id="neg-wordcloud")
                 ], width = 6, className='figure')
             ]),
+            # Third Row: predicted sentiment next to the star ratings
+            dbc.Row([
+                dbc.Col([
+                    html.Div("Sentiment Graph", id="sentiment-graph")
+                ], width = 12)
+            ]),
+            # Fourth Row: what reviewers talk about and how positive they are about it
+            dbc.Row([
+                dbc.Col([
+                    html.Div(id="aspects")
+                ], width = 12)
+            ]),
+            # Fifth Row: keyword search over the reviews
+            dbc.Row([
+                dbc.Col([
+                    html.Div("Search Reviews", className="main-subtitles"),
+                    dbc.InputGroup([
+                        dbc.Input(id='review-search-input', type='text',
+                                  placeholder='Find reviews mentioning a word, e.g. one from the important words'),
+                        dbc.Button('Search', id='review-search-button', n_clicks=0),
+                    ]),
+                    # no ratings checked means every rating
+                    dcc.Checklist(id='review-search-rating',
+                                  options=[{'label': f' {rating}', 'value': rating} for rating in range(1, 6)],
+                                  value=[], inline=True,
+                                  inputStyle={'margin-left': '10px'}),
+                    dcc.Loading(html.Div(id='review-search-results')),
+                    dbc.Button('More', id='review-search-more', n_clicks=0, style={'display': 'none'}),
+
+                    # id of the last review shown, the next page starts after it
+                    dcc.Store(id='review-search-cursor'),
+                ], width = 12)
+            ], style={'margin': '20px'}),
         ]),
     ], id="figure-div", style={"display":'none'}),
     
     # div to display something before product is selected
     html.Div([
         html.H3("Select a product or start a scrape request!")
-    ], id="home-placeholder", style={'display':'block', 'padding': '20px'})
+    ], id="home-placeholder", style={'display':'block', 'padding': '20px'}),
+
+    # comparison of several products
+    html.Div([
+        html.H4("Compare Products", style={'margin': '20px'}),
+        dcc.Dropdown(
+            id='compare-dropdown',
+            options=[],
+            multi=True,
+            placeholder=f'Select up to {MAX_COMPARE_PRODUCTS} products to compare',
+            style={'color': 'black', 'padding-left': "20px", 'padding-right': "0px"}
+        ),
+
+        # data for the compared products
+        dcc.Store(id='compare-data'),
+
+        html.Div([
+            html.Div("Compare Ratings Graph", id="compare-ratings-graph"),
+            dbc.Row(id="compare-important-words"),
+        ], id="compare-div", style={"display":'none'}),
+    ], style={'margin-top': '40px'})
 ])
 
 
@@ -447,26 +767,41 @@ def display_selected_product(selected_product_asin, opt):
 
 # callback to refresh products
 @app.callback(
-    Output('product-dropdown', 'options'),
+    [Output('product-dropdown', 'options'),
+     Output('compare-dropdown', 'options')],
     Input('refresh-button', 'n_clicks')
 )
 def update_dropdown_options(n_clicks):
-    # Simulate fetching updated product data (product_names and asins)
+    # this also fires when the page first loads, which fills in the empty dropdown
+    # clicking refresh skips the cached product list
+    if n_clicks:
+        get_products.cache.invalidate()
+
     updated_product_names, updated_asins = get_products()
     
     options = [{'label': product_name, 'value': asin} for product_name, asin in zip(updated_product_names, updated_asins)]
-    return options
+    return options, options
+
+# Define the callback to load the data for the selected product
+@app.callback(
+    Output('product-data', 'data'),
+    [Input('product-dropdown', 'value')]
+)
+def load_product_data(asin):
+    if asin:
+        return load_product_bundle(asin)
+    return None
 
 # Define the callback to update the wordclouds
 @app.callback(
     [Output('pos-wordcloud', 'children'),
      Output('neg-wordcloud', 'children')],
-    [Input('product-dropdown', 'value')]
+    [Input('product-data', 'data')]
 )
-def update_wordclouds(asin):
-    if asin:
-        # Fetch the wordclouds for the selected ASIN
-        image_urls = fetch_wordclouds(asin_to_fetch=asin)
+def update_wordclouds(bundle):
+    if bundle:
+        # wordclouds for the selected ASIN
+        image_urls = bundle["wordclouds"]
 
         wordclouds = []
 
@@ -509,49 +844,54 @@ def update_wordclouds(asin):
         return html.Div(), html.Div()
     
 
+# table of the top ten sentiment model coefficients, colored by sign
+def create_important_words_table(important_words):
+    # selecting top ten variables and removing id row
+    import pandas as pd
+    important_words_df = pd.DataFrame(important_words).iloc[:10, 1:3]
+
+    return dash_table.DataTable(
+        data=important_words_df.to_dict('records'),
+                columns=[
+                    {'id': 'feature', 'name': 'Word'},
+                    {'id': 'coefficient', 'name': 'Coefficient', 'type': 'numeric'
+                     , "format": Format(precision=3, scheme=Scheme.fixed)}
+                ],
+                # conditional styling based on value of coefficient
+                style_data_conditional=[
+                    {
+                        'if': {'filter_query': '{coefficient} > 0'},
+                        'backgroundColor': '#90EE90',
+                        'color': '#013220'
+                    },
+                    {
+                        'if': { 'filter_query': '{coefficient} < 0'},
+                        'backgroundColor': '#ffcccb',
+                        'color': '#8B0000'
+                    },
+                ],
+                style_cell={'textAlign': 'center'},
+                cell_selectable = False
+    )
+
 # Define the callback to update the important words table
 @app.callback(
     Output('important-words', 'children'),
-    [Input('product-dropdown', 'value')]
+    [Input('product-data', 'data')]
 )
-def update_important_words(asin):
-    if asin:
-        # Fetch the wordclouds for the selected ASIN
-        important_words_df = fetch_important_words_csv(asin=asin)
-        
-        # selecting top ten variables and removing id row
-        important_words_df = important_words_df.iloc[:10, 1:3]
+def update_important_words(bundle):
+    if bundle:
+        # important words for the selected ASIN
+        important_words = bundle["important_words"]
 
-        if isinstance(important_words_df, pd.DataFrame):
+        if important_words is not None:
             colored_words_table =  dbc.Col([
 
                 html.Div("Important Words From Sentiment Model", className="main-subtitles",
                          style={'display': 'flex',
                                 'justify-content': 'center'}),
                 
-                dash_table.DataTable(
-                    data=important_words_df.to_dict('records'),
-                            columns=[
-                                {'id': 'feature', 'name': 'Word'},
-                                {'id': 'coefficient', 'name': 'Coefficient', 'type': 'numeric'
-                                 , "format": Format(precision=3, scheme=Scheme.fixed)}
-                            ],
-                            # conditional styling based on value of coefficient
-                            style_data_conditional=[
-                                {
-                                    'if': {'filter_query': '{coefficient} > 0'},
-                                    'backgroundColor': '#90EE90',
-                                    'color': '#013220'
-                                },
-                                {
-                                    'if': { 'filter_query': '{coefficient} < 0'},
-                                    'backgroundColor': '#ffcccb',
-                                    'color': '#8B0000'
-                                },
-                            ],
-                            style_cell={'textAlign': 'center'},
-                            cell_selectable = False
-                )
+                create_important_words_table(important_words)
             ])
 
             return colored_words_table
@@ -565,28 +905,212 @@ def update_important_words(asin):
         return html.Div()
     
 
-# Define the callback to update the ratings graph and review count
+# Define the callback to update the aspects table
 @app.callback(
-    [Output('ratings-graph', 'children'),
-     Output('review-count', 'children')],
-    [Input('product-dropdown', 'value')])
-def update_ratings_graph(asin):
-    reviews_df = fetch_reviews(asin=asin)
+    Output('aspects', 'children'),
+    [Input('product-data', 'data')])
+def update_aspects(bundle):
+    # no table until the aspects of the product have been mined
+    if not bundle or not bundle["aspects"]:
+        return html.Div()
 
-    fig = create_ratings_plot(reviews_df)
-    graph = html.Div([
-        html.Div('Number of Ratings by Month and Rating', className="main-subtitles",
+    return html.Div([
+        html.Div('Most Mentioned Aspects', className="main-subtitles",
                  style={'display': 'flex',
-                        'justify-content': 'center',
-                        'padding-bottom':'0ch'}),
-        dcc.Graph(id='rating-counts-plot', figure=fig)
+                        'justify-content': 'center'}),
+        dash_table.DataTable(
+            data=bundle["aspects"],
+            columns=[
+                {'id': 'aspect', 'name': 'Aspect'},
+                {'id': 'mentions', 'name': 'Reviews', 'type': 'numeric'},
+                {'id': 'positive', 'name': 'Positive', 'type': 'numeric'},
+                {'id': 'negative', 'name': 'Negative', 'type': 'numeric'},
+                {'id': 'positive_ratio', 'name': 'Positive Share', 'type': 'numeric',
+                 "format": Format(precision=0, scheme=Scheme.percentage)}
+            ],
+            # sorting and paging happen in the browser, the table is already computed
+            sort_action='native',
+            page_size=10,
+            style_data_conditional=[
+                {
+                    'if': {'filter_query': '{positive_ratio} >= 0.7', 'column_id': 'positive_ratio'},
+                    'backgroundColor': '#90EE90',
+                    'color': '#013220'
+                },
+                {
+                    'if': {'filter_query': '{positive_ratio} <= 0.3', 'column_id': 'positive_ratio'},
+                    'backgroundColor': '#ffcccb',
+                    'color': '#8B0000'
+                },
+            ],
+            style_cell={'textAlign': 'center'},
+            cell_selectable = False
+        )
     ])
 
+
+# Define the callback to reset the ratings graph filters and update the review count
+@app.callback(
+    [Output('month-range-filter', 'max'),
+     Output('month-range-filter', 'value'),
+     Output('month-range-filter', 'marks'),
+     Output('location-filter', 'options'),
+     Output('location-filter', 'value'),
+     Output('review-count', 'children')],
+    [Input('product-data', 'data')])
+def update_ratings_filters(bundle):
+    if not bundle:
+        return 0, [0, 0], None, [], [], html.Div()
+
+    months = bundle["facets"]["months"]
+    last = max(len(months) - 1, 0)
+
+    # label the first and last month of the slider
+    marks = {0: months[0], last: months[-1]} if months else None
+    location_options = [{'label': location or 'Unknown', 'value': i} for i, location in enumerate(bundle["facets"]["locations"])]
+
     review_count_display = html.Div([html.Div("Reviews Scraped", style={'display': 'flex',
                                                                         'justify-content': 'center'},
                                                className="main-subtitles"),
-                                     CircularComponent(len(reviews_df))]) 
-    return graph, review_count_display
+                                     CircularComponent(sum(rollup['count'] for rollup in bundle["rollups"]))])
+    return last, [0, last], marks, location_options, [], review_count_display
+
+# ratings graph drawn in the browser, so changing a filter doesn't make a server call
+app.clientside_callback(
+    ClientsideFunction(namespace='ratings', function_name='filter_ratings_plot'),
+    Output('rating-counts-plot', 'figure'),
+    [Input('product-data', 'data'),
+     Input('month-range-filter', 'value'),
+     Input('rating-filter', 'value'),
+     Input('verified-filter', 'value'),
+     Input('location-filter', 'value')]
+)
+
+# Define the callback to update the predicted sentiment graph
+@app.callback(
+    Output('sentiment-graph', 'children'),
+    [Input('product-data', 'data')])
+def update_sentiment_graph(bundle):
+    # no scores until the sentiment model of the product has been trained
+    if not bundle or not bundle["sentiment"]:
+        return html.Div()
+
+    fig = create_sentiment_plot(bundle["rollups"], bundle["sentiment"])
+    return html.Div([
+        html.Div('Predicted Sentiment and Average Rating by Month', className="main-subtitles",
+                 style={'display': 'flex',
+                        'justify-content': 'center',
+                        'padding-bottom':'0ch'}),
+        dcc.Graph(id='sentiment-plot', figure=fig)
+    ])
+
+# one keyword search result, with the matches highlighted in their context
+def create_search_result(result):
+    return html.Div([
+        html.Div([html.B('★' * result["rating"]), f' {result["title"]} - {result["date"]}']),
+        *[html.P([snippet["before"], html.Mark(snippet["match"]), snippet["after"]])
+          for snippet in result["snippets"]]
+    ], className="search-result")
+
+# Define the callback to search the reviews of the selected product
+# the search itself runs against the scraper api's inverted index
+@app.callback(
+    [Output('review-search-results', 'children'),
+     Output('review-search-cursor', 'data'),
+     Output('review-search-more', 'style')],
+    [Input('review-search-button', 'n_clicks'),
+     Input('review-search-input', 'n_submit'),
+     Input('review-search-more', 'n_clicks'),
+     Input('product-dropdown', 'value')],
+    [State('review-search-input', 'value'),
+     State('review-search-rating', 'value'),
+     State('review-search-cursor', 'data'),
+     State('review-search-results', 'children')],
+    prevent_initial_call=True
+)
+def update_review_search(search_clicks, n_submit, more_clicks, asin, query, ratings, cursor, shown_results):
+    hidden = {'display': 'none'}
+
+    # a new product clears the results
+    if dash.ctx.triggered_id == 'product-dropdown' or not asin or not query:
+        return [], None, hidden
+
+    more = dash.ctx.triggered_id == 'review-search-more'
+
+    params = {'q': query, 'limit': SEARCH_PAGE_SIZE}
+    if ratings:
+        params['rating'] = ','.join(str(rating) for rating in ratings)
+    if more and cursor:
+        params['after'] = cursor
+
+    try:
+        response = requests.get(f'http://127.0.0.1:5000/api/search/{asin}', params=params, timeout=10)
+        search_results = response.json()
+    except Exception as e:
+        print(f"Error searching reviews for ASIN {asin}: {str(e)}")
+        return [html.Div("Failed to connect to server")], None, hidden
+
+    if response.status_code != 200:
+        print(f"Error searching reviews for ASIN {asin}: {search_results.get('message')}")
+        return [html.Div("Search failed")], None, hidden
+
+    results = [create_search_result(result) for result in search_results["results"]]
+    if more:
+        results = (shown_results or []) + results
+    if not results:
+        results = [html.Div(f'No reviews mention "{query}"')]
+
+    more_style = {'display': 'block'} if search_results["next"] else hidden
+    return results, search_results["next"], more_style
+
+# Define the callback to load the data for the compared products
+@app.callback(
+    Output('compare-data', 'data'),
+    [Input('compare-dropdown', 'value')]
+)
+def load_comparison_data(compare_asins):
+    if compare_asins:
+        return load_comparison_bundle(compare_asins[:MAX_COMPARE_PRODUCTS])
+    return None
+
+# Define the callback to update the comparison graph and tables
+@app.callback(
+    [Output('compare-ratings-graph', 'children'),
+     Output('compare-important-words', 'children'),
+     Output('compare-div', 'style')],
+    [Input('compare-data', 'data')],
+    [State('compare-dropdown', 'options')])
+def update_comparison(bundle, opt):
+    if not bundle:
+        return html.Div(), [], {'display': 'none'}
+
+    labels = {x['value']: x['label'] for x in opt}
+    products = bundle["products"]
+
+    fig = create_comparison_plot(products, labels)
+    graph = html.Div([
+        html.Div('Average Rating by Month', className="main-subtitles",
+                 style={'display': 'flex',
+                        'justify-content': 'center'}),
+        dcc.Graph(id='compare-ratings-plot', figure=fig)
+    ])
+
+    # one important words table per product, side by side
+    tables = []
+    for product in products:
+        if product["important_words"] is not None:
+            table = create_important_words_table(product["important_words"])
+        else:
+            table = html.Div("Important words df doesn't exist for this product.")
+
+        tables.append(dbc.Col([
+            html.Div(labels.get(product["asin"], product["asin"]), className="main-subtitles",
+                     style={'display': 'flex',
+                            'justify-content': 'center'}),
+            table
+        ], width=12 // MAX_COMPARE_PRODUCTS))
+
+    return graph, tables, {'display': 'block'}
 
 # Run the Dash app
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+/* assets/ratings_filters.js */
+
+/*
+ Filters the ratings graph in the browser.
+
+ product-data holds the facets of the selected product, the review counts split by
+ month, rating, verified and location:
+   {months: [...], locations: [...], rows: [[month index, rating, verified, location index, count], ...]}
+ so changing the month range, ratings, verified only or locations just sums those rows
+ again here instead of calling the server.
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ratings: {
+        filter_ratings_plot: function(bundle, monthRange, ratings, verifiedOnly, locations) {
+            if (!bundle || !bundle.facets) {
+                return {data: [], layout: {}};
+            }
+
+            var months = bundle.facets.months;
+            var rows = bundle.facets.rows;
+
+            // the slider can still hold the range of the previous product for a moment
+            var last = Math.max(months.length - 1, 0);
+            var start = Math.min(Math.max((monthRange || [0, last])[0], 0), last);
+            var end = Math.min(Math.max((monthRange || [0, last])[1], 0), last);
+
+            var ratingSet = new Set(ratings || []);
+            var onlyVerified = (verifiedOnly || []).indexOf('verified') !== -1;
+            // no locations selected means every location
+            var locationSet = (locations && locations.length) ? new Set(locations) : null;
+
+            // counts[rating][month index - start]
+            var counts = {};
+            ratingSet.forEach(function(rating) {
+                counts[rating] = new Array(end - start + 1).fill(0);
+            });
+
+            for (var i = 0; i < rows.length; i++) {
+                var row = rows[i];
+                var month = row[0], rating = row[1], verified = row[2], location = row[3], count = row[4];
+
+                if (month < start || month > end) continue;
+                if (!ratingSet.has(rating)) continue;
+                if (onlyVerified && !verified) continue;
+                if (locationSet && !locationSet.has(location)) continue;
+
+                counts[rating][month - start] += count;
+            }
+
+            var x = months.slice(start, end + 1);
+            var data = Object.keys(counts).sort().map(function(rating) {
+                return {
+                    type: 'scatter',
+                    mode: 'lines',
+                    name: rating,
+                    x: x,
+                    y: counts[rating],
+                    hovertemplate: 'Month=%{x}<br>Number of Ratings=%{y}<extra>' + rating + '</extra>'
+                };
+            });
+
+            return {
+                data: data,
+                layout: {
+                    xaxis: {title: {text: 'Month'}},
+                    yaxis: {title: {text: 'Number of Ratings'}},
+                    legend: {title: {text: 'rating'}},
+                    margin: {t: 20}
+                }
+            };
+        }
+    }
+});
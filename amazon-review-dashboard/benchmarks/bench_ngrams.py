@@ -0,0 +1,77 @@
+# Benchmark n-gram counting.
+#
+#   python benchmarks/bench_ngrams.py --reviews reviews_both.json
+#   python benchmarks/bench_ngrams.py --synthetic 50000
+#
+# Compares the old zip/join/Counter frequent_words over one flat token list with
+# the numpy engine in wordclouds.py, which keeps n-grams inside each review, and
+# prints reviews per second for unigrams, bigrams and trigrams. "encoded" is the
+# counting alone, for when the same encoded reviews are counted more than once.
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from wordclouds import count_ngrams, encode_reviews, frequent_ngrams, top_ngrams
+
+
+def legacy_frequent_words(list_words, ngrams_number=1, number_top_words=10):
+    # what wordclouds.frequent_words used to do
+    if ngrams_number >= 2:
+        ngrams = zip(*[list_words[index_token:] for index_token in range(ngrams_number)])
+        list_words = (" ".join(ngram) for ngram in ngrams)
+    return Counter(list_words).most_common(number_top_words)
+
+
+def load_reviews(reviews_path=None, synthetic=0):
+    if reviews_path:
+        import pandas as pd
+        df = pd.read_json(reviews_path)
+        return [text.lower().split() for text in df["text"]]
+
+    # reviews of 5 to 80 words drawn from a zipf-ish vocabulary
+    random.seed(0)
+    vocabulary = [f"word{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    return [random.choices(vocabulary, weights, k=random.randint(5, 80)) for _ in range(synthetic)]
+
+
+def run(name, fn, reviews, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {len(reviews) * repeat} reviews in {elapsed:.2f}s - {len(reviews) * repeat / elapsed:.0f} reviews/s')
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reviews', help='json file of reviews with a text column')
+    parser.add_argument('--synthetic', type=int, default=20000, help='number of generated reviews if no file is given')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    reviews = load_reviews(args.reviews, args.synthetic)
+    flat = [token for tokens in reviews for token in tokens]
+
+    # encoding is done once and shared by every n and group, so it's timed on its own too
+    print('encoding')
+    token_ids, review_index, vocabulary = run('numpy', lambda: encode_reviews(reviews), reviews, args.repeat)
+
+    for n in (1, 2, 3):
+        print(f'{n}-grams')
+        legacy = run('legacy', lambda: legacy_frequent_words(flat, n, args.top), reviews, args.repeat)
+        vectorized = run('numpy', lambda: frequent_ngrams(reviews, n, args.top), reviews, args.repeat)
+        run('encoded', lambda: top_ngrams(*count_ngrams(token_ids, review_index, n, len(vocabulary)), vocabulary, args.top),
+            reviews, args.repeat)
+
+        # the legacy counts include n-grams that cross from one review into the next
+        if n == 1 and [count for _, count in legacy] != [count for _, count in vectorized]:
+            print('  top unigram counts differ')
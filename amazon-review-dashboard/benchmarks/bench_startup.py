@@ -0,0 +1,76 @@
+# Benchmark dashboard startup.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 5 --port 8051
+#
+# Starts app.py in a fresh process and prints how long it takes until the page
+# and the dash layout first answer, i.e. the time to first byte after a cold start.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# started without the debug reloader so only one process serves the app
+RUN_APP = "import app; app.app.run_server(debug=False, port={port})"
+
+
+def wait_for(url, start, timeout):
+    # poll until the url returns its first byte, returns seconds since start
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                response.read(1)
+                return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.05)
+    return None
+
+
+def run_once(port, timeout):
+    base_url = f'http://127.0.0.1:{port}'
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', RUN_APP.format(port=port)],
+        cwd=APP_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        page = wait_for(base_url + '/', start, timeout)
+        layout = wait_for(base_url + '/_dash-layout', start, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return page, layout
+
+
+def report(name, times):
+    times = [t for t in times if t is not None]
+    if not times:
+        print(f'{name:>8}: no response')
+        return
+    print(f'{name:>8}: median {statistics.median(times):.2f}s  min {min(times):.2f}s  max {max(times):.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    pages, layouts = [], []
+    for _ in range(args.runs):
+        page, layout = run_once(args.port, args.timeout)
+        pages.append(page)
+        layouts.append(layout)
+
+    report('page', pages)
+    report('layout', layouts)
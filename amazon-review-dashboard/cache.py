@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+
+# every cache made by ttl_lru_cache, for the stats endpoint and invalidation
+CACHES = {}
+
+
+class TTLCache:
+    """
+    Size bounded LRU cache where every entry also expires after ttl seconds
+    Parameters
+    ----------
+    maxsize : int
+        number of entries kept, the least recently used one is evicted first
+    ttl : float
+        seconds an entry stays valid after it was stored
+    """
+
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, asin=None):
+        # drop every entry whose first argument is asin, or everything
+        with self.lock:
+            if asin is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if key[0] and key[0][0] == asin]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class Uncached:
+    """
+    Result that ttl_lru_cache hands back without storing it, e.g. the fallback
+    value of a fetch that failed, so the next call tries again
+    Parameters
+    ----------
+    value : object
+        what the decorated function returns to its caller
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+def ttl_lru_cache(maxsize=128, ttl=300):
+    """
+    Decorator caching a function's results in a TTLCache
+    The first positional argument is expected to be the asin so that all
+    entries for a product can be dropped with invalidate_asin. Results wrapped
+    in Uncached are returned unwrapped and not cached
+    """
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        CACHES[func.__name__] = cache
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            found, value = cache.get(key)
+            if found:
+                return value
+
+            value = func(*args, **kwargs)
+            if isinstance(value, Uncached):
+                return value.value
+            cache.set(key, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def invalidate_asin(asin):
+    for cache in CACHES.values():
+        cache.invalidate(asin)
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
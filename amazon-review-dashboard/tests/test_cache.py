@@ -0,0 +1,90 @@
+# Tests for the TTL/LRU cache of the dashboard's S3 and MySQL reads
+#
+#   python -m pytest tests
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import cache
+from cache import TTLCache, Uncached, invalidate_asin, ttl_lru_cache
+
+
+class Clock:
+    # stands in for time.monotonic
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    entries = TTLCache(maxsize=4, ttl=10)
+
+    entries.set(('a',), 1)
+    clock.now += 9
+    assert entries.get(('a',)) == (True, 1)
+    clock.now += 2
+    assert entries.get(('a',)) == (False, None)
+    assert entries.stats()['size'] == 0
+
+
+def test_least_recently_used_is_evicted():
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    entries.get('a')
+    entries.set('c', 3)
+
+    assert entries.get('b') == (False, None)
+    assert entries.get('a') == (True, 1)
+    assert entries.stats()['evictions'] == 1
+
+
+def test_results_are_cached_by_arguments():
+    calls = []
+
+    @ttl_lru_cache(maxsize=8, ttl=60)
+    def fetch(asin, sentiment=None):
+        calls.append((asin, sentiment))
+        return len(calls)
+
+    assert fetch('B01', sentiment='positive') == 1
+    assert fetch('B01', sentiment='positive') == 1
+    assert fetch('B01', sentiment='negative') == 2
+    assert fetch.cache.stats()['hits'] == 1
+
+
+def test_uncached_results_are_fetched_again():
+    calls = []
+
+    @ttl_lru_cache(maxsize=8, ttl=60)
+    def fetch(asin):
+        calls.append(asin)
+        return Uncached(None) if len(calls) == 1 else 'data'
+
+    assert fetch('B01') is None
+    assert fetch('B01') == 'data'
+    assert fetch('B01') == 'data'
+    assert len(calls) == 2
+
+
+def test_invalidate_asin_drops_only_that_asin():
+    calls = []
+
+    @ttl_lru_cache(maxsize=8, ttl=60)
+    def fetch_for_invalidation(asin):
+        calls.append(asin)
+        return asin
+
+    fetch_for_invalidation('B01')
+    fetch_for_invalidation('B02')
+    invalidate_asin('B01')
+    fetch_for_invalidation('B01')
+    fetch_for_invalidation('B02')
+
+    assert calls == ['B01', 'B02', 'B01']
@@ -0,0 +1,98 @@
+# Tests for the n-gram counting in wordclouds.py
+#
+#   python -m pytest tests
+
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from wordclouds import count_ngrams, encode_reviews, frequent_ngrams, frequent_words, top_ngrams
+
+
+REVIEWS = [
+    "battery life is great",
+    "great battery life",
+    "battery died",
+]
+
+
+def naive_ngrams(reviews, n):
+    # every n-gram of each review on its own, what the numpy engine has to match
+    counts = Counter()
+    for review in reviews:
+        tokens = review.split()
+        counts.update(" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+    return counts
+
+
+def test_encode_reviews():
+    token_ids, review_index, vocabulary = encode_reviews(["a b", ["b", "c"]])
+
+    assert vocabulary == {"a": 0, "b": 1, "c": 2}
+    assert token_ids.tolist() == [0, 1, 1, 2]
+    assert review_index.tolist() == [0, 0, 1, 1]
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_count_ngrams_matches_naive_count(n):
+    token_ids, review_index, vocabulary = encode_reviews(REVIEWS)
+    ngrams, counts = count_ngrams(token_ids, review_index, n, len(vocabulary))
+
+    tokens = list(vocabulary)
+    counted = {" ".join(tokens[i] for i in ngram): count for ngram, count in zip(ngrams.tolist(), counts.tolist())}
+    assert counted == naive_ngrams(REVIEWS, n)
+
+
+def test_ngrams_stay_inside_reviews():
+    # "great great" would only come from joining the end of one review to the next
+    token_ids, review_index, vocabulary = encode_reviews(["very great", "great product"])
+    ngrams, _ = count_ngrams(token_ids, review_index, 2, len(vocabulary))
+
+    tokens = list(vocabulary)
+    assert sorted(" ".join(tokens[i] for i in ngram) for ngram in ngrams.tolist()) == ["great product", "very great"]
+
+
+def test_count_ngrams_without_windows():
+    token_ids, review_index, vocabulary = encode_reviews(["one"])
+    ngrams, counts = count_ngrams(token_ids, review_index, 2, len(vocabulary))
+
+    assert ngrams.shape == (0, 2)
+    assert len(counts) == 0
+
+
+def test_count_ngrams_rejects_zero():
+    with pytest.raises(ValueError):
+        count_ngrams(np.array([0]), np.array([0]), 0, 1)
+
+
+def test_count_ngrams_large_vocabulary():
+    # vocabulary_size ** n doesn't fit an int64, the rows are compared instead
+    token_ids = np.array([0, 1, 0, 1], dtype=np.int64)
+    review_index = np.zeros(4, dtype=np.int64)
+    ngrams, counts = count_ngrams(token_ids, review_index, 3, 2 ** 32)
+
+    assert dict(zip(map(tuple, ngrams.tolist()), counts.tolist())) == {(0, 1, 0): 1, (1, 0, 1): 1}
+
+
+def test_top_ngrams_orders_by_count_then_ngram():
+    token_ids, review_index, vocabulary = encode_reviews(["b a", "a b", "c a"])
+    ngrams, counts = count_ngrams(token_ids, review_index, 1, len(vocabulary))
+
+    assert top_ngrams(ngrams, counts, vocabulary, 2) == [("a", 3), ("b", 2)]
+    assert top_ngrams(ngrams, counts, vocabulary, 10) == [("a", 3), ("b", 2), ("c", 1)]
+
+
+def test_frequent_ngrams_per_group():
+    frequent = frequent_ngrams(REVIEWS, 2, 1, groups=["positive", "positive", "negative"])
+
+    assert frequent == {"negative": [("battery died", 1)], "positive": [("battery life", 2)]}
+
+
+def test_frequent_words_flat_list():
+    # a flat token list is one review
+    assert frequent_words(["a", "b", "a", "b"], 2, 1) == [("a b", 2)]
@@ -1,5 +1,6 @@
 
 from collections import Counter
+import numpy as np
 import wordcloud
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -12,49 +13,163 @@ from wordcloud import WordCloud, STOPWORDS, ImageColorGenerator
 plt.rcParams["figure.figsize"] = [16, 9]
 
 
-def create_ngrams(token_list, nb_elements):
+def encode_reviews(reviews, vocabulary=None):
     """
-    Create n-grams for list of tokens
+    Encode the tokens of several reviews as integer ids
     Parameters
     ----------
-    token_list : list
-        list of strings
-    nb_elements :
+    reviews : iterable
+        token lists, or strings which are split on whitespace
+    vocabulary : dict, optional
+        token to id mapping to extend, a new one is made if not given
+    Returns
+    -------
+    tuple
+        (token ids, review index of each token, vocabulary), the first two as
+        flat int64 arrays and the vocabulary as a dict of token to id
+    """
+    vocabulary = {} if vocabulary is None else vocabulary
+    token_ids = []
+    review_index = []
+
+    for index, tokens in enumerate(reviews):
+        if isinstance(tokens, str):
+            tokens = tokens.split()
+        token_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+        review_index.extend([index] * len(tokens))
+
+    return np.asarray(token_ids, dtype=np.int64), np.asarray(review_index, dtype=np.int64), vocabulary
+
+
+def count_ngrams(token_ids, review_index, nb_elements, vocabulary_size):
+    """
+    Count the n-grams of encoded reviews, n-grams never span two reviews
+    Parameters
+    ----------
+    token_ids : ndarray
+        token ids from encode_reviews
+    review_index : ndarray
+        review index of each token from encode_reviews
+    nb_elements : int
         number of elements in the n-gram
+    vocabulary_size : int
+        number of distinct token ids
     Returns
     -------
-    Generator
-        generator of all n-grams
+    tuple
+        (n-grams, counts), the n-grams as an array of token ids with one row per
+        distinct n-gram and nb_elements columns
     """
-    ngrams = zip(*[token_list[index_token:] for index_token in range(nb_elements)])
-    return (" ".join(ngram) for ngram in ngrams)
+    if nb_elements < 1:
+        raise ValueError("number of n-grams should be >= 1")
 
+    windows = len(token_ids) - nb_elements + 1
+    if windows <= 0:
+        return np.empty((0, nb_elements), dtype=np.int64), np.empty(0, dtype=np.int64)
 
-def frequent_words(list_words, ngrams_number=1, number_top_words=10):
+    # an n-gram starting at i stays in one review when its first and last token are in the same one
+    starts = np.flatnonzero(review_index[:windows] == review_index[nb_elements - 1:])
+    columns = [token_ids[starts + offset] for offset in range(nb_elements)]
+
+    if vocabulary_size ** nb_elements < 2 ** 63:
+        # each n-gram as one int64 in base vocabulary_size, so np.unique sorts flat integers
+        keys = np.zeros(len(starts), dtype=np.int64)
+        for column in columns:
+            keys = keys * vocabulary_size + column
+        keys, counts = np.unique(keys, return_counts=True)
+
+        ngrams = np.empty((len(keys), nb_elements), dtype=np.int64)
+        for offset in range(nb_elements - 1, -1, -1):
+            keys, ngrams[:, offset] = np.divmod(keys, vocabulary_size)
+        return ngrams, counts
+
+    # too many combinations to fit in an int64, compare the rows instead
+    return np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+
+
+def top_ngrams(ngrams, counts, vocabulary, number_top_words=10):
     """
-    Create n-grams for list of tokens
+    Most frequent n-grams as strings
     Parameters
     ----------
-    ngrams_number : int
+    ngrams : ndarray
+        n-grams from count_ngrams
+    counts : ndarray
+        counts from count_ngrams
+    vocabulary : dict
+        token to id mapping the n-grams were encoded with
     number_top_words : int
-        output dataframe length
+        output list length
     Returns
     -------
-    DataFrame
-        Dataframe with the entities and their frequencies.
+    list
+        (n-gram, frequency) tuples, most frequent first
     """
-    frequent = []
-    if ngrams_number == 1:
-        pass
-    elif ngrams_number >= 2:
-        list_words = create_ngrams(list_words, ngrams_number)
+    if len(counts) > number_top_words:
+        top = np.argpartition(-counts, number_top_words - 1)[:number_top_words]
     else:
-        raise ValueError("number of n-grams should be >= 1")
-    counter = Counter(list_words)
-    frequent = counter.most_common(number_top_words)
+        top = np.arange(len(counts))
+    # most frequent first, ties in n-gram order
+    top = top[np.lexsort((top, -counts[top]))]
+
+    tokens = np.array(list(vocabulary), dtype=object)
+    return [(" ".join(tokens[ngrams[index]]), int(counts[index])) for index in top]
+
+
+def frequent_ngrams(reviews, ngrams_number=1, number_top_words=10, groups=None):
+    """
+    Most frequent n-grams of several reviews, overall or per group
+    Parameters
+    ----------
+    reviews : iterable
+        token lists, or strings which are split on whitespace
+    ngrams_number : int
+    number_top_words : int
+        output list length
+    groups : array-like, optional
+        a label per review, e.g. its sentiment or asin, to get the top n-grams of each label
+    Returns
+    -------
+    list or dict
+        (n-gram, frequency) tuples, or a dict of them per label when groups is given
+    """
+    token_ids, review_index, vocabulary = encode_reviews(reviews)
+
+    if groups is None:
+        ngrams, counts = count_ngrams(token_ids, review_index, ngrams_number, len(vocabulary))
+        return top_ngrams(ngrams, counts, vocabulary, number_top_words)
+
+    labels, group_codes = np.unique(np.asarray(groups), return_inverse=True)
+    token_groups = group_codes[review_index]
+
+    frequent = {}
+    for code, label in enumerate(labels.tolist()):
+        in_group = token_groups == code
+        ngrams, counts = count_ngrams(token_ids[in_group], review_index[in_group], ngrams_number, len(vocabulary))
+        frequent[label] = top_ngrams(ngrams, counts, vocabulary, number_top_words)
     return frequent
 
 
+def frequent_words(list_words, ngrams_number=1, number_top_words=10):
+    """
+    Most frequent n-grams of a list of tokens
+    Parameters
+    ----------
+    list_words : list
+        list of strings, or a list of token lists to keep n-grams within each review
+    ngrams_number : int
+    number_top_words : int
+        output list length
+    Returns
+    -------
+    list
+        (n-gram, frequency) tuples, most frequent first
+    """
+    if list_words and not isinstance(list_words[0], str):
+        return frequent_ngrams(list_words, ngrams_number, number_top_words)
+    return frequent_ngrams([list_words], ngrams_number, number_top_words)
+
+
 def make_word_cloud(text_or_counter, stop_words=None):
     if isinstance(text_or_counter, str):
         word_cloud = wordcloud.WordCloud(stopwords=stop_words).generate(text_or_counter)